@@ -0,0 +1,175 @@
+"""Компактный учет активности пользователей.
+
+Вместо списка datetime на каждое сообщение у пользователя хранится пара
+(последний час, битовая маска): бит i означает, что пользователь заходил за i
+часов до последнего. Маска держит HISTORY_HOURS часов (10 суток), поэтому
+запись о пользователе не растет, а отметка визита — это сдвиг и OR, без
+перебора старых визитов.
+
+Уникальные пользователи за сутки считаются HyperLogLog-ом: 4096 однобайтных
+регистров (~1.6% погрешности) на день, сколько бы человек ни зашло. При общем
+хранилище (Redis) вместо него работает HyperLogLog самого Redis
+(storage.SharedUniques) с тем же интерфейсом, что у DailyUniques.
+
+Для отчетов "за последние 24 часа" счетчики ведутся по часам прямо при записи
+(HourlyCounters): отчет складывает 24 числа и не перебирает историю.
+"""
+
+import hashlib
+import math
+import time
+from datetime import datetime, timedelta
+
+HISTORY_HOURS = 10 * 24
+HISTORY_MASK = (1 << HISTORY_HOURS) - 1
+
+
+def current_hour(timestamp=None):
+    """Номер часа с начала эпохи"""
+    return int((time.time() if timestamp is None else timestamp) // 3600)
+
+
+# ---------- Часы активности одного пользователя ----------
+
+
+def mark_hour(activity, hour):
+    """Новая запись (последний час, маска) с отмеченным часом hour"""
+    if activity is None:
+        return (hour, 1)
+    last_hour, bits = activity
+    if hour > last_hour:
+        return (hour, ((bits << (hour - last_hour)) | 1) & HISTORY_MASK)
+    # Визит "из прошлого" (часы сервера сдвинулись) — ставим бит на своем месте
+    age = last_hour - hour
+    if age < HISTORY_HOURS:
+        bits |= 1 << age
+    return (last_hour, bits)
+
+
+def from_visits(visits):
+    """Запись активности из старого списка datetime"""
+    activity = None
+    for visit in sorted(visits):
+        activity = mark_hour(activity, current_hour(visit.timestamp()))
+    return activity
+
+
+def coerce(value):
+    """Запись активности из того, что лежит в хранилище (старые данные — списки)"""
+    if isinstance(value, list):
+        return from_visits(value)
+    return value
+
+
+# ---------- Уникальные за день ----------
+
+
+class HyperLogLog:
+    """Оценка числа различных элементов по 2^precision регистрам"""
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item):
+        """Добавляет элемент; True, если регистры изменились (стоит сохранить)"""
+        digest = hashlib.blake2b(str(item).encode(), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        # Позиция первой единицы в оставшихся битах
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Мало элементов — точнее линейный счет по пустым регистрам
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+def day_key(now=None):
+    return (now or datetime.now()).strftime("%Y-%m-%d")
+
+
+class DailyUniques:
+    """HyperLogLog на каждый день поверх словаря хранилища (память, SQLite)"""
+
+    def __init__(self, storage, keep_days=30):
+        self.storage = storage  # "2024-05-01": HyperLogLog
+        self.keep_days = keep_days
+
+    def add(self, day, item):
+        uniques = self.storage.get(day)
+        if uniques is None:
+            uniques = HyperLogLog()
+            # Новый день — заодно выбрасываем слишком старые
+            cutoff = day_key(datetime.strptime(day, "%Y-%m-%d") - timedelta(days=self.keep_days))
+            for old_day in [d for d in self.storage if d < cutoff]:
+                self.storage.pop(old_day, None)
+        # Регистры меняются редко, и только тогда день нужно сохранить
+        if uniques.add(item):
+            self.storage[day] = uniques
+
+    def count(self, day):
+        uniques = self.storage.get(day)
+        return uniques.count() if uniques is not None else 0
+
+
+# ---------- Счетчики по часам ----------
+
+
+class HourlyCounters:
+    """Счетчики событий по часам поверх словаря хранилища с incr().
+
+    Ключи — строки "имя:час", чтобы одинаково жить в памяти, SQLite и Redis.
+    Часы старше keep_hours выбрасываются раз в час.
+    """
+
+    def __init__(self, storage, keep_hours=HISTORY_HOURS):
+        self.storage = storage
+        self.keep_hours = keep_hours
+        self._pruned_hour = None
+
+    def add(self, name, hour, amount=1):
+        self.storage.incr(f"{name}:{hour}", amount)
+        if self._pruned_hour is None or hour > self._pruned_hour:
+            self._pruned_hour = hour
+            self._prune(hour)
+
+    def total(self, name, hours, now_hour=None):
+        """Сумма за последние hours часов, включая текущий"""
+        now_hour = current_hour() if now_hour is None else now_hour
+        get = self.storage.get
+        return sum(get(f"{name}:{hour}", 0) for hour in range(now_hour - hours + 1, now_hour + 1))
+
+    def _prune(self, now_hour):
+        oldest = now_hour - self.keep_hours
+        for key in list(self.storage):
+            if int(key.rsplit(":", 1)[1]) < oldest:
+                self.storage.pop(key, None)
+
+
+def track_last_seen(counters, previous, current):
+    """Переносит пользователя в счетчике "last_seen" в час его последнего визита.
+
+    В каждом часе счетчик — число пользователей, чей последний визит пришелся на
+    этот час, поэтому уникальные за N часов — это просто сумма N счетчиков.
+    """
+    last_hour = current[0]
+    if previous is not None:
+        if previous[0] == last_hour:
+            return
+        # Совсем старые часы уже выброшены — вычитать не из чего
+        if previous[0] > last_hour - counters.keep_hours:
+            counters.add("last_seen", previous[0], -1)
+    counters.add("last_seen", last_hour)
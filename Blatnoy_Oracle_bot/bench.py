@@ -0,0 +1,474 @@
+"""Бенчмарки горячих мест бота.
+
+Запуск: python bench.py games [--count 100000]
+        python bench.py hands
+        python bench.py deal [--decks 6] [--rng pcg32]
+        python bench.py keywords [--count 10000]
+        python bench.py send [--threads 8] [--count 200] [--latency 0.005]
+        python bench.py markup
+        python bench.py metrics [--threads 4]
+"""
+
+import argparse
+import os
+import random
+import threading
+import time
+import timeit
+import tracemalloc
+
+import requests
+import telebot
+from telebot import apihelper, types
+
+from cards import Hand, Shoe, card_deck, new_hand
+from games import DuelGame, SoloGame
+import keyboards
+from corpus import load_corpus
+from matcher import KeywordMatcher
+from metrics import MetricsRegistry
+from rng import DEFAULT_PROVIDER, PROVIDERS
+from stub_api import StubServer
+from transport import TelegramTransport, percentile
+
+
+def legacy_solo_game():
+    """Раунд в старом виде: словарь со списками строк"""
+    return {
+        "player_hand": [random.choice(card_deck), random.choice(card_deck)],
+        "dealer_hand": [random.choice(card_deck), random.choice(card_deck)],
+        "game_state": "player_turn",
+    }
+
+
+def legacy_duel_game(player1_id, player2_id):
+    """Мультиплеерная игра в старом виде"""
+    player1_hand = [random.choice(card_deck), random.choice(card_deck)]
+    player2_hand = [random.choice(card_deck), random.choice(card_deck)]
+    return {
+        "player1_id": player1_id,
+        "player2_id": player2_id,
+        "player1_name": "фраерок",
+        "player2_name": "фраерок",
+        "bet": "пиво",
+        "player1_hand": player1_hand,
+        "player2_hand": player2_hand,
+        "current_turn": player1_id,
+        "player1_score": 0,
+        "player2_score": 0,
+        "player1_stand": False,
+        "player2_stand": False,
+        "game_state": "active",
+        "round_number": 1,
+    }
+
+
+# Башмаки хранятся отдельно от партий (user_shoes, duel_shoes), поэтому в замер
+# памяти не входят, как и в старых словарях, где карты брались из общей колоды
+SHOE = Shoe()
+
+
+def solo_game():
+    if SHOE.needs_shuffle:
+        SHOE.shuffle()
+    return SoloGame(player_hand=new_hand(SHOE), dealer_hand=new_hand(SHOE))
+
+
+def duel_game(player1_id, player2_id):
+    if SHOE.needs_shuffle:
+        SHOE.shuffle()
+    player1_hand = new_hand(SHOE)
+    player2_hand = new_hand(SHOE)
+    return DuelGame(
+        player1_id=player1_id,
+        player2_id=player2_id,
+        player1_name="фраерок",
+        player2_name="фраерок",
+        bet="пиво",
+        player1_hand=player1_hand,
+        player2_hand=player2_hand,
+        current_turn=player1_id,
+        player1_score=player1_hand.value,
+        player2_score=player2_hand.value,
+    )
+
+
+def bytes_per_game(factory, count):
+    """Сколько байт памяти занимает одна игра, если держать count игр одновременно"""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    games = [factory(user_id) for user_id in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(games) == count
+    return (after - before) / count
+
+
+def bench_games(args):
+    count = args.count
+    rows = [
+        ("solo", lambda _: legacy_solo_game(), lambda _: solo_game()),
+        (
+            "duel",
+            lambda uid: legacy_duel_game(uid, uid + 1),
+            lambda uid: duel_game(uid, uid + 1),
+        ),
+    ]
+    print(f"Память на {count} одновременных игр")
+    for name, legacy, compact in rows:
+        legacy_size = bytes_per_game(legacy, count)
+        compact_size = bytes_per_game(compact, count)
+        print(
+            f"  {name}: dict {legacy_size:.0f} Б/игру, "
+            f"__slots__ {compact_size:.0f} Б/игру, "
+            f"в {legacy_size / compact_size:.1f} раза меньше"
+        )
+
+    # Доступ к полям, как в handle_multiplayer_action
+    legacy = legacy_duel_game(1, 2)
+    compact = duel_game(1, 2)
+    number = 1_000_000
+    legacy_time = timeit.timeit(
+        lambda: legacy["player1_stand"] and legacy["player2_stand"]
+        or legacy["player1_score"] > 21,
+        number=number,
+    )
+    compact_time = timeit.timeit(
+        lambda: compact.player1_stand and compact.player2_stand
+        or compact.player1_score > 21,
+        number=number,
+    )
+    print(
+        f"Проверка конца раунда: dict {legacy_time / number * 1e9:.0f} нс, "
+        f"__slots__ {compact_time / number * 1e9:.0f} нс"
+    )
+
+
+def legacy_card_value(card):
+    """Старый подсчет очков карты по строке"""
+    if card[0] in ["2", "3", "4", "5", "6", "7", "8", "9"]:
+        return int(card[0])
+    elif card.startswith("10"):
+        return 10
+    elif card[0] in ["В", "Д", "К"]:
+        return 10
+    elif card[0] == "Т":
+        return 11
+    return 0
+
+
+def legacy_hand_value(hand):
+    """Старый подсчет очков руки: полный проход по картам на каждый вызов"""
+    total = 0
+    aces = 0
+    for card in hand:
+        if card[0] == "Т":
+            aces += 1
+            total += 11
+        else:
+            total += legacy_card_value(card)
+    while total > 21 and aces > 0:
+        total -= 10
+        aces -= 1
+    return total
+
+
+def bench_hands(args):
+    # Типичный ход: к руке из двух-трех карт добавляется карта и пересчитываются очки
+    deals = [[random.randrange(len(card_deck)) for _ in range(4)] for _ in range(10_000)]
+
+    def legacy_round():
+        for cards in deals:
+            hand = [card_deck[cards[0]], card_deck[cards[1]]]
+            legacy_hand_value(hand)
+            for card in cards[2:]:
+                hand.append(card_deck[card])
+                legacy_hand_value(hand)
+
+    def table_round():
+        for cards in deals:
+            hand = Hand(cards[:2])
+            hand.value
+            for card in cards[2:]:
+                hand.add(card)
+                hand.value
+
+    for name, fn in (("строки + пересчет", legacy_round), ("таблицы + Hand", table_round)):
+        seconds = min(timeit.repeat(fn, number=5, repeat=3)) / 5
+        print(f"  {name}: {seconds / len(deals) * 1e9:.0f} нс на раздачу из 4 карт")
+
+
+def bench_deal(args):
+    # Старая раздача: отдельный вызов генератора на каждую карту, с возвратом
+    number = 1_000_000
+    randrange = random.randrange
+    size = len(card_deck)
+    legacy_time = min(timeit.repeat(lambda: randrange(size), number=number, repeat=3))
+    # Башмак: тасовка раз на колоду, сама раздача — сдвиг индекса
+    shoe = Shoe(args.decks, rng=args.rng)
+    shoe_time = min(timeit.repeat(shoe.deal, number=number, repeat=3))
+    shuffles = 2000
+    shuffle_time = min(timeit.repeat(shoe.shuffle, number=shuffles, repeat=3)) / shuffles
+    print(f"random.randrange: {legacy_time / number * 1e9:.0f} нс на карту")
+    print(
+        f"Shoe({args.decks}, {args.rng}).deal: {shoe_time / number * 1e9:.0f} нс на карту с учетом тасовок, "
+        f"тасовка {shuffle_time * 1e6:.1f} мкс "
+        f"({shuffle_time / len(shoe.cards) * 1e9:.0f} нс на карту)"
+    )
+
+
+KEYWORDS = ("когда", "почему", "как", "кто", "куда", "кого", "ты", "вы")
+# Формы ключей, которые точное сравнение пропускает
+KEYWORD_FORMS = ("когда-нибудь", "почему-то", "кому", "кем", "вам", "вас", "куда-то")
+FILLER = (
+    "а", "мне", "стоит", "ли", "брать", "кредит", "на", "машину", "если", "жена",
+    "против", "и", "что", "будет", "с", "работой", "завтра", "пацаны", "говорят",
+    "надо", "ехать", "в", "город", "или", "остаться", "дома", "скажи", "честно",
+    "братан", "деньги", "вернут", "этот", "раз", "мусора", "приедут", "сегодня",
+)
+
+
+def question_corpus(count, seed=1):
+    """Вопросы обычной длины: 4–25 слов, в части из них есть ключи (и с пунктуацией)"""
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        words = rng.choices(FILLER, k=rng.randint(4, 25))
+        for _ in range(rng.choice((0, 0, 1, 1, 1, 2))):
+            keyword = rng.choice(KEYWORDS if rng.random() < 0.8 else KEYWORD_FORMS)
+            if rng.random() < 0.2:
+                keyword = keyword.capitalize() + rng.choice("?,")
+            words.insert(rng.randrange(len(words) + 1), keyword)
+        questions.append(" ".join(words) + rng.choice(("?", "", " ?")))
+    return questions
+
+
+def legacy_keyword(question, keywords=KEYWORDS):
+    """Старый выбор ключа из get_response_by_keywords: три проверки на каждый ключ"""
+    question_lower = question.lower()
+    if "ты" in question_lower:
+        if (
+            " ты " in f" {question_lower} "
+            or question_lower.startswith("ты ")
+            or question_lower.endswith(" ты")
+        ):
+            return "ты"
+    found_keywords = []
+    for keyword in keywords:
+        if (
+            f" {keyword} " in f" {question_lower} "
+            or question_lower.startswith(f"{keyword} ")
+            or question_lower.endswith(f" {keyword}")
+        ):
+            found_keywords.append(keyword)
+    if len(found_keywords) == 1:
+        return found_keywords[0]
+    return None
+
+
+def bench_keywords(args):
+    questions = question_corpus(args.count)
+    matcher = KeywordMatcher(KEYWORDS, priority=("ты",))
+    # Сначала — что ответы совпадают со старой логикой на всем корпусе
+    mismatches = [q for q in questions if legacy_keyword(q) != matcher.find(q.lower())]
+    assert not mismatches, mismatches[:5]
+
+    def legacy_pass():
+        for question in questions:
+            legacy_keyword(question)
+
+    def matcher_pass():
+        find = matcher.find
+        for question in questions:
+            find(question.lower())
+
+    # Нормализация с леммами из корпуса бота
+    corpus = load_corpus(os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.json"))
+
+    def normalized_pass():
+        keyword = corpus.keyword
+        for question in questions:
+            keyword(question)
+
+    average = sum(len(q) for q in questions) / len(questions)
+    print(f"{len(questions)} вопросов, в среднем {average:.0f} символов, ответы совпадают")
+    exact = sum(matcher.find(q.lower()) is not None for q in questions)
+    normalized = sum(corpus.keyword(q) is not None for q in questions)
+    # Нормализация только добавляет ответы по ключу, найденные раньше не меняет
+    changed = [
+        q for q in questions
+        if matcher.find(q.lower()) is not None and corpus.keyword(q) != matcher.find(q.lower())
+    ]
+    assert not changed, changed[:5]
+    print(f"  ответ по ключу: точное совпадение {exact}, с нормализацией {normalized}")
+    for name, fn in (
+        ("цикл по ключам", legacy_pass),
+        ("одна регулярка", matcher_pass),
+        ("нормализация + регулярка", normalized_pass),
+    ):
+        seconds = min(timeit.repeat(fn, number=3, repeat=3)) / 3
+        print(f"  {name}: {seconds / len(questions) * 1e9:.0f} нс на вопрос")
+
+
+def bench_send(args):
+    """sendMessage из нескольких потоков в заглушку API при разных транспортах"""
+    server = StubServer(latency=args.latency)
+    apihelper.API_URL = server.start() + "/bot{0}/{1}"
+    bot = telebot.TeleBot("1:bench", threaded=False)
+
+    def no_keep_alive(method, url, **kwargs):
+        # Новое соединение на каждый запрос
+        return requests.request(method, url, headers={"Connection": "close"}, **kwargs)
+
+    modes = (
+        ("без keep-alive", no_keep_alive),
+        ("сессия на поток (telebot)", None),
+        (f"общий пул на {args.threads}", TelegramTransport(pool_size=args.threads).request),
+    )
+    for name, sender in modes:
+        apihelper.CUSTOM_REQUEST_SENDER = sender
+        server.connections = 0
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(chat_id):
+            mine = []
+            for i in range(args.count):
+                started = time.perf_counter()
+                bot.send_message(chat_id, f"сообщение {i}")
+                mine.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(mine)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        print(
+            f"  {name}: {len(latencies) / elapsed:.0f} запросов/с, "
+            f"p50 {percentile(latencies, 0.5) * 1000:.2f} мс, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.2f} мс, "
+            f"соединений {server.connections}"
+        )
+    apihelper.CUSTOM_REQUEST_SENDER = None
+    server.shutdown()
+
+
+def legacy_game_actions():
+    """Клавиатура хода, как ее собирали на каждую отрисовку"""
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    btn_hit = types.InlineKeyboardButton("Давай карту", callback_data="hit")
+    btn_stand = types.InlineKeyboardButton("Хватит", callback_data="stand")
+    btn_surrender = types.InlineKeyboardButton("Сдаюсь", callback_data="surrender")
+    markup.add(btn_hit, btn_stand, btn_surrender)
+    return markup
+
+
+def legacy_multiplayer_turn(game_id):
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    btn_hit = types.InlineKeyboardButton("Давай карту", callback_data=f"multi_hit_{game_id}")
+    btn_stand = types.InlineKeyboardButton("Хватит", callback_data=f"multi_stand_{game_id}")
+    markup.add(btn_hit, btn_stand)
+    return markup
+
+
+def bench_markup(args):
+    """Сборка и сериализация клавиатуры на отрисовку: каждый раз против готовой"""
+    # telebot сериализует разметку при каждой отправке — считаем и это
+    assert legacy_game_actions().to_json() == keyboards.GAME_ACTIONS.to_json()
+    assert legacy_multiplayer_turn("g1").to_json() == keyboards.multiplayer_turn("g1").to_json()
+    number = 20_000
+    for name, fn in (
+        ("ход: сборка каждый раз", lambda: legacy_game_actions().to_json()),
+        ("ход: готовая", lambda: keyboards.GAME_ACTIONS.to_json()),
+        ("мультиплеер: сборка каждый раз", lambda: legacy_multiplayer_turn("game_7").to_json()),
+        ("мультиплеер: кеш по game_id", lambda: keyboards.multiplayer_turn("game_7").to_json()),
+    ):
+        seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+        print(f"  {name}: {seconds * 1e6:.2f} мкс")
+
+
+def bench_metrics(args):
+    """Запись метрик в шарды потоков против общего словаря под блокировкой"""
+    registry = MetricsRegistry()
+    calls = registry.counter("calls_total", "", ("handler",))
+    seconds = registry.histogram("handler_seconds", "", ("handler",))
+    lock = threading.Lock()
+    shared = {}
+
+    def locked_inc():
+        with lock:
+            shared["game_callback"] = shared.get("game_callback", 0) + 1
+
+    number = 200_000
+    for name, fn in (
+        ("счетчик: общий под блокировкой", lambda: locked_inc()),
+        ("счетчик: шард потока", lambda: calls.inc("game_callback")),
+        ("гистограмма: шард потока", lambda: seconds.observe(0.003, "game_callback")),
+    ):
+        seconds_per_op = min(timeit.repeat(fn, number=number, repeat=3)) / number
+        print(f"  {name}: {seconds_per_op * 1e9:.0f} нс")
+
+    def hammer(fn):
+        threads = [
+            threading.Thread(target=lambda: [fn() for _ in range(number)])
+            for _ in range(args.threads)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    print(f"  {args.threads} потоков по {number}:")
+    print(f"    общий под блокировкой: {hammer(locked_inc):.2f} с")
+    print(f"    шарды потоков: {hammer(lambda: calls.inc('game_callback')):.2f} с")
+    started = time.perf_counter()
+    registry.collect()
+    print(f"  сбор /metrics: {(time.perf_counter() - started) * 1000:.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки блатного оракула")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    games = commands.add_parser("games", help="память и доступ к полям игр")
+    games.add_argument("--count", type=int, default=100_000)
+    games.set_defaults(func=bench_games)
+
+    hands = commands.add_parser("hands", help="подсчет очков руки")
+    hands.set_defaults(func=bench_hands)
+
+    deal = commands.add_parser("deal", help="раздача из башмака против randrange")
+    deal.add_argument("--decks", type=int, default=1)
+    deal.add_argument("--rng", choices=sorted(PROVIDERS), default=DEFAULT_PROVIDER)
+    deal.set_defaults(func=bench_deal)
+
+    keywords = commands.add_parser("keywords", help="поиск ключевых слов в вопросе")
+    keywords.add_argument("--count", type=int, default=10_000)
+    keywords.set_defaults(func=bench_keywords)
+
+    send = commands.add_parser("send", help="отправка в заглушку API: пул против сессий")
+    send.add_argument("--threads", type=int, default=8)
+    send.add_argument("--count", type=int, default=200, help="сообщений на поток")
+    send.add_argument("--latency", type=float, default=0.005, help="задержка заглушки, с")
+    send.set_defaults(func=bench_send)
+
+    markup = commands.add_parser("markup", help="клавиатуры: сборка против готовых")
+    markup.set_defaults(func=bench_markup)
+
+    metrics = commands.add_parser("metrics", help="запись метрик: шарды против блокировки")
+    metrics.add_argument("--threads", type=int, default=4)
+    metrics.set_defaults(func=bench_metrics)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,40 @@
 import os
+import hmac
+import html
 import random
+import re
 import time
 import telebot
 from telebot import types
+from telebot.handler_backends import RedisHandlerBackend
 from flask import Flask, request
 import threading
 from datetime import datetime, timedelta
+from urllib.parse import urlparse
 import schedule
-from collections import defaultdict
+from dispatcher import ChatDispatcher
+from storage import open_store
+from cards import CARD_NAMES, Shoe, get_hand_display, new_hand, replay_shoe
+from games import DuelGame, SoloGame
+import keyboards
+import activity
+from history import TournamentHistory
+from leaderboard import StatsEngine
+from corpus import CorpusError, ReloadableCorpus
+from ttlcache import TTLCache
+from outbound import PRIORITY_BACKGROUND, OutboundGateway
+from deadletter import DEFAULT_PATH as DEAD_LETTER_DEFAULT_PATH, DeadLetterLog
+from transport import TelegramTransport
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, instrument
+from rng import DEFAULT_PROVIDER, PROVIDERS
+from rules import (
+    TOURNAMENT_TARGET,
+    dealer_should_hit,
+    is_bust,
+    round_outcome,
+    round_points,
+    tournament_winner,
+)
 
 # ======================= ИНИЦИАЛИЗАЦИЯ БОТА И FLASK =======================
 
@@ -20,31 +47,258 @@ if not TOKEN:
 # ID администратора для отправки уведомлений (замени на свой)
 ADMIN_ID = 585578360  # Здесь твой ID из кода
 
-# Создаем бота
-bot = telebot.TeleBot(TOKEN)
+# Режим получения апдейтов: "polling" (getUpdates) или "webhook" (Telegram сам шлет апдейты во Flask)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Публичный адрес сервиса, например https://xxx.onrender.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет обязателен: без него любой, кто знает адрес, может слать боту поддельные апдейты
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError("BOT_MODE должен быть polling или webhook")
+if BOT_MODE == "webhook":
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise ValueError("В режиме webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+    # Ограничения Telegram для secret_token в setWebhook
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+        raise ValueError("WEBHOOK_SECRET: 1-256 символов из A-Z, a-z, 0-9, _ и -")
+
+# Хранилище состояния: STATE_BACKEND=memory (по умолчанию), sqlite (переживает рестарт)
+# или redis (общее состояние для нескольких реплик бота)
+store = open_store()
+
+# Пул воркеров для апдейтов: очередь ограничена, чтобы всплеск не съел всю память
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "4"))
+
+# Исходящие сообщения: общий лимит бота ~30/с и ~1/с на чат с небольшим запасом на всплеск
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_SENDERS = int(os.getenv("OUTBOUND_SENDERS", "4"))
+# Повторы при сбоях сети и 5xx: пауза 1, 2, 4... секунды, не больше OUTBOUND_BACKOFF_MAX
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "5"))
+OUTBOUND_BACKOFF_BASE = float(os.getenv("OUTBOUND_BACKOFF_BASE", "1"))
+OUTBOUND_BACKOFF_MAX = float(os.getenv("OUTBOUND_BACKOFF_MAX", "60"))
+# Сколько раз запрос ждет retry_after после ответа 429, прежде чем сдаться
+OUTBOUND_MAX_RATE_LIMITS = int(os.getenv("OUTBOUND_MAX_RATE_LIMITS", "10"))
+# Недоставленные сообщения (переотправка: python deadletter.py)
+DEAD_LETTER_PATH = os.getenv("DEAD_LETTER_PATH", DEAD_LETTER_DEFAULT_PATH)
+# Сколько последних сообщений помнить, чтобы не слать правки без изменений (0 — не помнить)
+EDIT_CACHE_SIZE = int(os.getenv("EDIT_CACHE_SIZE", "10000"))
+
+# HTTP к Telegram: одна сессия с keep-alive на все потоки. В API ходят отправители
+# очереди и поток поллинга (плюс запас на setWebhook и next-step), отсюда размер пула
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", str(OUTBOUND_SENDERS + 2)))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+# Другой адрес Bot API, например локальная заглушка: TELEGRAM_API_URL=http://127.0.0.1:8081
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# История турниров: сегменты на диске, в памяти — только последние HISTORY_RECENT записей.
+# Сегменты старше HISTORY_RETENTION_DAYS удаляются при ночном сжатии (0 — хранить все)
+HISTORY_DIR = os.getenv(
+    "HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history")
+)
+HISTORY_SEGMENT_BYTES = int(os.getenv("HISTORY_SEGMENT_BYTES", str(1 << 20)))
+HISTORY_RECENT = int(os.getenv("HISTORY_RECENT", "200"))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "0"))
+
+# Башмак: сколько колод и какую долю карт сдать до перетасовки
+SHOE_DECKS = int(os.getenv("SHOE_DECKS", "1"))
+SHOE_PENETRATION = float(os.getenv("SHOE_PENETRATION", "0.75"))
+# Файл с текстами оракула и как часто проверять его изменения (0 — не следить)
+CORPUS_PATH = os.getenv(
+    "CORPUS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.json")
+)
+CORPUS_WATCH_INTERVAL = float(os.getenv("CORPUS_WATCH_INTERVAL", "5"))
+# Повтор того же вопроса в чате в течение ANSWER_CACHE_TTL секунд получает тот же
+# ответ одним сообщением (0 — отключить)
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "60"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "10000"))
+# Как отвечает оракул: compact — обращение, ответ и кнопки одним сообщением,
+# dramatic — по-старому: обращение, "печатает...", пауза, ответ, отдельный вопрос с кнопками
+REPLY_STYLE = os.getenv("REPLY_STYLE", "compact").lower()
+if REPLY_STYLE not in ("compact", "dramatic"):
+    raise ValueError("REPLY_STYLE должен быть compact или dramatic")
+# Генератор для тасовки: shake128 (быстрый, по умолчанию), mersenne (random.Random) или pcg32
+RNG_PROVIDER = os.getenv("RNG_PROVIDER", DEFAULT_PROVIDER).lower()
+if RNG_PROVIDER not in PROVIDERS:
+    raise ValueError(f"RNG_PROVIDER должен быть одним из: {', '.join(PROVIDERS)}")
+
+# Метрики для /metrics: пишутся в шард своего потока, складываются при сборе
+metrics = MetricsRegistry()
+handler_calls = metrics.counter(
+    "oracle_handler_calls_total", "Вызовы обработчиков апдейтов", ("handler",)
+)
+handler_errors = metrics.counter(
+    "oracle_handler_errors_total", "Обработчики, завершившиеся исключением", ("handler",)
+)
+handler_seconds = metrics.histogram(
+    "oracle_handler_seconds", "Время работы обработчика", ("handler",)
+)
+
+# Каждый апдейт обрабатывается как единица работы хранилища
+dispatcher = ChatDispatcher(
+    workers=UPDATE_WORKERS,
+    max_pending=UPDATE_QUEUE_SIZE,
+    task_context=store.unit_of_work,
+)
+
+
+def get_update_chat_id(update):
+    """Ключ очереди для апдейта: чат, из которого он пришел"""
+    message = update.message or update.edited_message
+    if message:
+        return message.chat.id
+    call = update.callback_query
+    if call:
+        return call.message.chat.id if call.message else call.from_user.id
+    # Прочие апдейты нам не важны по порядку — раскидываем их по ID
+    return update.update_id
+
+
+def dispatch_update(update, block=True):
+    """Отдает апдейт в пул воркеров, сохраняя порядок внутри чата"""
+    return dispatcher.submit(
+        get_update_chat_id(update),
+        telebot.TeleBot.process_new_updates,
+        bot,
+        [update],
+        block=block,
+    )
+
+
+class DispatchingTeleBot(telebot.TeleBot):
+    """TeleBot, который обрабатывает апдейты в пуле диспетчера, а не в потоке поллинга"""
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # Смещение для getUpdates двигаем сразу, не дожидаясь обработки
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            dispatch_update(update)
+
+    # Замер обработчиков: команды и колбэки оборачиваются при регистрации,
+    # next-step обработчики (process_question и т.п.) — при вызове, потому что
+    # с Redis они хранятся по имени и обертку туда не положить
+    @staticmethod
+    def _build_handler_dict(handler, pass_bot=False, **filters):
+        return telebot.TeleBot._build_handler_dict(
+            instrument(handler, handler_calls, handler_errors, handler_seconds),
+            pass_bot,
+            **filters,
+        )
+
+    def _exec_task(self, task, *args, **kwargs):
+        if getattr(task, "__self__", None) is not self:
+            task = instrument(task, handler_calls, handler_errors, handler_seconds)
+        super()._exec_task(task, *args, **kwargs)
+
+
+def create_next_step_backend():
+    """Хранилище next-step обработчиков: при общем состоянии они тоже должны быть общими,
+    иначе ответ на "Выкладывай, че там?" может прийти в другую реплику"""
+    if not store.shared:
+        return None
+    url = urlparse(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return RedisHandlerBackend(
+        host=url.hostname or "localhost",
+        port=url.port or 6379,
+        db=int(url.path.lstrip("/") or 0),
+        prefix="oracle:next_step",
+        password=url.password,
+    )
+
+
+transport = TelegramTransport(
+    pool_size=HTTP_POOL_SIZE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    api_url=TELEGRAM_API_URL or None,
+    metrics=metrics,
+).install()
+
+# Создаем бота (обработчики крутятся в воркерах диспетчера, собственный пул telebot не нужен)
+bot = DispatchingTeleBot(
+    TOKEN, threaded=False, next_step_backend=create_next_step_backend()
+)
+
+# Все исходящие сообщения идут через очередь с лимитами Telegram, обработчики не ждут сети
+outbound = OutboundGateway(
+    bot,
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    senders=OUTBOUND_SENDERS,
+    max_attempts=OUTBOUND_MAX_ATTEMPTS,
+    max_rate_limits=OUTBOUND_MAX_RATE_LIMITS,
+    backoff_base=OUTBOUND_BACKOFF_BASE,
+    backoff_max=OUTBOUND_BACKOFF_MAX,
+    dead_letters=DeadLetterLog(DEAD_LETTER_PATH),
+    # Через двое суток сообщение вряд ли будут править — запись можно забыть
+    rendered=TTLCache(EDIT_CACHE_SIZE, ttl=2 * 24 * 3600) if EDIT_CACHE_SIZE else None,
+)
 
 # Создаем Flask приложение
 app = Flask(__name__)
 
 # ======================= НОВЫЕ СТРУКТУРЫ ДАННЫХ =======================
 
+# Словари с изменяемыми значениями (игры, приглашения) создаются с track_reads=True:
+# значение могли поменять на месте, поэтому сохраняем каждый прочитанный ключ
+
 # Хранилище для учета посещений пользователей
-user_visits = defaultdict(list)  # user_id: [timestamp1, timestamp2, ...]
+user_visits = store.dict(
+    "user_visits"
+)  # user_id: (последний час, маска часов активности) — см. activity.py
+
+# Оценка уникальных пользователей по дням
+UNIQUES_KEEP_DAYS = 30
+if store.shared:
+    # Реплики отмечают визиты прямо в HyperLogLog Redis (PFADD), без чтения регистров
+    daily_uniques = store.uniques("daily_uniques", keep_days=UNIQUES_KEEP_DAYS)
+else:
+    daily_uniques = activity.DailyUniques(
+        store.dict("daily_uniques"), keep_days=UNIQUES_KEEP_DAYS
+    )  # "2024-05-01": HyperLogLog
+
+# История завершенных турниров (см. history.py)
+game_history = TournamentHistory(
+    HISTORY_DIR, segment_bytes=HISTORY_SEGMENT_BYTES, recent=HISTORY_RECENT
+)
+
+
+def import_legacy_history():
+    """Переносит турниры из хранилища состояния, где история жила раньше"""
+    if len(game_history):
+        return
+    if store.shared:
+        legacy = store.backend.read_log("game_history")
+    else:
+        legacy = store.backend.load_log("game_history")
+    for record in legacy:
+        game_history.append(record)
+    if legacy:
+        game_history.flush()
+        print(f"История: перенесено {len(legacy)} турниров в {HISTORY_DIR}")
 
-# Хранилище для истории игр
-game_history = []  # Список словарей с информацией о завершенных играх
+
+import_legacy_history()
 
 # ======================= НОВЫЕ СТРУКТУРЫ ДЛЯ МУЛЬТИПЛЕЕРА =======================
 
 # Хранилище для ожидающих приглашений
-pending_invitations = (
-    {}
+pending_invitations = store.dict(
+    "pending_invitations", track_reads=True
 )  # invitation_id: {inviter_id, invitee_id, bet, timestamp, status}
 
 # Хранилище для активных мультиплеерных игр
-multiplayer_games = (
-    {}
-)  # game_id: {player1_id, player2_id, bet, player1_hand, player2_hand, current_turn, scores}
+multiplayer_games = store.dict(
+    "multiplayer_games", track_reads=True
+)  # game_id: DuelGame
+
+# Башмак дуэли на весь турнир, переходит из раунда в раунд
+duel_shoes = store.dict("duel_shoes", track_reads=True)  # game_id: Shoe
 
 # Хранилище для состояний пользователей
 user_states = (
@@ -52,11 +306,34 @@ user_states = (
 )  # user_id: {'state': 'waiting_for_invite_decision', 'invitation_id': '...', etc}
 
 # Хранилище для турнирных очков в мультиплеере
-multiplayer_scores = {}  # game_id: {player1_id: score, player2_id: score}
+multiplayer_scores = store.dict(
+    "multiplayer_scores", track_reads=True
+)  # game_id: {player1_id: score, player2_id: score}
+
+# Счетчики для уникальных ID (сохраняются, чтобы ID не повторялись после рестарта)
+counters = store.dict("counters")  # "invitation" / "game": последний выданный номер,
+# "tournaments": сколько всего турниров сыграно
+
+# Почасовые счетчики для статистики за 24 часа: "last_seen:час", "tournaments:час"
+hourly_stats = activity.HourlyCounters(store.dict("hourly_stats"))
+
+
+def rebuild_hourly_stats():
+    """Заполняет счетчики по уже накопленной истории (один раз после обновления)"""
+    # Счетчики пишутся только через incr: в Redis это HINCRBY по тому же полю
+    if "tournaments" not in counters:
+        counters.incr("tournaments", len(game_history))
+    if len(hourly_stats.storage) == 0:
+        oldest = activity.current_hour() - hourly_stats.keep_hours
+        for visits in user_visits.values():
+            visits = activity.coerce(visits)
+            if visits is not None and visits[0] > oldest:
+                hourly_stats.add("last_seen", visits[0])
+        for game in game_history.query(start=datetime.fromtimestamp(oldest * 3600)):
+            hourly_stats.add("tournaments", activity.current_hour(game["timestamp"].timestamp()))
 
-# Счетчик для уникальных ID
-invitation_counter = 0
-game_counter = 0
+
+rebuild_hourly_stats()
 
 
 @app.route("/")
@@ -82,124 +359,168 @@ def status():
         "timestamp": time.time(),
         "message": "🚀 Блатной оракул работает на Render!",
         "active_users": len(user_visits),
+        "unique_today": unique_users_today(),
         "games_played": len(game_history),
+        "history": game_history.stats(),
+        "active_users_24h": hourly_stats.total("last_seen", 24),
+        "tournaments_24h": hourly_stats.total("tournaments", 24),
         "pending_invitations": len(pending_invitations),
         "active_multiplayer_games": len(multiplayer_games),
+        "pending_updates": dispatcher.pending,
+        "answer_cache": answer_cache.stats(),
+        "outbound": outbound.stats(),
+        "transport": transport.stats(),
     }
 
 
+# Гейджи считаются при сборе из тех же объектов, что и /status
+metrics.gauge("oracle_solo_games", "Идущие игры против бота", lambda: len(active_games))
+metrics.gauge(
+    "oracle_multiplayer_games", "Идущие игры между игроками", lambda: len(multiplayer_games)
+)
+metrics.gauge(
+    "oracle_pending_invitations", "Приглашения, ждущие ответа", lambda: len(pending_invitations)
+)
+metrics.gauge(
+    "oracle_queue_depth",
+    "Длина очередей: апдейты, отложенные продолжения, исходящие, запись истории",
+    lambda: {
+        ("updates",): dispatcher.pending,
+        ("timers",): dispatcher.scheduled,
+        ("outbound",): outbound.pending,
+        ("history",): game_history.stats()["queued"],
+    },
+    ("queue",),
+)
+OUTBOUND_RESULTS = (
+    "sent",
+    "rate_limited",
+    "retried",
+    "failed",
+    "dead_lettered",
+    "edits_skipped",
+    "not_modified",
+)
+
+
+def outbound_totals():
+    stats = outbound.stats()
+    return {(result,): stats[result] for result in OUTBOUND_RESULTS}
+
+
+metrics.counter_from(
+    "oracle_outbound_total", "Исходящие запросы по итогу", outbound_totals, ("result",)
+)
+
+
+@app.route("/metrics")
+def metrics_text():
+    """Метрики в текстовом формате Prometheus"""
+    return metrics.collect(), 200, {"Content-Type": METRICS_CONTENT_TYPE}
+
+
+@app.route("/leaderboard")
+def leaderboard_json():
+    """Рейтинг игроков: ?limit=N (до 100), ?user_id=ID — добавить место этого игрока"""
+    limit = max(1, min(request.args.get("limit", LEADERBOARD_SIZE, type=int), 100))
+    result = {
+        "players": len(player_stats),
+        "top": [
+            {"rank": place, "user_id": user_id, "name": user_names.get(user_id), **stats.as_dict()}
+            for place, user_id, stats in player_stats.top(limit)
+        ],
+    }
+    user_id = request.args.get("user_id", type=int)
+    if user_id is not None:
+        stats = player_stats.get(user_id)
+        result["user"] = {
+            "rank": player_stats.rank(user_id),
+            "user_id": user_id,
+            **(stats.as_dict() if stats else {}),
+        }
+    return result
+
+
+@app.route(WEBHOOK_PATH, methods=["POST"])
+def telegram_webhook():
+    """Принимает апдейты от Telegram и складывает их в очередь воркеров"""
+    if BOT_MODE != "webhook":
+        return "Not Found", 404
+
+    # Telegram присылает секрет, указанный в setWebhook, в этом заголовке
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not WEBHOOK_SECRET or not hmac.compare_digest(secret, WEBHOOK_SECRET):
+        return "Forbidden", 403
+
+    update_json = request.get_json(silent=True)
+    if not update_json:
+        return "Bad Request", 400
+
+    if not dispatch_update(types.Update.de_json(update_json), block=False):
+        # Очередь забита — пусть Telegram повторит доставку позже
+        return "Busy", 503
+
+    return "OK", 200
+
+
 # ======================= ИГРА В ОЧКО =======================
 
 # ======================= ОСНОВНЫЕ СЛОВАРИ =======================
-user_names = {}
-user_scores = {}
-dealer_scores = {}
-user_bets = {}
-active_games = {}
-
-# ======================= КАРТОЧНАЯ КОЛОДА И ФУНКЦИИ ИГРЫ =======================
-card_deck = [
-    "2♠",
-    "2♥",
-    "2♦",
-    "2♣",
-    "3♠",
-    "3♥",
-    "3♦",
-    "3♣",
-    "4♠",
-    "4♥",
-    "4♦",
-    "4♣",
-    "5♠",
-    "5♥",
-    "5♦",
-    "5♣",
-    "6♠",
-    "6♥",
-    "6♦",
-    "6♣",
-    "7♠",
-    "7♥",
-    "7♦",
-    "7♣",
-    "8♠",
-    "8♥",
-    "8♦",
-    "8♣",
-    "9♠",
-    "9♥",
-    "9♦",
-    "9♣",
-    "10♠",
-    "10♥",
-    "10♦",
-    "10♣",
-    "В♠",
-    "В♥",
-    "В♦",
-    "В♣",  # Валет
-    "Д♠",
-    "Д♥",
-    "Д♦",
-    "Д♣",  # Дама
-    "К♠",
-    "К♥",
-    "К♦",
-    "К♣",  # Король
-    "Т♠",
-    "Т♥",
-    "Т♦",
-    "Т♣",  # Туз
-]
-
-
-def get_card_value(card):
-    if card[0] in ["2", "3", "4", "5", "6", "7", "8", "9"]:
-        return int(card[0])
-    elif card.startswith("10"):
-        return 10
-    elif card[0] in ["В", "Д", "К"]:
-        return 10
-    elif card[0] == "Т":
-        return 11
-    return 0
-
-
-def calculate_hand_value(hand):
-    total = 0
-    aces = 0
-    for card in hand:
-        if card[0] == "Т":
-            aces += 1
-            total += 11
-        else:
-            total += get_card_value(card)
-    while total > 21 and aces > 0:
-        total -= 10
-        aces -= 1
-    return total
+user_names = store.dict("user_names")
+user_scores = store.dict("user_scores")
+dealer_scores = store.dict("dealer_scores")
+user_bets = store.dict("user_bets")
+active_games = store.dict("active_games", track_reads=True)  # user_id: SoloGame
+user_shoes = store.dict("user_shoes", track_reads=True)  # user_id: Shoe на весь турнир
+
+# Итоги игроков против бота и рейтинг по ним (см. leaderboard.py)
+player_stats = StatsEngine(
+    store.counters("player_stats") if store.shared else store.dict("player_stats"),
+    shared=store.shared,
+)  # user_id: PlayerStats
+LEADERBOARD_SIZE = 10
+
+
+def rebuild_player_stats():
+    """Турниры из истории в статистику игроков (один раз, пока статистика пуста).
+    Раунды в истории не записаны — их счет начнется с этого запуска."""
+    if len(player_stats) or not len(game_history):
+        return
+    for record in game_history.query():
+        player_stats.record_tournament(record["user_id"], record["winner"])
+
 
+rebuild_player_stats()
 
-def deal_card():
-    return random.choice(card_deck)
+# ======================= ФУНКЦИИ ИГРЫ =======================
+def new_shoe():
+    return Shoe(SHOE_DECKS, SHOE_PENETRATION, rng=RNG_PROVIDER)
 
 
-def create_game(user_id):
-    player_hand = [deal_card(), deal_card()]
-    dealer_hand = [deal_card(), deal_card()]
-    active_games[user_id] = {
-        "player_hand": player_hand,
-        "dealer_hand": dealer_hand,
-        "game_state": "player_turn",
-    }
-    return active_games[user_id]
+def get_duel_shoe(game_id):
+    shoe = duel_shoes.get(game_id)
+    if shoe is None:
+        # Игра сохранена версией, где башмак лежал в самой DuelGame
+        shoe = duel_shoes[game_id] = new_shoe()
+    return shoe
 
 
-def get_hand_display(hand, hide_first=False):
-    if hide_first:
-        return f"❓ {hand[1]}"
-    return " ".join(hand)
+def get_user_shoe(user_id):
+    shoe = user_shoes.get(user_id)
+    if shoe is None:
+        shoe = user_shoes[user_id] = new_shoe()
+    return shoe
+
+
+def create_game(user_id):
+    shoe = get_user_shoe(user_id)
+    if shoe.needs_shuffle:
+        # Тасуем только между раундами, как за настоящим столом
+        shoe.shuffle()
+    active_games[user_id] = SoloGame(
+        player_hand=new_hand(shoe), dealer_hand=new_hand(shoe)
+    )
+    return active_games[user_id]
 
 
 def clean_bet_text(bet_text):
@@ -264,35 +585,23 @@ def clean_bet_text(bet_text):
 
 
 def check_tournament_winner(user_id):
-    player_score = user_scores.get(user_id, 0)
-    dealer_score = dealer_scores.get(user_id, 0)
-    if player_score >= 101:
-        return "player"
-    elif dealer_score >= 101:
-        return "dealer"
-    return None
+    return tournament_winner(user_scores.get(user_id, 0), dealer_scores.get(user_id, 0))
 
 
 # ======================= ФУНКЦИИ ИГРЫ =======================
 def dealer_play_with_humor(message, user_id):
     game = active_games[user_id]
-    dealer_value = calculate_hand_value(game["dealer_hand"])
-    while dealer_value < 17:
-        game["dealer_hand"].append(deal_card())
-        dealer_value = calculate_hand_value(game["dealer_hand"])
-    player_value = calculate_hand_value(game["player_hand"])
-    if dealer_value > 21:
-        end_round_with_humor(message, user_id, "dealer_bust")
-    elif dealer_value > player_value:
-        end_round_with_humor(message, user_id, "dealer_wins")
-    elif dealer_value < player_value:
-        end_round_with_humor(message, user_id, "player_wins")
-    else:
-        end_round_with_humor(message, user_id, "push")
+    shoe = get_user_shoe(user_id)
+    dealer_value = game.dealer_hand.value
+    while dealer_should_hit(dealer_value):
+        game.dealer_hand.add(shoe.deal())
+        dealer_value = game.dealer_hand.value
+    player_value = game.player_hand.value
+    end_round_with_humor(message, user_id, round_outcome(player_value, dealer_value))
 
 
 # ======================= НОВАЯ ФУНКЦИЯ: СОХРАНЕНИЕ ТУРНИРА =======================
-def save_tournament_result(user_id, winner, bet, player_score, dealer_score):
+def save_tournament_result(user_id, winner, bet, player_score, dealer_score, shoe=None):
     """Сохраняет результат турнира (когда кто-то достиг 101 очка) в историю"""
     now = datetime.now()
 
@@ -307,8 +616,16 @@ def save_tournament_result(user_id, winner, bet, player_score, dealer_score):
         "dealer_final_score": dealer_score,
         "tournament_ended": True,
     }
+    if shoe is not None:
+        # По зерну башмака турнир можно переиграть карта в карту (/разбор)
+        tournament_data.update(
+            rng=shoe.rng, seed=shoe.seed, decks=shoe.decks, shuffles=shoe.shuffles
+        )
 
     game_history.append(tournament_data)
+    player_stats.record_tournament(user_id, winner)
+    counters.incr("tournaments")
+    hourly_stats.add("tournaments", activity.current_hour(now.timestamp()))
 
     # Отправляем уведомление администратору о завершении турнира
     send_tournament_notification_to_admin(tournament_data)
@@ -317,23 +634,22 @@ def save_tournament_result(user_id, winner, bet, player_score, dealer_score):
 
 
 def send_tournament_notification_to_admin(tournament_data):
-    """Отправляет уведомление о завершении турнира администратору"""
-    try:
-        winner_text = "Игрок" if tournament_data["winner"] == "player" else "Дилер"
-
-        notification = (
-            f"🏆 *Завершен турнир в 21*\n\n"
-            f"📅 *Дата и время:* {tournament_data['datetime_str']}\n"
-            f"👤 *Игрок:* {tournament_data['username']}\n"
-            f"🆔 *ID игрока:* {tournament_data['user_id']}\n"
-            f"💰 *Ставка:* {tournament_data['bet']}\n"
-            f"🏁 *Победитель:* {winner_text}\n"
-        )
-
-        bot.send_message(ADMIN_ID, notification, parse_mode="Markdown")
+    """Ставит в очередь уведомление о завершении турнира для администратора"""
+    winner_text = "Игрок" if tournament_data["winner"] == "player" else "Дилер"
+
+    notification = (
+        f"🏆 *Завершен турнир в 21*\n\n"
+        f"📅 *Дата и время:* {tournament_data['datetime_str']}\n"
+        f"👤 *Игрок:* {tournament_data['username']}\n"
+        f"🆔 *ID игрока:* {tournament_data['user_id']}\n"
+        f"💰 *Ставка:* {tournament_data['bet']}\n"
+        f"🏁 *Победитель:* {winner_text}\n"
+    )
 
-    except Exception as e:
-        print(f"Ошибка отправки уведомления о турнире: {e}")
+    # Сбои отправки очередь повторяет сама, а что не ушло — пишет в журнал недоставленных
+    outbound.send_message(
+        ADMIN_ID, notification, parse_mode="Markdown", priority=PRIORITY_BACKGROUND
+    )
 
 
 # ======================= ФУНКЦИЯ: ЕЖЕДНЕВНАЯ СТАТИСТИКА =======================
@@ -343,38 +659,48 @@ def send_daily_stats():
         now = datetime.now()
         cutoff_time = now - timedelta(hours=24)
 
-        # Считаем уникальных пользователей за последние 24 часа
-        recent_users = 0
-        for user_id, visits in user_visits.items():
-            if any(visit >= cutoff_time for visit in visits):
-                recent_users += 1
-
-        # Считаем турниры за последние 24 часа
-        recent_tournaments = 0
-        for game in game_history:
-            if game.get("tournament_ended") and game["timestamp"] >= cutoff_time:
-                recent_tournaments += 1
+        # За последние 24 часа (с точностью до часа) — по почасовым счетчикам
+        now_hour = activity.current_hour(now.timestamp())
+        recent_users = hourly_stats.total("last_seen", 24, now_hour)
+        recent_tournaments = hourly_stats.total("tournaments", 24, now_hour)
 
         stats_message = (
             f"📊 *Ежедневная статистика*\n\n"
             f"⏰ *Время отправки:* {now.strftime('%Y-%m-%d %H:%M:%S')}\n"
             f"👥 *Уникальных пользователей за 24ч:* {recent_users}\n"
+            f"📆 *Уникальных за сегодня (оценка):* {unique_users_today()}\n"
             f"🏆 *Завершенных турниров за 24ч:* {recent_tournaments}\n"
             f"📈 *Всего пользователей в истории:* {len(user_visits)}\n"
-            f"📋 *Всего турниров в истории:* {len([g for g in game_history if g.get('tournament_ended')])}\n"
+            f"📋 *Всего турниров в истории:* {counters.get('tournaments', 0)}\n"
             f"🕒 *Период:* {cutoff_time.strftime('%H:%M')} - {now.strftime('%H:%M')}"
         )
 
-        bot.send_message(ADMIN_ID, stats_message, parse_mode="Markdown")
-
     except Exception as e:
-        print(f"Ошибка отправки статистики: {e}")
+        # Планировщик не должен падать из-за одного подсчета
+        print(f"Ошибка подсчета статистики: {e}")
+        return
+
+    outbound.send_message(
+        ADMIN_ID, stats_message, parse_mode="Markdown", priority=PRIORITY_BACKGROUND
+    )
+
+
+def compact_history():
+    try:
+        removed, merged = game_history.compact(HISTORY_RETENTION_DAYS)
+    except OSError as e:
+        print(f"Ошибка сжатия истории: {e}")
+        return
+    if removed or merged:
+        print(f"История сжата: удалено сегментов {removed}, слито {merged}")
 
 
 def schedule_daily_stats():
     """Планирует отправку ежедневной статистики"""
     # Устанавливаем время отправки (20:00 каждый день)
     schedule.every().day.at("20:00").do(send_daily_stats)
+    # Ночью, когда играют меньше всего, сливаем мелкие сегменты истории и удаляем старые
+    schedule.every().day.at("04:00").do(compact_history)
 
     while True:
         schedule.run_pending()
@@ -382,12 +708,21 @@ def schedule_daily_stats():
 
 
 def record_user_visit(user_id):
-    """Записывает посещение пользователя"""
-    user_visits[user_id].append(datetime.now())
+    """Записывает посещение пользователя: отмечает текущий час и день"""
+    stored = user_visits.get(user_id)
+    previous = activity.coerce(stored)
+    visits = activity.mark_hour(previous, activity.current_hour())
+    # В тот же час запись не меняется — и сохранять нечего
+    if visits != stored:
+        user_visits[user_id] = visits
+        activity.track_last_seen(hourly_stats, previous, visits)
+
+    daily_uniques.add(activity.day_key(), user_id)
+
 
-    # Очищаем старые записи (старше 10 дней) чтобы не накапливать мусор
-    cutoff = datetime.now() - timedelta(days=10)
-    user_visits[user_id] = [visit for visit in user_visits[user_id] if visit >= cutoff]
+def unique_users_today():
+    """Оценка числа уникальных пользователей за сегодня"""
+    return daily_uniques.count(activity.day_key())
 
 
 def end_round_with_humor(message, user_id, result):
@@ -395,32 +730,29 @@ def end_round_with_humor(message, user_id, result):
         return
     game = active_games[user_id]
     bet = user_bets.get(user_id, "ни на что")
-    player_value = calculate_hand_value(game["player_hand"])
-    dealer_value = calculate_hand_value(game["dealer_hand"])
+    player_value = game.player_hand.value
+    dealer_value = game.dealer_hand.value
     if user_id not in user_scores:
         user_scores[user_id] = 0
     if user_id not in dealer_scores:
         dealer_scores[user_id] = 0
     old_player_score = user_scores[user_id]
     old_dealer_score = dealer_scores[user_id]
-    player_round_score = 0
-    dealer_round_score = 0
+    player_round_score, dealer_round_score = round_points(
+        result, player_value, dealer_value
+    )
+    player_stats.record_round(user_id, result, player_value)
     score_message = ""
 
     if result == "player_wins":
-        player_round_score = player_value
         score_message = f" У тебя плюс {player_round_score} "
     elif result == "dealer_wins":
-        dealer_round_score = dealer_value
         score_message = f" Я плюсую себе {dealer_round_score} "
     elif result == "player_bust":
-        dealer_round_score = dealer_value
         score_message = f" Перебор у тебя! Мне плюс {dealer_round_score} очков"
     elif result == "dealer_bust":
-        player_round_score = player_value
         score_message = f"Что то я пожадничал! Твои {player_round_score} очков"
     elif result == "surrender":
-        dealer_round_score = dealer_value // 2
         score_message = (
             f" Сдался,мне половину гони. Получается это {dealer_round_score} "
         )
@@ -469,8 +801,8 @@ def end_round_with_humor(message, user_id, result):
     final_text = (
         f"{comment}\n\n"
         f"Фиксируем на бумажке:\n"
-        f"Твои карты: {get_hand_display(game['player_hand'])} = {player_value}\n"
-        f"Мои карты: {get_hand_display(game['dealer_hand'])} = {dealer_value}\n\n"
+        f"Твои карты: {get_hand_display(game.player_hand)} = {player_value}\n"
+        f"Мои карты: {get_hand_display(game.dealer_hand)} = {dealer_value}\n\n"
         f"{score_message}\n\n"
         f"Общая картина такая:\n"
         f"Играем на <b>{bet}</b>\n"
@@ -493,20 +825,21 @@ def end_round_with_humor(message, user_id, result):
             bet=bet,
             player_score=new_player_score,
             dealer_score=new_dealer_score,
+            shoe=user_shoes.get(user_id),
         )
 
-        try:
-            bot.edit_message_text(
-                final_text,
-                message.chat.id,
-                message.message_id,
-                reply_markup=None,
-                parse_mode="HTML",
-            )
-        except:
-            bot.send_message(message.chat.id, final_text, parse_mode="HTML")
+        outbound.edit_message_text(
+            final_text,
+            message.chat.id,
+            message.message_id,
+            reply_markup=None,
+            parse_mode="HTML",
+            fallback=True,
+        )
         if user_id in active_games:
             del active_games[user_id]
+        if user_id in user_shoes:
+            del user_shoes[user_id]
         if user_id in user_scores:
             del user_scores[user_id]
         if user_id in dealer_scores:
@@ -515,23 +848,16 @@ def end_round_with_humor(message, user_id, result):
             del user_bets[user_id]
         return
 
-    markup = types.InlineKeyboardMarkup()
-    btn_continue = types.InlineKeyboardButton("Продолжаем?", callback_data="continue")
-    markup.add(btn_continue)
     final_text += f"\nНу че, продолжим?"
 
-    try:
-        bot.edit_message_text(
-            final_text,
-            message.chat.id,
-            message.message_id,
-            reply_markup=markup,
-            parse_mode="HTML",
-        )
-    except Exception as e:
-        bot.send_message(
-            message.chat.id, final_text, reply_markup=markup, parse_mode="HTML"
-        )
+    outbound.edit_message_text(
+        final_text,
+        message.chat.id,
+        message.message_id,
+        reply_markup=keyboards.CONTINUE_GAME,
+        parse_mode="HTML",
+        fallback=True,
+    )
 
     if user_id in active_games:
         del active_games[user_id]
@@ -541,7 +867,7 @@ def update_game_display(message, user_id):
     if user_id not in active_games:
         return
     game = active_games[user_id]
-    player_value = calculate_hand_value(game["player_hand"])
+    player_value = game.player_hand.value
     player_score = user_scores.get(user_id, 0)
     dealer_score = dealer_scores.get(user_id, 0)
     bet = user_bets.get(user_id, "ни на что")
@@ -549,38 +875,28 @@ def update_game_display(message, user_id):
         f"Играем на <b>{bet}</b>\n"
         f"У тебя всего {player_score}, у меня {dealer_score} \n"
         f"Играем дальше\n\n"
-        f"Твои карты: {get_hand_display(game['player_hand'])}\n"
+        f"Твои карты: {get_hand_display(game.player_hand)}\n"
         f"Очков: {player_value}\n\n"
-        f"Мои карты: {get_hand_display(game['dealer_hand'], hide_first=True)}\n"
+        f"Мои карты: {get_hand_display(game.dealer_hand, hide_first=True)}\n"
         f"Первая карта скрыта\n\n"
         f"Что выбираешь?:"
     )
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    btn_hit = types.InlineKeyboardButton("Давай карту", callback_data="hit")
-    btn_stand = types.InlineKeyboardButton("Хватит", callback_data="stand")
-    btn_surrender = types.InlineKeyboardButton("Сдаюсь", callback_data="surrender")
-    markup.add(btn_hit, btn_stand, btn_surrender)
-    try:
-        bot.edit_message_text(
-            game_text,
-            message.chat.id,
-            message.message_id,
-            reply_markup=markup,
-            parse_mode="HTML",
-        )
-    except Exception as e:
-        bot.send_message(
-            message.chat.id, game_text, reply_markup=markup, parse_mode="HTML"
-        )
+    markup = keyboards.GAME_ACTIONS
+    outbound.edit_message_text(
+        game_text,
+        message.chat.id,
+        message.message_id,
+        reply_markup=markup,
+        parse_mode="HTML",
+        fallback=True,
+    )
 
 
 # ======================= НОВЫЕ ФУНКЦИИ ДЛЯ МУЛЬТИПЛЕЕРА =======================
 
 def create_multiplayer_invitation(inviter_id, bet):
     """Создает приглашение для мультиплеерной игры"""
-    global invitation_counter
-    invitation_counter += 1
-    invitation_id = f"inv_{invitation_counter}_{inviter_id}"
+    invitation_id = f"inv_{counters.incr('invitation')}_{inviter_id}"
     
     pending_invitations[invitation_id] = {
         "inviter_id": inviter_id,
@@ -606,7 +922,7 @@ def send_invitation_to_user(invitation_id, invitee_username):
     bet = invitation["bet"]
 
     # Отправляем сообщение приглашающему
-    bot.send_message(
+    outbound.send_message(
         invitation["inviter_id"],
         f"Приглашение создано!\n\n"
         f"Ставка: <b>{bet}</b>\n"
@@ -623,30 +939,25 @@ def send_invitation_to_user(invitation_id, invitee_username):
 
 def create_multiplayer_game(inviter_id, invitee_id, bet):
     """Создает мультиплеерную игру"""
-    global game_counter
-    game_counter += 1
-    game_id = f"game_{game_counter}"
-
-    # Раздаем карты обоим игрокам
-    player1_hand = [deal_card(), deal_card()]
-    player2_hand = [deal_card(), deal_card()]
-
-    multiplayer_games[game_id] = {
-        "player1_id": inviter_id,
-        "player2_id": invitee_id,
-        "player1_name": user_names.get(inviter_id, "фраерок"),
-        "player2_name": user_names.get(invitee_id, "фраерок"),
-        "bet": bet,
-        "player1_hand": player1_hand,
-        "player2_hand": player2_hand,
-        "current_turn": inviter_id,  # Первым ходит пригласивший
-        "player1_score": calculate_hand_value(player1_hand),
-        "player2_score": calculate_hand_value(player2_hand),
-        "player1_stand": False,
-        "player2_stand": False,
-        "game_state": "active",
-        "round_number": 1,  # Номер раунда
-    }
+    game_id = f"game_{counters.incr('game')}"
+
+    # Раздаем карты обоим игрокам из общего башмака
+    shoe = duel_shoes[game_id] = new_shoe()
+    player1_hand = new_hand(shoe)
+    player2_hand = new_hand(shoe)
+
+    multiplayer_games[game_id] = DuelGame(
+        player1_id=inviter_id,
+        player2_id=invitee_id,
+        player1_name=user_names.get(inviter_id, "фраерок"),
+        player2_name=user_names.get(invitee_id, "фраерок"),
+        bet=bet,
+        player1_hand=player1_hand,
+        player2_hand=player2_hand,
+        current_turn=inviter_id,  # Первым ходит пригласивший
+        player1_score=player1_hand.value,
+        player2_score=player2_hand.value,
+    )
 
     # Инициализируем турнирные очки для мультиплеера
     multiplayer_scores[game_id] = {inviter_id: 0, invitee_id: 0}
@@ -664,15 +975,15 @@ def check_multiplayer_tournament_winner(game_id):
     if not game:
         return None
 
-    player1_id = game["player1_id"]
-    player2_id = game["player2_id"]
+    player1_id = game.player1_id
+    player2_id = game.player2_id
 
     player1_score = scores.get(player1_id, 0)
     player2_score = scores.get(player2_id, 0)
 
-    if player1_score >= 101:
+    if player1_score >= TOURNAMENT_TARGET:
         return "player1"
-    elif player2_score >= 101:
+    elif player2_score >= TOURNAMENT_TARGET:
         return "player2"
 
     return None
@@ -688,26 +999,26 @@ def end_multiplayer_round(game_id):
     if not scores:
         return None
 
-    player1_id = game["player1_id"]
-    player2_id = game["player2_id"]
-    player1_name = game["player1_name"]
-    player2_name = game["player2_name"]
+    player1_id = game.player1_id
+    player2_id = game.player2_id
+    player1_name = game.player1_name
+    player2_name = game.player2_name
 
-    player1_hand_value = game["player1_score"]
-    player2_hand_value = game["player2_score"]
+    player1_hand_value = game.player1_score
+    player2_hand_value = game.player2_score
 
     # Определяем победителя раунда
     round_winner = None
     round_score_to_add = 0
 
-    if player1_hand_value > 21 and player2_hand_value > 21:
+    if is_bust(player1_hand_value) and is_bust(player2_hand_value):
         # Оба проиграли
         round_winner = "draw"
-    elif player1_hand_value > 21:
+    elif is_bust(player1_hand_value):
         # Игрок 1 перебрал
         round_winner = "player2"
         round_score_to_add = player2_hand_value
-    elif player2_hand_value > 21:
+    elif is_bust(player2_hand_value):
         # Игрок 2 перебрал
         round_winner = "player1"
         round_score_to_add = player1_hand_value
@@ -748,15 +1059,19 @@ def start_new_multiplayer_round(game_id):
     if not game:
         return False
 
-    # Раздаем новые карты
-    game["player1_hand"] = [deal_card(), deal_card()]
-    game["player2_hand"] = [deal_card(), deal_card()]
-    game["player1_score"] = calculate_hand_value(game["player1_hand"])
-    game["player2_score"] = calculate_hand_value(game["player2_hand"])
-    game["player1_stand"] = False
-    game["player2_stand"] = False
-    game["current_turn"] = game["player1_id"]  # Первым ходит пригласивший
-    game["round_number"] += 1
+    # Раздаем новые карты, перетасовав башмак, если дошли до отсечки
+    shoe = get_duel_shoe(game_id)
+    if shoe.needs_shuffle:
+        shoe.shuffle()
+    game.player1_hand = new_hand(shoe)
+    game.player2_hand = new_hand(shoe)
+    game.player1_score = game.player1_hand.value
+    game.player2_score = game.player2_hand.value
+    game.player1_stand = False
+    game.player2_stand = False
+    game.current_turn = game.player1_id  # Первым ходит пригласивший
+    game.game_state = "active"
+    game.round_number += 1
 
     return True
 
@@ -770,32 +1085,30 @@ def update_multiplayer_game_display(game_id, player_id):
     scores = multiplayer_scores.get(game_id, {})
 
     player_name = user_names.get(player_id, "фраерок")
-    opponent_id = (
-        game["player2_id"] if player_id == game["player1_id"] else game["player1_id"]
-    )
+    opponent_id = game.opponent_of(player_id)
     opponent_name = (
-        game["player2_name"]
-        if player_id == game["player1_id"]
-        else game["player1_name"]
+        game.player2_name
+        if player_id == game.player1_id
+        else game.player1_name
     )
 
     # Определяем, чьи карты показывать
-    if player_id == game["player1_id"]:
-        player_hand = game["player1_hand"]
-        opponent_hand = game["player2_hand"]
-        player_score = game["player1_score"]
+    if player_id == game.player1_id:
+        player_hand = game.player1_hand
+        opponent_hand = game.player2_hand
+        player_score = game.player1_score
         player_total_score = scores.get(player_id, 0)
         opponent_total_score = scores.get(opponent_id, 0)
     else:
-        player_hand = game["player2_hand"]
-        opponent_hand = game["player1_hand"]
-        player_score = game["player2_score"]
+        player_hand = game.player2_hand
+        opponent_hand = game.player1_hand
+        player_score = game.player2_score
         player_total_score = scores.get(player_id, 0)
         opponent_total_score = scores.get(opponent_id, 0)
 
     game_text = (
         f" <b>Игра против {opponent_name}</b>\n"
-        f" на <b>{game['bet']}</b>\n\n"
+        f" на <b>{game.bet}</b>\n\n"
         f"Прмежуточный итог\n"
         f"У {player_name}: {player_total_score} очков, у {opponent_name}: {opponent_total_score}\n\n"
         f" <b>Твои карты:</b> {get_hand_display(player_hand)}\n"
@@ -808,33 +1121,27 @@ def update_multiplayer_game_display(game_id, player_id):
     tournament_winner = check_multiplayer_tournament_winner(game_id)
     if tournament_winner:
         if tournament_winner == "player1":
-            winner_name = game["player1_name"]
+            winner_name = game.player1_name
         else:
-            winner_name = game["player2_name"]
+            winner_name = game.player2_name
 
         game_text += f"🏆 <b>ТУРНИР ЗАВЕРШЕН!</b>\n"
         game_text += f"Победитель: {winner_name}!\n"
         game_text += (
-            f"{winner_name} набрал(а) 101 очко и забирает ставку <b>{game['bet']}</b>!"
+            f"{winner_name} набрал(а) 101 очко и забирает ставку <b>{game.bet}</b>!"
         )
 
         # Удаляем игру
         del multiplayer_games[game_id]
+        duel_shoes.pop(game_id, None)
         if game_id in multiplayer_scores:
             del multiplayer_scores[game_id]
 
         return game_text, None
 
-    if game["current_turn"] == player_id:
+    if game.current_turn == player_id:
         game_text += "🎯 <b>Твой ход!</b> Выбери действие:"
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        btn_hit = types.InlineKeyboardButton(
-            "Давай карту", callback_data=f"multi_hit_{game_id}"
-        )
-        btn_stand = types.InlineKeyboardButton(
-            "Хватит", callback_data=f"multi_stand_{game_id}"
-        )
-        markup.add(btn_hit, btn_stand)
+        markup = keyboards.multiplayer_turn(game_id)
     else:
         game_text += f"⏳ <b>Ход {opponent_name}</b>\nЖди своего хода..."
         markup = None
@@ -857,80 +1164,98 @@ def end_multiplayer_round_and_continue(game_id):
     if round_result["tournament_winner"]:
         # Турнир завершен
         if round_result["tournament_winner"] == "player1":
-            winner_name = game["player1_name"]
-            loser_name = game["player2_name"]
+            winner_name = game.player1_name
+            loser_name = game.player2_name
         else:
-            winner_name = game["player2_name"]
-            loser_name = game["player1_name"]
+            winner_name = game.player2_name
+            loser_name = game.player1_name
 
         result_text = (
             f" <b>ТУРНИР ЗАВЕРШЕН!</b>\n\n"
             f" Финальный итог:\n"
-            f" {game['player1_name']}: {round_result['player1_total']}\n"
-            f" {game['player2_name']}: {round_result['player2_total']}\n\n"
+            f" {game.player1_name}: {round_result['player1_total']}\n"
+            f" {game.player2_name}: {round_result['player2_total']}\n\n"
             f" <b>ПОБЕДИТЕЛЬ: {winner_name}!</b>\n\n"
-            f"{winner_name} набрал(а) 101 очко и забирает <b>{game['bet']}</b>!"
+            f"{winner_name} набрал(а) 101 очко и забирает <b>{game.bet}</b>!"
         )
 
         # Отправляем результаты обоим игрокам
-        bot.send_message(game["player1_id"], result_text, parse_mode="HTML")
-        bot.send_message(game["player2_id"], result_text, parse_mode="HTML")
+        outbound.send_message(game.player1_id, result_text, parse_mode="HTML")
+        outbound.send_message(game.player2_id, result_text, parse_mode="HTML")
 
         # Удаляем игру
         del multiplayer_games[game_id]
+        duel_shoes.pop(game_id, None)
         if game_id in multiplayer_scores:
             del multiplayer_scores[game_id]
 
         return
 
-    # Турнир продолжается, показываем результаты раунда
-    time.sleep(2)
+    # Турнир продолжается: пока идет пауза, ходы в этой игре не принимаем
+    game.game_state = "round_over"
+    dispatcher.call_later(2, send_multiplayer_round_results, game_id, round_result)
+
+
+def send_multiplayer_round_results(game_id, round_result):
+    """Показывает итоги раунда обоим игрокам и через паузу раздает новый"""
+    game = multiplayer_games.get(game_id)
+    if not game:
+        return
+
     round_text = (
-        f"<b>Раунд {game['round_number']} завершен!</b>\n\n"
-        f" {game['player1_name']}:\n"
-        f"Карты: {get_hand_display(game['player1_hand'])}\n"
+        f"<b>Раунд {game.round_number} завершен!</b>\n\n"
+        f" {game.player1_name}:\n"
+        f"Карты: {get_hand_display(game.player1_hand)}\n"
         f"Очков в раунде: {round_result['player1_hand_value']}\n\n"
-        f"{game['player2_name']}:\n"
-        f"Карты: {get_hand_display(game['player2_hand'])}\n"
+        f"{game.player2_name}:\n"
+        f"Карты: {get_hand_display(game.player2_hand)}\n"
         f"Очков в раунде: {round_result['player2_hand_value']}\n\n"
     )
 
     if round_result["round_winner"] == "draw":
         round_text += f"🤝 <b>Ничья в раунде!</b>\n"
     elif round_result["round_winner"] == "player1":
-        round_text += f"🏆 <b>Победитель раунда: {game['player1_name']}</b>\n"
+        round_text += f"🏆 <b>Победитель раунда: {game.player1_name}</b>\n"
         round_text += f"Получает {round_result['player1_hand_value']} очков\n"
     else:
-        round_text += f"🏆 <b>Победитель раунда: {game['player2_name']}</b>\n"
+        round_text += f"🏆 <b>Победитель раунда: {game.player2_name}</b>\n"
         round_text += f"Получает {round_result['player2_hand_value']} очков\n"
     round_text += f"➡️ <b>Следующий раунд начинается...</b>"
 
     # Отправляем результаты раунда обоим игрокам
-    bot.send_message(game["player1_id"], round_text, parse_mode="HTML")
-    bot.send_message(game["player2_id"], round_text, parse_mode="HTML")
+    outbound.send_message(game.player1_id, round_text, parse_mode="HTML")
+    outbound.send_message(game.player2_id, round_text, parse_mode="HTML")
+
+    dispatcher.call_later(2, continue_multiplayer_tournament, game_id)
+
+
+def continue_multiplayer_tournament(game_id):
+    """Раздает новый раунд и показывает игру обоим игрокам"""
+    game = multiplayer_games.get(game_id)
+    if not game:
+        return
 
     # Начинаем новый раунд
-    time.sleep(2)
     start_new_multiplayer_round(game_id)
 
     # Обновляем отображение для обоих игроков
     # Игрок 1
-    game_text, markup = update_multiplayer_game_display(game_id, game["player1_id"])
+    game_text, markup = update_multiplayer_game_display(game_id, game.player1_id)
     if markup:
-        bot.send_message(
-            game["player1_id"], game_text, reply_markup=markup, parse_mode="HTML"
+        outbound.send_message(
+            game.player1_id, game_text, reply_markup=markup, parse_mode="HTML"
         )
     else:
-        bot.send_message(game["player1_id"], game_text, parse_mode="HTML")
+        outbound.send_message(game.player1_id, game_text, parse_mode="HTML")
 
     # Игрок 2
-    game_text, markup = update_multiplayer_game_display(game_id, game["player2_id"])
+    game_text, markup = update_multiplayer_game_display(game_id, game.player2_id)
     if markup:
-        bot.send_message(
-            game["player2_id"], game_text, reply_markup=markup, parse_mode="HTML"
+        outbound.send_message(
+            game.player2_id, game_text, reply_markup=markup, parse_mode="HTML"
         )
     else:
-        bot.send_message(game["player2_id"], game_text, parse_mode="HTML")
+        outbound.send_message(game.player2_id, game_text, parse_mode="HTML")
 
 
 # ======================= ОБРАБОТЧИКИ КОМАНД ИГРЫ =======================
@@ -947,17 +1272,19 @@ def new_tournament(message):
         del user_bets[user_id]
     if user_id in active_games:
         del active_games[user_id]
-    bot.send_message(
+    # Новый турнир — свежий башмак
+    user_shoes[user_id] = new_shoe()
+    outbound.send_message(
         message.chat.id,
         f"Играть будем до 101 очка, {name}!\n"
         f"Очки считаем за выигранный кон, перебор это 0 очков.\n"
         f"Ну, решился что ли?",
         parse_mode="HTML",
     )
-    msg = bot.send_message(
+    outbound.send_message(
         message.chat.id, f"На что играем, {name}?", parse_mode="HTML"
     )
-    bot.register_next_step_handler(msg, process_bet_with_humor)
+    bot.register_next_step_handler_by_chat_id(message.chat.id, process_bet_with_humor)
 
 
 def process_bet_with_humor(message):
@@ -988,16 +1315,16 @@ def process_bet_with_humor(message):
         phrase in bet_text
         for phrase in ["просто так", "простотак", "да просто", "за просто так"]
     ):
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Ты побереги свой 'просто так'.\nДумай еще.",
             parse_mode="HTML",
         )
-        msg = bot.send_message(message.chat.id, "Так на что играем?")
-        bot.register_next_step_handler(msg, process_bet_with_humor)
+        outbound.send_message(message.chat.id, "Так на что играем?")
+        bot.register_next_step_handler_by_chat_id(message.chat.id, process_bet_with_humor)
         return
     elif any(name in bet_text for name in forbidden_names):
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             f"Нет, мы будем играть на твое рыжее, драное очко\n"
             f"И за базар придется отвечать...",
@@ -1007,13 +1334,13 @@ def process_bet_with_humor(message):
         start_new_round(message)
         return
     elif "интерес" in bet_text:
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Мой интерес - твоя квартира. Но я человек добрый, даю шанс подумать еще.\nПредложи что-то попроще, пока я не передумал.",
             parse_mode="HTML",
         )
-        msg = bot.send_message(message.chat.id, "Ну? Что предлагаешь?")
-        bot.register_next_step_handler(msg, process_bet_with_humor)
+        outbound.send_message(message.chat.id, "Ну? Что предлагаешь?")
+        bot.register_next_step_handler_by_chat_id(message.chat.id, process_bet_with_humor)
         return
     elif any(
         phrase in bet_text
@@ -1026,11 +1353,11 @@ def process_bet_with_humor(message):
             "/сыграем",
         ]
     ):
-        bot.send_message(
+        outbound.send_message(
             message.chat.id, "Ставка твоя голимый тухляк.\nМеняй.", parse_mode="HTML"
         )
-        msg = bot.send_message(message.chat.id, "Что ставишь?")
-        bot.register_next_step_handler(msg, process_bet_with_humor)
+        outbound.send_message(message.chat.id, "Что ставишь?")
+        bot.register_next_step_handler_by_chat_id(message.chat.id, process_bet_with_humor)
         return
     elif any(
         phrase in bet_text
@@ -1042,31 +1369,35 @@ def process_bet_with_humor(message):
             "ни на что не играю",
         ]
     ):
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Для меня 'ничто' - это твоя жизнь. Хочешь так?\nПодумай еще, пока я в хорошем настроении.",
             parse_mode="HTML",
         )
-        msg = bot.send_message(message.chat.id, "Уважаемый, не тяни.")
-        bot.register_next_step_handler(msg, process_bet_with_humor)
+        outbound.send_message(message.chat.id, "Уважаемый, не тяни.")
+        bot.register_next_step_handler_by_chat_id(message.chat.id, process_bet_with_humor)
         return
     elif any(
         phrase in bet_text for phrase in ["мое очко", "мою жопу", "мой рот", "моя жопа"]
     ):
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Я с петухами в карты не играю.\nПодумай еще.",
             parse_mode="HTML",
         )
-        time.sleep(1)  # Задержка 1 секунда
-        msg = bot.send_message(message.chat.id, "А ты че задумался то?")
-        bot.register_next_step_handler(msg, process_bet_with_humor)
+        bot.register_next_step_handler_by_chat_id(
+            message.chat.id, process_bet_with_humor
+        )
+        # Задержка 1 секунда без блокировки воркера
+        dispatcher.call_later(
+            1, outbound.send_message, message.chat.id, "А ты че задумался то?"
+        )
         return
     elif any(
         phrase in bet_text
         for phrase in ["твое очко", "твою жопу", "твой рот", "твоя жопа"]
     ):
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             f"О как!\nПринимаю! Ставка  {display_bet}.\n За базар придется отвечать...",
             parse_mode="HTML",
@@ -1076,7 +1407,7 @@ def process_bet_with_humor(message):
         ask_for_multiplayer_invitation(message, user_id, display_bet)
         return
     else:
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             f"Ну давай, играем на {display_bet}!\nПонеслась.., моча по трубам!",
             parse_mode="HTML",
@@ -1087,12 +1418,9 @@ def process_bet_with_humor(message):
 
 def ask_for_game_mode(message, user_id, bet):
     """Спрашивает, как играть: с ботом или с другом"""
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    btn_friend = types.InlineKeyboardButton("позвать кента", callback_data=f"play_friend_{bet}")
-    btn_bot = types.InlineKeyboardButton("играть с арестанотом", callback_data=f"play_bot_{bet}")
-    markup.add(btn_friend, btn_bot)
-    
-    bot.send_message(
+    markup = keyboards.game_mode(bet)
+
+    outbound.send_message(
         message.chat.id,
         f"Со мной будешь фарт мерить, или нешел какого-то лоха?\n"
         f"• <b>играть с арестантом </b> - продолжим обычную игру\n"
@@ -1113,8 +1441,8 @@ def handle_game_mode_decision(call):
             bet = call.data.replace("play_bot_", "", 1)
             user_bets[user_id] = bet
             
-            bot.answer_callback_query(call.id, "Играем с ботом!")
-            bot.edit_message_text(
+            outbound.answer_callback_query(call.id, "Играем с ботом!")
+            outbound.edit_message_text(
                 f"Отлично! Играем с ботом на <b>{bet}</b>!\nПонеслась.., моча по трубам!",
                 call.message.chat.id,
                 call.message.message_id,
@@ -1129,7 +1457,7 @@ def handle_game_mode_decision(call):
             bet = call.data.replace("play_friend_", "", 1)
             user_bets[user_id] = bet
             
-            bot.answer_callback_query(call.id, "Создаем приглашение...")
+            outbound.answer_callback_query(call.id, "Создаем приглашение...")
             
             # Создаем уникальное приглашение
             invitation_id = create_multiplayer_invitation(user_id, bet)
@@ -1139,14 +1467,14 @@ def handle_game_mode_decision(call):
             
     except Exception as e:
         print(f"Ошибка в обработке выбора режима игры: {e}")
-        bot.answer_callback_query(call.id, "Произошла ошибка!")
+        outbound.answer_callback_query(call.id, "Произошла ошибка!")
 
 
 def send_friend_invitation(message, user_id, bet, invitation_id):
     """Отправляет 3 сообщения для приглашения друга"""
     
     # 1-е сообщение: Инструкция
-    bot.send_message(
+    outbound.send_message(
         message.chat.id,
         " <b>Как пригласить друга:</b>\n\n"
         "1. Скопируй следующие два <b> сообщения</b> полностью\n"
@@ -1166,7 +1494,7 @@ def send_friend_invitation(message, user_id, bet, invitation_id):
         f"Чтобы подтвердить игру, скопируй нижнее сообщение, перейди в бот и отправь его 👇"
     )
     
-    bot.send_message(
+    outbound.send_message(
         message.chat.id,
         invitation_text,
         parse_mode="HTML"
@@ -1174,7 +1502,7 @@ def send_friend_invitation(message, user_id, bet, invitation_id):
     
     # 3-е сообщение: Команда для копирования
     command_text = f"/принять {invitation_id}"
-    bot.send_message(
+    outbound.send_message(
         message.chat.id,
         f"<code>{command_text}</code>\n\n",
         parse_mode="HTML"
@@ -1192,18 +1520,18 @@ def accept_invitation(message):
         # Получаем ID приглашения из команды
         parts = message.text.split()
         if len(parts) < 2:
-            bot.send_message(message.chat.id, "Использование: /принять invitation_id")
+            outbound.send_message(message.chat.id, "Использование: /принять invitation_id")
             return
 
         invitation_id = parts[1]
         invitation = pending_invitations.get(invitation_id)
 
         if not invitation:
-            bot.send_message(message.chat.id, "Приглашение не найдено или устарело.")
+            outbound.send_message(message.chat.id, "Приглашение не найдено или устарело.")
             return
 
         if invitation["status"] != "pending":
-            bot.send_message(message.chat.id, "Это приглашение уже было использовано.")
+            outbound.send_message(message.chat.id, "Это приглашение уже было использовано.")
             return
 
         # Обновляем приглашение
@@ -1221,7 +1549,7 @@ def accept_invitation(message):
         bet = invitation["bet"]
 
         # Отправляем приглашающему
-        bot.send_message(
+        outbound.send_message(
             invitation["inviter_id"],
             f"🎮 <b>{invitee_name} принял(а) твое приглашение!</b>\n\n"
             f"💰 Ставка: <b>{bet}</b>\n"
@@ -1232,7 +1560,7 @@ def accept_invitation(message):
         )
 
         # Отправляем приглашенному
-        bot.send_message(
+        outbound.send_message(
             user_id,
             f"🎮 <b>Ты принял(а) приглашение от {inviter_name}!</b>\n\n"
             f"💰 Ставка: <b>{bet}</b>\n"
@@ -1250,28 +1578,28 @@ def accept_invitation(message):
             game_id, invitation["inviter_id"]
         )
         if markup:
-            bot.send_message(
+            outbound.send_message(
                 invitation["inviter_id"],
                 game_text,
                 reply_markup=markup,
                 parse_mode="HTML",
             )
         else:
-            bot.send_message(invitation["inviter_id"], game_text, parse_mode="HTML")
+            outbound.send_message(invitation["inviter_id"], game_text, parse_mode="HTML")
 
         # Приглашенному
         game_text, markup = update_multiplayer_game_display(game_id, user_id)
         if markup:
-            bot.send_message(user_id, game_text, reply_markup=markup, parse_mode="HTML")
+            outbound.send_message(user_id, game_text, reply_markup=markup, parse_mode="HTML")
         else:
-            bot.send_message(user_id, game_text, parse_mode="HTML")
+            outbound.send_message(user_id, game_text, parse_mode="HTML")
 
         # Удаляем приглашение
         del pending_invitations[invitation_id]
 
     except Exception as e:
         print(f"Ошибка при принятии приглашения: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при принятии приглашения.")
+        outbound.send_message(message.chat.id, "Произошла ошибка при принятии приглашения.")
 
 
 @bot.callback_query_handler(
@@ -1293,67 +1621,72 @@ def handle_multiplayer_action(call):
 
         game = multiplayer_games.get(game_id)
         if not game:
-            bot.answer_callback_query(call.id, "Игра не найдена!")
+            outbound.answer_callback_query(call.id, "Игра не найдена!")
+            return
+
+        # Между раундами идет подсчет — кнопки старого раунда не принимаем
+        if game.game_state != "active":
+            outbound.answer_callback_query(call.id, "Раунд уже закончен, жди раздачи!")
             return
 
         # Проверяем, чей сейчас ход
-        if game["current_turn"] != user_id:
-            bot.answer_callback_query(call.id, "Сейчас не твой ход!")
+        if game.current_turn != user_id:
+            outbound.answer_callback_query(call.id, "Сейчас не твой ход!")
             return
 
         # Обрабатываем действие
-        if user_id == game["player1_id"]:
+        if user_id == game.player1_id:
             if action == "hit":
                 # Добавляем карту
-                game["player1_hand"].append(deal_card())
-                game["player1_score"] = calculate_hand_value(game["player1_hand"])
+                game.player1_hand.add(get_duel_shoe(game_id).deal())
+                game.player1_score = game.player1_hand.value
 
                 # Проверяем перебор
-                if game["player1_score"] > 21:
-                    bot.answer_callback_query(call.id, "У тебя перебор!")
-                    game["player1_stand"] = True
-                    game["current_turn"] = game["player2_id"]
+                if is_bust(game.player1_score):
+                    outbound.answer_callback_query(call.id, "У тебя перебор!")
+                    game.player1_stand = True
+                    game.current_turn = game.player2_id
                 else:
-                    bot.answer_callback_query(call.id, "Карта добавлена!")
+                    outbound.answer_callback_query(call.id, "Карта добавлена!")
 
             elif action == "stand":
-                bot.answer_callback_query(call.id, "Ход завершен!")
-                game["player1_stand"] = True
-                game["current_turn"] = game["player2_id"]
+                outbound.answer_callback_query(call.id, "Ход завершен!")
+                game.player1_stand = True
+                game.current_turn = game.player2_id
 
         else:  # player2
             if action == "hit":
                 # Добавляем карту
-                game["player2_hand"].append(deal_card())
-                game["player2_score"] = calculate_hand_value(game["player2_hand"])
+                game.player2_hand.add(get_duel_shoe(game_id).deal())
+                game.player2_score = game.player2_hand.value
 
                 # Проверяем перебор
-                if game["player2_score"] > 21:
-                    bot.answer_callback_query(call.id, "У тебя перебор!")
-                    game["player2_stand"] = True
-                    game["current_turn"] = game["player1_id"]
+                if is_bust(game.player2_score):
+                    outbound.answer_callback_query(call.id, "У тебя перебор!")
+                    game.player2_stand = True
+                    game.current_turn = game.player1_id
                 else:
-                    bot.answer_callback_query(call.id, "Карта добавлена!")
+                    outbound.answer_callback_query(call.id, "Карта добавлена!")
 
             elif action == "stand":
-                bot.answer_callback_query(call.id, "Ход завершен!")
-                game["player2_stand"] = True
-                game["current_turn"] = game["player1_id"]
+                outbound.answer_callback_query(call.id, "Ход завершен!")
+                game.player2_stand = True
+                game.current_turn = game.player1_id
 
         # Проверяем, закончился ли раунд
         round_over = False
 
         # Если оба игрока встали
-        if game["player1_stand"] and game["player2_stand"]:
+        if game.player1_stand and game.player2_stand:
             round_over = True
 
         # Если у обоих перебор
-        if game["player1_score"] > 21 and game["player2_score"] > 21:
+        if is_bust(game.player1_score) and is_bust(game.player2_score):
             round_over = True
 
         # Если у одного перебор, а другой встал
-        if (game["player1_score"] > 21 and game["player2_stand"]) or (
-            game["player2_score"] > 21 and game["player1_stand"]
+        if (is_bust(game.player1_score) and game.player2_stand) or (
+            is_bust(game.player2_score) and game.player1_stand
         ):
             round_over = True
 
@@ -1364,47 +1697,28 @@ def handle_multiplayer_action(call):
             # Обновляем отображение для обоих игроков
             # Игрок, который сделал ход
             game_text, markup = update_multiplayer_game_display(game_id, user_id)
-            try:
-                if markup:
-                    bot.edit_message_text(
-                        game_text,
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=markup,
-                        parse_mode="HTML",
-                    )
-                else:
-                    bot.edit_message_text(
-                        game_text,
-                        call.message.chat.id,
-                        call.message.message_id,
-                        parse_mode="HTML",
-                    )
-            except:
-                if markup:
-                    bot.send_message(
-                        user_id, game_text, reply_markup=markup, parse_mode="HTML"
-                    )
-                else:
-                    bot.send_message(user_id, game_text, parse_mode="HTML")
+            outbound.edit_message_text(
+                game_text,
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=markup,
+                parse_mode="HTML",
+                fallback=True,
+            )
 
             # Противник
-            opponent_id = (
-                game["player2_id"]
-                if user_id == game["player1_id"]
-                else game["player1_id"]
-            )
+            opponent_id = game.opponent_of(user_id)
             game_text, markup = update_multiplayer_game_display(game_id, opponent_id)
             if markup:
-                bot.send_message(
+                outbound.send_message(
                     opponent_id, game_text, reply_markup=markup, parse_mode="HTML"
                 )
             else:
-                bot.send_message(opponent_id, game_text, parse_mode="HTML")
+                outbound.send_message(opponent_id, game_text, parse_mode="HTML")
 
     except Exception as e:
         print(f"Ошибка в мультиплеерной игре: {e}")
-        bot.answer_callback_query(call.id, "Произошла ошибка!")
+        outbound.answer_callback_query(call.id, "Произошла ошибка!")
 
 
 @bot.message_handler(commands=["продолжим?"])
@@ -1413,7 +1727,7 @@ def continue_tournament(message):
     record_user_visit(user_id)  # Записываем посещение
     name = user_names.get(user_id, "фраерок")
     if user_id not in user_bets:
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             f"Игры пока нет, {name}!\nДавай начнем ее командой /сыграем?",
             parse_mode="HTML",
@@ -1422,13 +1736,13 @@ def continue_tournament(message):
     tournament_winner = check_tournament_winner(user_id)
     if tournament_winner:
         if tournament_winner == "player":
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 f"Ты уже выиграл, {name}! Начинаем по новой? (/сыграем?)",
                 parse_mode="HTML",
             )
         else:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 f"Я тебя уже обставил {name}! Хочешь реванш? (/сыграем?)",
                 parse_mode="HTML",
@@ -1437,7 +1751,7 @@ def continue_tournament(message):
     bet = user_bets[user_id]
     player_score = user_scores.get(user_id, 0)
     dealer_score = dealer_scores.get(user_id, 0)
-    bot.send_message(
+    outbound.send_message(
         message.chat.id,
         f"Продолжаем игру, {name}!\n"
         f"Играем на  <b>{bet}</b>\n"
@@ -1454,13 +1768,13 @@ def start_new_round(message):
     tournament_winner = check_tournament_winner(user_id)
     if tournament_winner:
         if tournament_winner == "player":
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 f"Ты выиграл, {name}! Хочешь еще испытать судьбу? (/сыграем?)",
                 parse_mode="HTML",
             )
         else:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 f"Уважаемый, я тебя уже выиграл, {name}! Хочешь реванш? (/сыграем?)",
                 parse_mode="HTML",
@@ -1468,7 +1782,7 @@ def start_new_round(message):
         return
     create_game(user_id)
     game = active_games[user_id]
-    player_value = calculate_hand_value(game["player_hand"])
+    player_value = game.player_hand.value
     player_score = user_scores.get(user_id, 0)
     dealer_score = dealer_scores.get(user_id, 0)
     bet = user_bets.get(user_id, "ни на что")
@@ -1476,32 +1790,24 @@ def start_new_round(message):
         f"Играем на <b>{bet}</b>\n"
         f"У тебя всего {player_score} у меня {dealer_score}\n"
         f"Смотри на карты\n\n"
-        f"Твои карты: {get_hand_display(game['player_hand'])}\n"
+        f"Твои карты: {get_hand_display(game.player_hand)}\n"
         f"Очков: {player_value}\n\n"
-        f"Мои карты: {get_hand_display(game['dealer_hand'], hide_first=True)}\n"
+        f"Мои карты: {get_hand_display(game.dealer_hand, hide_first=True)}\n"
         f"Первая карта скрыта\n\n"
         f"Что выбираешь?:"
     )
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    btn_hit = types.InlineKeyboardButton("Давай карту", callback_data="hit")
-    btn_stand = types.InlineKeyboardButton("Хватит", callback_data="stand")
-    btn_surrender = types.InlineKeyboardButton("Сдаюсь", callback_data="surrender")
-    markup.add(btn_hit, btn_stand, btn_surrender)
+    markup = keyboards.GAME_ACTIONS
     if hasattr(message, "message_id"):
-        try:
-            bot.edit_message_text(
-                game_text,
-                message.chat.id,
-                message.message_id,
-                reply_markup=markup,
-                parse_mode="HTML",
-            )
-        except Exception as e:
-            bot.send_message(
-                message.chat.id, game_text, reply_markup=markup, parse_mode="HTML"
-            )
+        outbound.edit_message_text(
+            game_text,
+            message.chat.id,
+            message.message_id,
+            reply_markup=markup,
+            parse_mode="HTML",
+            fallback=True,
+        )
     else:
-        bot.send_message(
+        outbound.send_message(
             message.chat.id, game_text, reply_markup=markup, parse_mode="HTML"
         )
 
@@ -1518,31 +1824,28 @@ def game_callback(call):
         name = user_names.get(user_id, "фраерок")
         if items_deleted:
             deleted_text = ", ".join(items_deleted)
-            bot.answer_callback_query(call.id, f" Сбросил {deleted_text}")
-            try:
-                bot.edit_message_text(
-                    f" {name}, решил соскочить с игры!\n"
-                    f" Сброшено: {deleted_text}.\n\n"
-                    f"Хочешь начать заново? — /сыграем?",
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=None,
-                    parse_mode="HTML",
-                )
-            except:
-                bot.send_message(
-                    call.message.chat.id,
+            outbound.answer_callback_query(call.id, f" Сбросил {deleted_text}")
+            outbound.edit_message_text(
+                f" {name}, решил соскочить с игры!\n"
+                f" Сброшено: {deleted_text}.\n\n"
+                f"Хочешь начать заново? — /сыграем?",
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=None,
+                parse_mode="HTML",
+                fallback=True,
+                fallback_text=(
                     f" {name}, соскочил с игры.\n"
                     f"Сброшено: {deleted_text}.\n\n"
-                    f"Хочешь начать заново? — /сыграем?",
-                    parse_mode="HTML",
-                )
+                    f"Хочешь начать заново? — /сыграем?"
+                ),
+            )
         else:
-            bot.answer_callback_query(call.id, " Нет активной игры")
+            outbound.answer_callback_query(call.id, " Нет активной игры")
         return
     if call.data == "continue":
         if user_id not in user_bets:
-            bot.answer_callback_query(call.id, "Сначала сделай ставку!")
+            outbound.answer_callback_query(call.id, "Сначала сделай ставку!")
             return
         if user_id in active_games:
             del active_games[user_id]
@@ -1556,206 +1859,34 @@ def game_callback(call):
                 self.chat = Chat(uid)
 
         start_new_round(SimpleMessage(user_id))
-        bot.answer_callback_query(call.id)
+        outbound.answer_callback_query(call.id)
         return
     if user_id not in active_games:
-        bot.answer_callback_query(call.id, "Игра не найдена")
+        outbound.answer_callback_query(call.id, "Игра не найдена")
         return
     game = active_games[user_id]
     if call.data == "hit":
-        game["player_hand"].append(deal_card())
-        player_value = calculate_hand_value(game["player_hand"])
-        if player_value > 21:
-            game["game_state"] = "game_over"
+        game.player_hand.add(get_user_shoe(user_id).deal())
+        player_value = game.player_hand.value
+        if is_bust(player_value):
+            game.game_state = "game_over"
             end_round_with_humor(call.message, user_id, "player_bust")
         else:
             update_game_display(call.message, user_id)
     elif call.data == "stand":
-        game["game_state"] = "dealer_turn"
+        game.game_state = "dealer_turn"
         dealer_play_with_humor(call.message, user_id)
     elif call.data == "surrender":
-        game["game_state"] = "game_over"
+        game.game_state = "game_over"
         end_round_with_humor(call.message, user_id, "surrender")
-    bot.answer_callback_query(call.id)
+    outbound.answer_callback_query(call.id)
 
 
 # ======================= ОРИГИНАЛЬНЫЙ КОД ОРАКУЛА =======================
-templates = {
-    "default_username": [
-        "На, {name}, держи мудрость...",
-        "Слушай сюда, {name}, вот что скажу...",
-        "Держи, {name}, лови мысль...",
-        "Вот тебе, {name}, на раздумье...",
-        "Запомни, {name}, эти слова...",
-    ],
-    "custom_name": [
-        "Вот тебе наводочка, {name},",
-        "Слушай внимательно, {name},",
-        "Заруби себе на носу, {name},",
-        "Прими к сведению, {name},",
-        "Задумайся, {name}, над этим:",
-    ],
-    "no_name": [
-        "Такая для тебя новость:",
-        "Вот что скажу:",
-        "Держи мысль:",
-        "Слушай сюда:",
-        "Запомни эти слова:",
-    ],
-}
-
-когда = [
-    "Когда в гривнах шакал панибрата найдёт",
-    "когда свист на горе раком встанет",
-    "Когда на бутыре червонец щербатым станет",
-    "Когда в беспределе засуха братву накроет",
-    "Когда в общаге левый шухер царём пройдёт",
-    "Когда в тёмной малине фраер засветится",
-    "Когда на стрелке мусор понятия примет",
-    "Когда в чёрном ходу кореш в законе сядет",
-    "Когда в шухере базар на волю выйдет",
-    " Когда в ментовском кармане совесть проклюнется",
-]
-
-почему = [
-    "Потому что хаза не спрашивает — она диктует",
-    "хочешь понять — сядь на шконку, срок откинь, тогда и поговорим.",
-    "Потому что на зоне один закон — или воруешь, или воруют тебя",
-    "Потому что жизнь — это не малина, тут каждый фраер платит за свой косяк",
-    "Потому что ветер в тюрьме не по понятиям дует — он с камеры на камеру переходит.",
-    "Сучить не будет, но скажу: кто вор — тот и ответ знает.",
-    "Потому что у судьбы, как у мента, свои расклады и своя правда",
-    "Потому что колесо крутится — сегодня ты в верхах, завтра внизу, а почему — не нам решать.",
-    'если бы все "почему" да "как" знали — зона бы пустовала, а она полна',
-    "Потому что расклад такой: жизнь — не пазл картинку сам не соберешь",
-]
-
-как = [
-    "Как в тихом омуте — без лишней пены, но с глубиной. Тема закрыта.",
-    "Как по наколке — раз и навсегда. Точка.",
-    "Как нож в масло — тихо и навсегда.",
-    "Как приговор — без апелляции. Конец разговору",
-    "Как замок на сундуке — открывать не тебе. Забудь",
-    "Как фраер ушёл — без обратного хода",
-    "Как по шаблону — без отсебятины",
-    "Как в карцере — без лишних глаз и разговоров",
-    "Как дым по ветру — видно, но не поймаешь",
-]
-
-кто = [
-    "Тот, чьё имя на зоне шепчут, а вслух не зовут",
-    "Братва, которая с нами за одном столом сидела, пока ты щи хлебал",
-    "Кто вопросы задаёт — тот с ответом не всегда спит спокойно. Завязывай.",
-    "Кто последний раз спрашивал — до сих пор ищет. Не повторяй.",
-    "Кто знает — тот молчит. Кто спрашивает — тот лишний. Будь здоров",
-    "Тот, кого в глаза не видел, а в спину не тыкали. И лучше не знать.",
-]
-
-куда = [
-    "Куда все уходят, но никто не возвращается. Лучше не спрашивай.",
-    "Куда ветер зоны дует — не нам менять его направление",
-    "Куда последний вагон идёт — билет в один конец. Не твой маршрут",
-    "Куда глаза смотрят, а ноги не доходят. Оставь как есть",
-    "Куда тень падает — там и ответ, но светить туда не стоит",
-    "Куда дорога кривая ведёт — прямым ходом не дойти. Выпей чаю и сиди",
-]
-
-кого = [
-    "Того, чьё имя на зоне знают все, но вслух не называют",
-    "Того, чьи руки чище, а слово твёрже камня",
-    "Человека, на чьё молчание можно поставить жизнь",
-    "Того, кто в шторм не свернёт и пайку последнюю разделит",
-    " Чью спину ветер не гнёт, а уважение гнёт",
-    "Чьи глаза на стрелке больше слов говорят.",
-    'Братаан, чья фраза "по понятиям" — уже закон',
-    "Того, кто в чужом кармане не шарит, но свой не пустит",
-    "Чьё имя шепчут, когда нужна правда, а не треп.",
-]
-
-ты = [
-    "я тебя на «вы» дважды предупредил. Третий раз будет без слов — по понятиям. Уважение или ходка, выбирай.",
-    "«Ты» у нас только к суке обращаются. Смени пластинку, пока цел",
-    "Мне «тыкали» последний раз в карцере. Тот фраер до сих пор щи хлебает через трубочку",
-    " У нас, сынок, «ты» — это как перчатка в лицо. Поднимать не спешат — боятся не успеть",
-    "«Ты» — это для мусора и шестёрок. Определись, кто ты, пока я не определил за тебя",
-    "Каждое «ты» — как гвоздь в крышку. У меня терпения на три гвоздя. Ты уже второй забиваешь",
-    "На «ты» здесь говорят только при последнем слове. Ты уверен, что хочешь услышать?",
-    "Меня на «ты» звали только отец да срок. Отец в могиле, срок — отбыт. Выводы сделай сам",
-    "«Ты» — это ключ от люка в подвал. Не крути его без надобности",
-    "«Ты» — это как шаг на лёд, который не проверен. Следующий шаг может быть последним. Выбери, куда ступать",
-]
-
-вы = [
-    "«вы» — это к барине в кабинете. У нас тут все по чину: кто по понятиям живет — тот и брат. А я не барин, я — человек закона. Говори как с равным, но не забывай дистанцию. Уважение — не в «выканье», а в честном слове",
-    "«Вы» оставь для судей в мантиях. Здесь власть не в словах, а в деле. Я живу по уставу, а не по этикету. Говори прямо — ясность дороже поклонов",
-    "«Вы» звучит как стук каблуков по плацу. Здесь власть другая — от взгляда и слова. Я не чиновник в кресле, я — закон в действии. Уважение покажешь делом, не речью",
-    "«Вы» — как шинель мусорская: снаружи блестит, а внутри пусто. У нас иерархия проще: есть воры, есть братва, есть фраера. Я из первых. Говори по-братски, но не панибратствуй",
-    " «Вы» — для тех, кто за решёткой впервые. Я здесь дом построил, не избу. Звание не титулом даётся, а кровью и сроком. Обращайся как к равному, но не забывай, кто держит порядок",
-    "«Вы» — это как замок без ключа: красиво, но бесполезно. У нас ценится слово, а не форма. Я не граф, я — вор. Разговор вёл бы по сути, а не по церемониям",
-    "«Вы» — звучит, будто ты с инспекцией пришёл. Здесь власть не по указу, а по праву сильного. Я этот право заслужил, а не унаследовал. Говори без лакейских поклонов — услышу",
-    "«Вы» — для папских прихвостней. У нас статус определяется не словами, а поступками. Я не из благородных — я из избранных. Уважение прояви в глазах, а не в речах.",
-]
-
-sp = [
-    "Кто не сидел — тот не жил.",
-    "Лучше быть головой в грязи, чем жопой в облаках.",
-    "Свети ворам, а не ментам: полжизни здесь, полжизни там!",
-    "Ворам - по масти, мусорам - по пасти!",
-    "Шоколад ни в чём не виноват. Пацан к успеху шёл. Не получилось, не фортануло",
-    "Свобода — это когда тебя не ищет.",
-    "Попал — не сдавай, сдался — не жалуйся!",
-    "Сильному - мясо, слабому - кость!",
-    "Сучья кровь не водица — не прощается",
-    "Тюрьма плачет по тебе, а ты на воле",
-    "Не люби деньги - погубят, не люби женщин - обманут, а люби волю.",
-    "Помни: «дать по морде» и «дать в морду» — это одно и то же. А «дать по жопе» и «дать в жопу» — нет!",
-    "Не плачь отец, что сын твой вор, пусть плачет тот, чей сын козел!",
-    "Говори кратко, проси мало, уходи борзо!",
-    "Бей первым! Бог простит, люди поймут.",
-    "Не умеешь воровать, не воруй",
-    "Добро должно быть с зубами, а петух с перьями",
-    "Мать простит, а зона — никогда",
-    "Жопа — как воля: пока своя — не ценишь, а потерял — не вернёшь",
-    "Порядочный арестант в петухи не опустится, даже если жизнь на кону",
-    "Нет на зоне краше, петуха на параше!",
-]
-
-keyword_lists = {
-    "когда": когда,
-    "почему": почему,
-    "как": как,
-    "кто": кто,
-    "куда": куда,
-    "кого": кого,
-    "ты": ты,
-    "вы": вы,
-}
-
-
-def get_response_by_keywords(question):
-    question_lower = question.lower()
-    if "ты" in question_lower:
-        if (
-            " ты " in f" {question_lower} "
-            or question_lower.startswith("ты ")
-            or question_lower.endswith(" ты")
-        ):
-            return random.choice(ты)
-    found_keywords = []
-    for keyword in keyword_lists:
-        if keyword != " ты ":
-            if (
-                f" {keyword} " in f" {question_lower} "
-                or question_lower.startswith(f"{keyword} ")
-                or question_lower.endswith(f" {keyword}")
-            ):
-                found_keywords.append(keyword)
-    if len(found_keywords) > 1:
-        return random.choice(sp)
-    elif len(found_keywords) == 1:
-        return random.choice(keyword_lists[found_keywords[0]])
-    else:
-        return random.choice(sp)
+# Тексты ответов живут в corpus.json и перечитываются без перезапуска бота
+corpus = ReloadableCorpus(CORPUS_PATH)
+# (chat_id, версия корпуса, нормализованный вопрос): ответ
+answer_cache = TTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
 
 
 default_nicks = {
@@ -1784,15 +1915,17 @@ def report_to_dev(message):
     user_id = message.from_user.id
     record_user_visit(user_id)  # Записываем посещение
     name = user_names.get(user_id, "фраерок")
-    bot.send_message(
+    outbound.send_message(
         message.chat.id,
         f" Ну что {name}, хочешь доложить администрации об чем то?\n"
         f"Кидай маляву, и я передам ее кому надо:\n",
         parse_mode="HTML",
     )
-    time.sleep(1)  # Задержка 1 секунда
-    msg = bot.send_message(message.chat.id, "Пой птичка не стесняйся...")
-    bot.register_next_step_handler(msg, process_dev_message)
+    bot.register_next_step_handler_by_chat_id(message.chat.id, process_dev_message)
+    # Задержка 1 секунда без блокировки воркера
+    dispatcher.call_later(
+        1, outbound.send_message, message.chat.id, "Пой птичка не стесняйся..."
+    )
 
 
 def process_dev_message(message):
@@ -1800,17 +1933,15 @@ def process_dev_message(message):
     record_user_visit(user_id)  # Записываем посещение
     name = user_names.get(user_id, "фраерок")
     user_message = message.text
-    try:
-        bot.send_message(
-            585578360,
-            f"Сообщение от блатного оракула\n\n"
-            f"👤 От: {name} (ID: {user_id})\n"
-            f"⏰ {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-            f"✉️ {user_message}\n\n",
-        )
-    except Exception as e:
-        print(f"❌ Ошибка отправки: {e}")
-    bot.send_message(
+    outbound.send_message(
+        585578360,
+        f"Сообщение от блатного оракула\n\n"
+        f"👤 От: {name} (ID: {user_id})\n"
+        f"⏰ {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"✉️ {user_message}\n\n",
+        priority=PRIORITY_BACKGROUND,
+    )
+    outbound.send_message(
         message.chat.id,
         f" {name}, твои действия зафиксированы\n"
         f"«{user_message[:100]}...»\n\n"
@@ -1825,6 +1956,8 @@ def reset_game_data(user_id):
     if user_id in active_games:
         del active_games[user_id]
         items_deleted.append("активную игру")
+    if user_id in user_shoes:
+        del user_shoes[user_id]
     if user_id in user_bets:
         del user_bets[user_id]
         items_deleted.append("ставку")
@@ -1868,15 +2001,7 @@ def send_welcome(message):
         "• /ссучиться - связаться с администрацией (жалобы и предложения)\n"
         "• /принять - принять приглашение на игру\n"
     )
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    btn1 = types.KeyboardButton("/поинтересоваться")
-    btn2 = types.KeyboardButton("/сыграем?")
-    btn3 = types.KeyboardButton("/погремуха")
-    btn4 = types.KeyboardButton("/расход")
-    btn5 = types.KeyboardButton("/не_оставь_в_беде")
-    btn6 = types.KeyboardButton("/ссучиться")
-    markup.add(btn1, btn2, btn3, btn4, btn5, btn6)
-    bot.send_message(message.chat.id, welcome_text, reply_markup=markup)
+    outbound.send_message(message.chat.id, welcome_text, reply_markup=keyboards.MAIN_MENU)
 
 
 @bot.message_handler(commands=["погремуха"])
@@ -1889,8 +2014,8 @@ def ask_name(message):
         "Хочешь уважения, представься\n"
         "(или напиши 'нет', чтобы оставить все как есть):"
     )
-    msg = bot.send_message(message.chat.id, msg_text)
-    bot.register_next_step_handler(msg, process_name)
+    outbound.send_message(message.chat.id, msg_text)
+    bot.register_next_step_handler_by_chat_id(message.chat.id, process_name)
 
 
 def process_name(message):
@@ -1898,7 +2023,7 @@ def process_name(message):
     record_user_visit(user_id)  # Записываем посещение
     name = message.text.strip()
     if name.lower() in ["нет", "no", "оставить", "так и быть", "пусть будет так"]:
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             f"Добро, оставим как есть {user_names.get(user_id, 'на старых')} .",
         )
@@ -1912,9 +2037,9 @@ def process_name(message):
         and name != "/ссучиться"
     ):
         user_names[user_id] = name
-        bot.send_message(message.chat.id, f"Приветствую тебя {name}. С чем пожаловал?")
+        outbound.send_message(message.chat.id, f"Приветствую тебя {name}. С чем пожаловал?")
     else:
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "У порядочного арестанта должна быть погремуха!\nКак вспомнишь обращайся.",
         )
@@ -1944,14 +2069,8 @@ def ask_question(message):
             )
             user_names[user_id] = random.choice(default_nicks[gender_guess])
     name = user_names[user_id]
-    msg = bot.send_message(message.chat.id, f"Выкладывай {name}, че там?")
-    bot.register_next_step_handler(msg, process_question)
-
-
-def get_random_template(template_type):
-    if template_type in templates:
-        return random.choice(templates[template_type])
-    return "Вот что скажу:"
+    outbound.send_message(message.chat.id, f"Выкладывай {name}, че там?")
+    bot.register_next_step_handler_by_chat_id(message.chat.id, process_question)
 
 
 def process_question(message):
@@ -1971,7 +2090,7 @@ def process_question(message):
         ]
         or len(words) <= 1
     ):
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Вопрос как предъява, не может быть пустым!\nПиши че хотел.",
         )
@@ -1988,39 +2107,56 @@ def process_question(message):
             )
             user_names[user_id] = random.choice(default_nicks[gender_guess])
     name = user_names[user_id]
-    bot.send_chat_action(message.chat.id, "typing")
-    response = get_response_by_keywords(question)
-    if user_id in user_names:
-        name = user_names[user_id]
-        if (
-            message.from_user.username
-            and user_names[user_id] == f"@{message.from_user.username}"
-        ):
-            template = get_random_template("default_username")
-            bot.send_message(message.chat.id, template.format(name=name))
-            bot.send_chat_action(message.chat.id, "typing")
-            time.sleep(1)
-            bot.send_message(message.chat.id, f"«<b>{response}</b>»", parse_mode="HTML")
-        elif (
-            message.from_user.username
-            and user_names[user_id] != f"@{message.from_user.username}"
-        ):
-            template = get_random_template("custom_name")
-            bot.send_message(message.chat.id, template.format(name=name))
-            bot.send_chat_action(message.chat.id, "typing")
-            time.sleep(1)
-            bot.send_message(message.chat.id, f"«<b>{response}</b>»", parse_mode="HTML")
-        else:
-            template = get_random_template("no_name")
-            bot.send_message(message.chat.id, template)
-            bot.send_chat_action(message.chat.id, "typing")
-            time.sleep(1)
-            bot.send_message(message.chat.id, f"«<b>{response}</b>»", parse_mode="HTML")
-    markup = types.InlineKeyboardMarkup()
-    btn_yes = types.InlineKeyboardButton("Да", callback_data="ask_again")
-    btn_no = types.InlineKeyboardButton("Нет", callback_data="stop_talking")
-    markup.add(btn_yes, btn_no)
-    bot.send_message(message.chat.id, "Еще вопросы?", reply_markup=markup)
+    # Весь вопрос отвечаем из одного снимка корпуса, даже если его сейчас перезагружают
+    texts = corpus.current
+    normalized = texts.normalizer.normalize(question)
+    cache_key = (message.chat.id, texts.version, normalized)
+    if ANSWER_CACHE_TTL > 0:
+        response = answer_cache.get(cache_key)
+        if response is not None:
+            # Тот же вопрос в чате только что задавали — тот же ответ, без шаблона и пауз
+            outbound.send_message(
+                message.chat.id,
+                f"«<b>{response}</b>»",
+                parse_mode="HTML",
+                reply_to_message_id=message.message_id,
+            )
+            return
+    response = texts.answer(question, normalized)
+    if ANSWER_CACHE_TTL > 0:
+        answer_cache.put(cache_key, response)
+    intro = get_oracle_intro(texts, message.from_user, name)
+
+    if REPLY_STYLE == "compact":
+        # Один запрос к Telegram вместо пяти
+        outbound.send_message(
+            message.chat.id,
+            f"{html.escape(intro)}\n\n«<b>{response}</b>»\n\nЕще вопросы?",
+            reply_markup=keyboards.ASK_AGAIN,
+            parse_mode="HTML",
+        )
+        return
+
+    outbound.send_chat_action(message.chat.id, "typing")
+    outbound.send_message(message.chat.id, intro)
+    outbound.send_chat_action(message.chat.id, "typing")
+    # Ответ уходит через секунду "раздумий", воркер на это время не занимаем
+    dispatcher.call_later(1, send_oracle_answer, message.chat.id, response)
+
+
+def get_oracle_intro(texts, from_user, name):
+    """Обращение перед ответом: по нику, по выданной погремухе или безымянное"""
+    if from_user.username and name == f"@{from_user.username}":
+        return texts.template("default_username").format(name=name)
+    if from_user.username:
+        return texts.template("custom_name").format(name=name)
+    return texts.template("no_name")
+
+
+def send_oracle_answer(chat_id, response):
+    """Отправляет ответ оракула и предлагает задать еще вопрос"""
+    outbound.send_message(chat_id, f"«<b>{response}</b>»", parse_mode="HTML")
+    outbound.send_message(chat_id, "Еще вопросы?", reply_markup=keyboards.ASK_AGAIN)
 
 
 @bot.callback_query_handler(func=lambda call: True)
@@ -2028,7 +2164,8 @@ def callback_query(call):
     user_id = call.from_user.id
     record_user_visit(user_id)  # Записываем посещение
     if user_id not in user_names:
-        user_info = bot.get_chat(user_id)
+        # Имя берем из самого апдейта: get_chat занял бы поток обработчика запросом к API
+        user_info = call.from_user
         if user_info.username:
             user_names[user_id] = f"@{user_info.username}"
         else:
@@ -2041,13 +2178,13 @@ def callback_query(call):
             user_names[user_id] = random.choice(default_nicks[gender_guess])
     name = user_names[user_id]
     if call.data == "ask_again":
-        msg = bot.send_message(call.message.chat.id, "Ну задавай")
-        bot.register_next_step_handler(msg, process_question)
+        outbound.send_message(call.message.chat.id, "Ну задавай")
+        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_question)
     elif call.data == "stop_talking":
-        bot.send_message(
+        outbound.send_message(
             call.message.chat.id, f"Бывай {name}! Заходи не бойся, выходи не плачь."
         )
-        bot.edit_message_reply_markup(
+        outbound.edit_message_reply_markup(
             call.message.chat.id, call.message.message_id, reply_markup=None
         )
 
@@ -2073,10 +2210,11 @@ def send_help(message):
         "/расход - закончить разговор (стереть имя)\n"
         "/ссучиться - кинуть маляву куму (жалобы и предложения)\n"
         "/сыграем? - игра в 21 (пока сумме не будет больше 101)\n"
-        "/принять - принять приглашение на игру от другого игрока\n\n"
+        "/принять - принять приглашение на игру от другого игрока\n"
+        "/рейтинг - кто в авторитете за игровым столом\n\n"
         "Консультирую 24/7 по всем вопросам!"
     )
-    bot.send_message(message.chat.id, help_text, parse_mode="HTML")
+    outbound.send_message(message.chat.id, help_text, parse_mode="HTML")
 
 
 @bot.message_handler(commands=["расход"])
@@ -2091,7 +2229,7 @@ def stop_talking(message):
             response_text = f" {name}, решил соскочить!\nигра закончена"
         else:
             response_text = f" Бывай {name}, заходи не бойся, уходи не плачь\n"
-        bot.send_message(message.chat.id, response_text, parse_mode="HTML")
+        outbound.send_message(message.chat.id, response_text, parse_mode="HTML")
     else:
         game_items = reset_game_data(user_id)
         if game_items:
@@ -2101,7 +2239,93 @@ def stop_talking(message):
             )
         else:
             response_text = f" Жизнь ворам, фарту масти!"
-        bot.send_message(message.chat.id, response_text, parse_mode="HTML")
+        outbound.send_message(message.chat.id, response_text, parse_mode="HTML")
+
+
+@bot.message_handler(commands=["рейтинг"])
+def show_leaderboard(message):
+    """Топ игроков по выигранным турнирам и место спросившего"""
+    user_id = message.from_user.id
+    record_user_visit(user_id)  # Записываем посещение
+    name = user_names.get(user_id, "фраерок")
+    top = player_stats.top(LEADERBOARD_SIZE)
+    if not top:
+        outbound.send_message(
+            message.chat.id, f"{name}, в рейтинге пока пусто. Будь первым — /сыграем?"
+        )
+        return
+
+    lines = ["🏆 <b>Авторитеты за игровым столом</b>\n"]
+    for place, player_id, stats in top:
+        player_name = html.escape(user_names.get(player_id, "фраерок"))
+        lines.append(
+            f"{place}. {player_name} — турниров {stats.tournaments_won}, "
+            f"раундов {stats.wins}/{stats.rounds}"
+        )
+
+    stats = player_stats.get(user_id)
+    if stats is None:
+        lines.append(f"\n{html.escape(name)}, тебя в рейтинге нет. Сыграй — /сыграем?")
+    else:
+        lines.append(
+            f"\n<b>{html.escape(name)}</b>, ты на {player_stats.rank(user_id)} месте "
+            f"из {len(player_stats)}\n"
+            f"Турниров: выиграл {stats.tournaments_won}, слил {stats.tournaments_lost}\n"
+            f"Раундов: {stats.rounds} (взял {stats.wins}, слил {stats.losses}, "
+            f"ничьих {stats.pushes})\n"
+            f"Переборов: {stats.busts}, сдался: {stats.surrenders}\n"
+            f"В среднем на руке: {stats.average_hand:.1f}"
+        )
+    outbound.send_message(message.chat.id, "\n".join(lines), parse_mode="HTML")
+
+
+@bot.message_handler(commands=["разбор"])
+def replay_tournament(message):
+    """Для админа: порядок карт в турнире из истории по его зерну"""
+    if message.from_user.id != ADMIN_ID:
+        return
+    parts = message.text.split()
+    # Разбирать можно турниры из окна последних записей истории
+    tournaments = [g for g in game_history.recent() if g.get("seed") is not None]
+    if not tournaments:
+        outbound.send_message(message.chat.id, "В истории нет турниров с зерном")
+        return
+    try:
+        # /разбор N — N-й с конца турнир, по умолчанию последний
+        record = tournaments[-int(parts[1]) if len(parts) > 1 else -1]
+    except (ValueError, IndexError):
+        outbound.send_message(message.chat.id, f"Формат: /разбор [1..{len(tournaments)}]")
+        return
+
+    orders = replay_shoe(record["seed"], record["rng"], record["decks"], record["shuffles"])
+    lines = [
+        f"Турнир {record['datetime_str']}, {record['username']} ({record['user_id']})",
+        f"Генератор: {record['rng']}, зерно: <code>{record['seed']}</code>, "
+        f"колод: {record['decks']}, тасовок: {record['shuffles']}",
+    ]
+    for number, order in enumerate(orders, 1):
+        lines.append(f"\nТасовка {number}:\n" + " ".join(CARD_NAMES[card] for card in order))
+    text = "\n".join(lines)
+    # Длинный разбор режем под лимит сообщения Telegram
+    for start in range(0, len(text), 4000):
+        outbound.send_message(message.chat.id, text[start : start + 4000], parse_mode="HTML")
+
+
+@bot.message_handler(commands=["перечитать"])
+def reload_corpus(message):
+    """Для админа: перечитать corpus.json, не перезапуская бота"""
+    if message.from_user.id != ADMIN_ID:
+        return
+    try:
+        texts = corpus.reload()
+    except CorpusError as e:
+        outbound.send_message(message.chat.id, f"Корпус не перезагружен, работаем на старом:\n{e}")
+        return
+    outbound.send_message(
+        message.chat.id,
+        f"Корпус перезагружен, версия {texts.version}: "
+        f"{len(texts.answers)} ключей, {len(texts.fallback)} общих ответов",
+    )
 
 
 @bot.message_handler(func=lambda message: True)
@@ -2131,9 +2355,23 @@ def run_flask():
     app.run(host="0.0.0.0", port=port)
 
 
+def start_webhook():
+    """Регистрирует вебхук в Telegram"""
+    webhook_url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+    bot.remove_webhook()
+    bot.set_webhook(
+        url=webhook_url,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=UPDATE_WORKERS,
+    )
+    print(f"🪝 Вебхук установлен: {webhook_url} (воркеров: {UPDATE_WORKERS})")
+
+
 def run_bot():
     """Запускает Telegram бота"""
     print("🤖 Telegram бот запускается...")
+    # getUpdates не работает, пока висит вебхук от прошлого запуска
+    bot.remove_webhook()
     bot.infinity_polling(timeout=60, long_polling_timeout=60)
 
 
@@ -2146,16 +2384,29 @@ def run_scheduler():
 if __name__ == "__main__":
     print("🚀 Блатной оракул запущен на Render.com")
 
-    # Запускаем Flask в отдельном потоке
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-
     # Запускаем планировщик для ежедневной статистики
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
 
-    # Запускаем бота в основном потоке
-    run_bot()
+    # Запускаем фоновое сохранение состояния и воркеры, которые обрабатывают апдейты
+    store.start()
+    game_history.start()
+    outbound.start()
+    dispatcher.start()
+    if CORPUS_WATCH_INTERVAL > 0:
+        corpus.watch(CORPUS_WATCH_INTERVAL)
+
+    if BOT_MODE == "webhook":
+        # Апдейты приходят во Flask, поэтому он и работает в основном потоке
+        start_webhook()
+        run_flask()
+    else:
+        # Запускаем Flask в отдельном потоке
+        flask_thread = threading.Thread(target=run_flask, daemon=True)
+        flask_thread.start()
+
+        # Запускаем бота в основном потоке
+        run_bot()
 
 
 
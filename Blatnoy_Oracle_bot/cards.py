@@ -0,0 +1,213 @@
+"""Карточная колода и подсчет очков.
+
+Карта — число 0..51, индекс в card_deck: card // 4 дает достоинство, card % 4 — масть.
+Очки и надписи карт посчитаны заранее в таблицах, а рука хранит текущую сумму,
+поэтому добавление карты и подсчет очков не перебирают всю руку.
+Карты сдаются из башмака (Shoe): как за настоящим столом, без повторов внутри колоды.
+"""
+
+from rng import DEFAULT_PROVIDER, make_rng, new_seed
+from rules import BLACKJACK
+
+card_deck = [
+    "2♠",
+    "2♥",
+    "2♦",
+    "2♣",
+    "3♠",
+    "3♥",
+    "3♦",
+    "3♣",
+    "4♠",
+    "4♥",
+    "4♦",
+    "4♣",
+    "5♠",
+    "5♥",
+    "5♦",
+    "5♣",
+    "6♠",
+    "6♥",
+    "6♦",
+    "6♣",
+    "7♠",
+    "7♥",
+    "7♦",
+    "7♣",
+    "8♠",
+    "8♥",
+    "8♦",
+    "8♣",
+    "9♠",
+    "9♥",
+    "9♦",
+    "9♣",
+    "10♠",
+    "10♥",
+    "10♦",
+    "10♣",
+    "В♠",
+    "В♥",
+    "В♦",
+    "В♣",  # Валет
+    "Д♠",
+    "Д♥",
+    "Д♦",
+    "Д♣",  # Дама
+    "К♠",
+    "К♥",
+    "К♦",
+    "К♣",  # Король
+    "Т♠",
+    "Т♥",
+    "Т♦",
+    "Т♣",  # Туз
+]
+
+# Очки по достоинству: 2..10, валет, дама, король, туз
+RANK_VALUES = (2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11)
+ACE_RANK = len(RANK_VALUES) - 1
+
+# Таблицы по номеру карты: надпись, очки (туз — 11) и "жесткие" очки (туз — 1)
+CARD_NAMES = tuple(card_deck)
+CARD_VALUES = bytes(RANK_VALUES[card // 4] for card in range(len(card_deck)))
+HARD_VALUES = bytes(
+    1 if card // 4 == ACE_RANK else CARD_VALUES[card] for card in range(len(card_deck))
+)
+IS_ACE = bytes(int(card // 4 == ACE_RANK) for card in range(len(card_deck)))
+
+
+def soft_total(hard, aces):
+    """Очки руки: один туз считается за 11, если это не дает перебор.
+
+    Два туза по 11 — всегда перебор, поэтому "мягким" бывает максимум один туз,
+    и это то же самое, что считать все тузы по 11 и сбрасывать по 10 при переборе.
+    """
+    if aces and hard + 10 <= BLACKJACK:
+        return hard + 10
+    return hard
+
+
+class Hand:
+    """Карты на руке с накопленной суммой: добавление карты и очки — O(1)"""
+
+    __slots__ = ("cards", "hard", "aces")
+
+    def __init__(self, cards=()):
+        self.cards = bytes(cards)
+        hard = 0
+        aces = 0
+        for card in self.cards:
+            hard += HARD_VALUES[card]
+            aces += IS_ACE[card]
+        self.hard = hard
+        self.aces = aces
+
+    def add(self, card):
+        self.cards += bytes((card,))
+        self.hard += HARD_VALUES[card]
+        self.aces += IS_ACE[card]
+
+    @property
+    def value(self):
+        return soft_total(self.hard, self.aces)
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __getitem__(self, index):
+        return self.cards[index]
+
+    def __repr__(self):
+        return f"Hand({get_hand_display(self)} = {self.value})"
+
+
+def get_card_value(card):
+    return CARD_VALUES[card]
+
+
+def calculate_hand_value(cards):
+    """Очки для произвольной последовательности номеров карт"""
+    hard = 0
+    aces = 0
+    for card in cards:
+        hard += HARD_VALUES[card]
+        aces += IS_ACE[card]
+    return soft_total(hard, aces)
+
+
+# Нераспечатанная колода: карты по порядку
+FRESH_DECK = bytes(range(len(card_deck)))
+
+
+class Shoe:
+    """Башмак из нескольких колод.
+
+    Карты один раз перемешиваются генератором из rng.py в заранее выделенном массиве,
+    а раздача — просто сдвиг индекса. Когда роздано penetration башмака, перед
+    следующим раундом колоды тасуются заново (needs_shuffle).
+
+    Каждая тасовка начинается с нераспечатанной колоды, а генератор выводится
+    из зерна и номера тасовки, так что по (rng, seed, decks) порядок карт
+    восстанавливается без хранения состояния генератора (см. replay_shoe).
+    """
+
+    __slots__ = ("cards", "position", "cut", "rng", "seed", "shuffles")
+
+    def __init__(self, decks=1, penetration=0.75, seed=None, rng=DEFAULT_PROVIDER):
+        self.cards = bytearray(len(card_deck) * decks)
+        self.cut = max(1, int(len(self.cards) * penetration))
+        self.rng = rng
+        self.seed = new_seed() if seed is None else seed
+        self.shuffles = 0
+        self.shuffle()
+
+    @property
+    def decks(self):
+        return len(self.cards) // len(card_deck)
+
+    def shuffle(self):
+        cards = self.cards
+        cards[:] = FRESH_DECK * self.decks
+        make_rng(self.rng, self.seed, self.shuffles).shuffle(cards)
+        self.position = 0
+        self.shuffles += 1
+
+    @property
+    def needs_shuffle(self):
+        """Дошли до отсечки — пора тасовать перед следующим раундом"""
+        return self.position >= self.cut
+
+    def deal(self):
+        try:
+            card = self.cards[self.position]
+        except IndexError:
+            # Башмак кончился посреди раунда — тасуем сразу
+            self.shuffle()
+            card = self.cards[0]
+        self.position += 1
+        return card
+
+
+def replay_shoe(seed, rng=DEFAULT_PROVIDER, decks=1, shuffles=1):
+    """Порядок карт в каждой из первых shuffles тасовок башмака — для разбора спорных игр"""
+    shoe = Shoe(decks, seed=seed, rng=rng)
+    orders = [bytes(shoe.cards)]
+    for _ in range(shuffles - 1):
+        shoe.shuffle()
+        orders.append(bytes(shoe.cards))
+    return orders
+
+
+def new_hand(shoe):
+    """Раздача: рука из двух карт"""
+    return Hand((shoe.deal(), shoe.deal()))
+
+
+def get_hand_display(hand, hide_first=False):
+    if hide_first:
+        return f"❓ {CARD_NAMES[hand[1]]}"
+    return " ".join([CARD_NAMES[card] for card in hand])
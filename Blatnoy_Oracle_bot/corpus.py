@@ -0,0 +1,177 @@
+"""Тексты оракула: шаблоны обращений, ответы по ключевым словам и общие ответы.
+
+Корпус лежит в JSON (corpus.json рядом с ботом) и загружается в неизменяемый
+снимок Corpus: кортежи ответов, индекс ключ -> ответы, готовый KeywordMatcher
+и нормализатор вопросов с таблицей лемм из того же файла.
+Перезагрузка собирает новый снимок целиком и подменяет ссылку на него одним
+присваиванием — читатели берут corpus.current без блокировок и до конца
+вопроса работают со своим снимком.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+
+from matcher import KeywordMatcher
+from normalize import Normalizer, fold
+
+DEFAULT_TEMPLATE = "Вот что скажу:"
+
+
+class CorpusError(ValueError):
+    """Файл корпуса не читается или не проходит проверку"""
+
+
+class Corpus:
+    """Неизменяемый снимок корпуса"""
+
+    __slots__ = (
+        "version",
+        "templates",
+        "answers",
+        "fallback",
+        "matcher",
+        "normalizer",
+        "source",
+    )
+
+    def __init__(
+        self, version, templates, answers, fallback, priority=(), lemmas=None, source=None
+    ):
+        self.version = version
+        self.templates = templates
+        self.answers = answers
+        self.fallback = fallback
+        self.matcher = KeywordMatcher(answers, priority)
+        self.normalizer = Normalizer(lemmas)
+        self.source = source
+
+    @classmethod
+    def from_dict(cls, data, source=None):
+        def phrases(value, where):
+            if not isinstance(value, list) or not value:
+                raise CorpusError(f"{where}: нужен непустой список строк")
+            if not all(isinstance(item, str) and item for item in value):
+                raise CorpusError(f"{where}: все элементы должны быть непустыми строками")
+            return tuple(value)
+
+        if not isinstance(data, dict):
+            raise CorpusError("Корпус должен быть JSON-объектом")
+        templates = {
+            kind: phrases(items, f"templates.{kind}")
+            for kind, items in data.get("templates", {}).items()
+        }
+        answers = {
+            fold(keyword): phrases(items, f"answers.{keyword}")
+            for keyword, items in data.get("answers", {}).items()
+        }
+        lemmas = data.get("lemmas", {})
+        if not isinstance(lemmas, dict) or not all(
+            isinstance(form, str) and isinstance(lemma, str)
+            for form, lemma in lemmas.items()
+        ):
+            raise CorpusError("lemmas: нужен объект форма -> ключ")
+        return cls(
+            version=data.get("version", 0),
+            templates=templates,
+            answers=answers,
+            fallback=phrases(data.get("fallback"), "fallback"),
+            priority=tuple(fold(key) for key in data.get("priority", ())),
+            lemmas=lemmas,
+            source=source,
+        )
+
+    def template(self, kind):
+        """Случайный шаблон обращения данного вида"""
+        items = self.templates.get(kind)
+        return random.choice(items) if items else DEFAULT_TEMPLATE
+
+    def keyword(self, question, normalized=None):
+        """Ключ, по которому отвечать на вопрос, или None.
+
+        normalized — уже нормализованный вопрос, если он есть у вызывающего.
+        """
+        # Сначала как раньше, по точным словам: вопрос, который находил ключ без
+        # нормализации, получает тот же ответ, а нормализация только подбирает промахи
+        keyword = self.matcher.find(question.lower())
+        if keyword is None:
+            if normalized is None:
+                normalized = self.normalizer.normalize(question)
+            keyword = self.matcher.find(normalized)
+        return keyword
+
+    def answer(self, question, normalized=None):
+        """Ответ по ключевому слову вопроса или общий ответ"""
+        return self.answer_for(self.keyword(question, normalized))
+
+    def answer_for(self, keyword):
+        """Случайный ответ для найденного ключа (None — общий ответ)"""
+        if keyword is None:
+            return random.choice(self.fallback)
+        return random.choice(self.answers[keyword])
+
+
+def load_corpus(path):
+    """Читает и проверяет корпус; при ошибке бросает CorpusError"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise CorpusError(f"Не удалось прочитать {path}: {e}") from e
+    return Corpus.from_dict(data, source=path)
+
+
+class ReloadableCorpus:
+    """Текущий снимок корпуса с перезагрузкой по команде или по изменению файла"""
+
+    def __init__(self, path):
+        self.path = path
+        # Перезагрузки идут по одной, читатели этот замок не трогают
+        self._reload_lock = threading.Lock()
+        self._mtime = self._stat()
+        self.current = load_corpus(path)
+        self._watcher = None
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        """Перечитывает файл и подменяет снимок; при ошибке старый снимок остается"""
+        with self._reload_lock:
+            mtime = self._stat()
+            corpus = load_corpus(self.path)
+            self._mtime = mtime
+            self.current = corpus
+            return corpus
+
+    def reload_if_changed(self):
+        """Перечитывает файл, если он изменился; возвращает новый снимок или None"""
+        if self._stat() == self._mtime:
+            return None
+        return self.reload()
+
+    def watch(self, interval, on_error=print):
+        """Фоновый поток, который раз в interval секунд проверяет файл"""
+        if self._watcher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    corpus = self.reload_if_changed()
+                except CorpusError as e:
+                    # Запоминаем время битого файла, чтобы не ругаться каждые interval секунд
+                    self._mtime = self._stat()
+                    on_error(f"Корпус не перезагружен: {e}")
+                    continue
+                if corpus is not None:
+                    print(f"Корпус перезагружен, версия {corpus.version}")
+
+        self._watcher = threading.Thread(target=loop, name="corpus-watcher", daemon=True)
+        self._watcher.start()
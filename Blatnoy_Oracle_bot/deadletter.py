@@ -0,0 +1,144 @@
+"""Журнал исходящих запросов, которые так и не дошли до Telegram.
+
+Очередь отправки складывает сюда запрос, если Telegram отказал насовсем (400,
+403) или повторы с растущей паузой кончились. Формат — JSON Lines: одна строка
+на запрос с методом бота, аргументами и последней ошибкой. Разметку кнопок
+пишем ее JSON-строкой — telebot принимает ее в reply_markup так же, как объект.
+
+Переотправка из командной строки:
+
+    python deadletter.py                # отправить все
+    python deadletter.py --dry-run      # только показать
+    python deadletter.py --path other.jsonl --rate 5
+
+Что снова не ушло, дописывается обратно в журнал.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import telebot
+
+from outbound import retry_after
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dead_letters.jsonl")
+
+
+def _encode(value):
+    # Объекты telebot (клавиатуры) умеют сериализоваться сами
+    if hasattr(value, "to_json"):
+        return value.to_json()
+    return value
+
+
+class DeadLetterLog:
+    """Файл недоставленных запросов; дописывается из нескольких потоков"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def record(self, method, args, kwargs, error, attempts=1):
+        entry = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "method": method,
+            "args": [_encode(arg) for arg in args],
+            "kwargs": {key: _encode(value) for key, value in kwargs.items()},
+            "attempts": attempts,
+            "error": str(error),
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.written += 1
+
+    def take(self):
+        """Забирает все записи, освобождая файл под новые.
+
+        Файл сначала переименовывается: бот может дописывать журнал, пока идет
+        переотправка, и его новые записи не должны потеряться.
+        """
+        taking = self.path + ".replay"
+        with self._lock:
+            if not os.path.exists(taking):
+                try:
+                    os.replace(self.path, taking)
+                except FileNotFoundError:
+                    return []
+        entries = []
+        with open(taking, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    print(f"Строка {number} журнала повреждена, пропускаю")
+        os.remove(taking)
+        return entries
+
+    def restore(self, entries):
+        """Возвращает записи в журнал"""
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def replay(bot, log, rate=1.0, dry_run=False):
+    """Переотправляет записи журнала; возвращает (отправлено, осталось)"""
+    entries = log.take()
+    if dry_run:
+        for entry in entries:
+            print(f"{entry['time']} {entry['method']} {entry['args'][:1]}: {entry['error']}")
+        log.restore(entries)
+        return 0, len(entries)
+
+    failed = []
+    sent = 0
+    for entry in entries:
+        method = getattr(bot, entry["method"])
+        for _ in range(2):
+            try:
+                method(*entry["args"], **entry["kwargs"])
+            except Exception as e:
+                delay = retry_after(e)
+                if delay is not None:
+                    time.sleep(delay)
+                    continue
+                entry["attempts"] = entry.get("attempts", 0) + 1
+                entry["error"] = str(e)
+                failed.append(entry)
+            else:
+                sent += 1
+            break
+        else:
+            failed.append(entry)
+        time.sleep(1 / rate)
+    log.restore(failed)
+    return sent, len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Переотправка недоставленных сообщений")
+    parser.add_argument("--path", default=os.getenv("DEAD_LETTER_PATH", DEFAULT_PATH))
+    parser.add_argument("--rate", type=float, default=1.0, help="запросов в секунду")
+    parser.add_argument("--dry-run", action="store_true", help="только показать записи")
+    args = parser.parse_args()
+
+    token = os.getenv("TELEGRAM_TOKEN")
+    if not token and not args.dry_run:
+        parser.error("TELEGRAM_TOKEN не установлен")
+    bot = None if args.dry_run else telebot.TeleBot(token, threaded=False)
+    sent, left = replay(bot, DeadLetterLog(args.path), rate=args.rate, dry_run=args.dry_run)
+    print(f"Отправлено: {sent}, осталось в журнале: {left}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Диспетчер апдейтов: пул воркеров с сохранением порядка внутри одного чата"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+
+class ChatDispatcher:
+    """Пул воркеров для обработки апдейтов.
+
+    Задачи с одинаковым ключом (обычно это chat_id) выполняются строго по очереди,
+    задачи разных ключей — параллельно. Пока один чат ждет конца долгого раунда,
+    остальные чаты обслуживаются свободными воркерами.
+
+    Вместо time.sleep() обработчик вызывает call_later(): продолжение уходит
+    в кучу таймеров, воркер сразу освобождается, а очередь чата стоит на паузе
+    до срока — пользователь видит ту же паузу и тот же порядок сообщений.
+    """
+
+    def __init__(self, workers=4, max_pending=1000, name="dispatcher", task_context=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.name = name
+        # Фабрика контекст-менеджера, в котором выполняется каждая задача
+        # (например, store.unit_of_work для общего хранилища состояния)
+        self.task_context = task_context or nullcontext
+
+        self._lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        self._has_room = threading.Condition(self._lock)
+
+        # key: deque[(fn, args)] — ключ есть в словаре, пока у него есть задачи
+        # в очереди или одна из них прямо сейчас выполняется
+        self._queues = {}
+        # Ключи, чья следующая задача готова к запуску (ни один воркер их не держит)
+        self._ready = deque()
+        # Ключи, которые сейчас выполняются, и ключи на паузе до срока таймера
+        self._running = set()
+        self._held = set()
+        self._pending = 0
+        self._threads = []
+
+        # Куча таймеров: (срок по monotonic, порядковый номер, ключ)
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._timer_cond = threading.Condition(self._lock)
+        self._local = threading.local()
+
+    @property
+    def pending(self):
+        """Сколько задач ждет выполнения или выполняется"""
+        return self._pending
+
+    @property
+    def scheduled(self):
+        """Сколько отложенных продолжений ждут своего срока"""
+        return len(self._timers)
+
+    def current_key(self):
+        """Ключ задачи, которая выполняется в текущем потоке (или None)"""
+        return getattr(self._local, "key", None)
+
+    def start(self):
+        """Запускает потоки воркеров"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"{self.name}-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        timer = threading.Thread(target=self._run_timers, name=f"{self.name}-timer", daemon=True)
+        timer.start()
+        self._threads.append(timer)
+
+    def submit(self, key, fn, *args, block=True):
+        """Ставит задачу в очередь ключа.
+
+        Если очередь переполнена: при block=True ждет свободного места,
+        при block=False сразу возвращает False.
+        """
+        with self._lock:
+            while self._pending >= self.max_pending:
+                if not block:
+                    return False
+                self._has_room.wait()
+
+            tasks = self._queues.get(key)
+            if tasks is None:
+                self._queues[key] = deque([(fn, args)])
+                self._ready.append(key)
+                self._has_work.notify()
+            else:
+                # Ключ уже в работе или в очереди — воркер сам подхватит задачу
+                tasks.append((fn, args))
+            self._pending += 1
+        return True
+
+    def call_later(self, delay, fn, *args, key=None):
+        """Выполняет fn(*args) через delay секунд, не занимая воркер на время ожидания.
+
+        По умолчанию продолжение привязывается к ключу текущей задачи: оно встает
+        в голову очереди чата, и до его выполнения новые апдейты этого чата ждут.
+        За одну задачу можно отложить только одно продолжение — следующие шаги
+        откладываются цепочкой из самого продолжения.
+        """
+        if key is None:
+            key = self.current_key()
+        if key is None:
+            # Вызов не из воркера — заводим отдельную очередь под это продолжение
+            key = ("timer", next(self._timer_seq))
+
+        with self._lock:
+            if key in self._held:
+                raise RuntimeError(f"У ключа {key} уже есть отложенное продолжение")
+
+            tasks = self._queues.get(key)
+            if tasks is None:
+                tasks = self._queues[key] = deque()
+            elif key not in self._running and key in self._ready:
+                # Ключ ждал воркера — придержим его до срока таймера
+                self._ready.remove(key)
+            tasks.appendleft((fn, args))
+            self._held.add(key)
+            self._pending += 1
+
+            heapq.heappush(
+                self._timers, (time.monotonic() + delay, next(self._timer_seq), key)
+            )
+            self._timer_cond.notify()
+
+    def _run_timers(self):
+        with self._lock:
+            while True:
+                if not self._timers:
+                    self._timer_cond.wait()
+                    continue
+                due, _, key = self._timers[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._timer_cond.wait(wait)
+                    continue
+
+                heapq.heappop(self._timers)
+                self._held.discard(key)
+                # Если ключ еще выполняется, воркер сам поставит его в очередь
+                if key not in self._running:
+                    self._ready.append(key)
+                    self._has_work.notify()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._ready:
+                    self._has_work.wait()
+                key = self._ready.popleft()
+                fn, args = self._queues[key].popleft()
+                self._running.add(key)
+
+            self._local.key = key
+            try:
+                with self.task_context():
+                    fn(*args)
+            except Exception as e:
+                print(f"Ошибка в обработчике ({key}): {e}")
+            finally:
+                self._local.key = None
+
+            with self._lock:
+                self._running.discard(key)
+                self._pending -= 1
+                self._has_room.notify()
+                if key in self._held:
+                    # Очередь чата на паузе до срока — ее разбудит таймер
+                    continue
+                if self._queues[key]:
+                    # В конец общей очереди, чтобы болтливый чат не занимал воркер подряд
+                    self._ready.append(key)
+                    self._has_work.notify()
+                else:
+                    del self._queues[key]
@@ -0,0 +1,56 @@
+"""Состояние партий в очко.
+
+Вместо словарей со строковыми ключами — классы со __slots__: без __dict__ на каждую
+партию, а обращение к полю не хеширует строку ключа на каждом нажатии кнопки.
+Руки — cards.Hand с номерами карт и накопленной суммой очков.
+Башмаки живут весь турнир и хранятся отдельно от партии (user_shoes и duel_shoes
+в bot.py): в партии только то, что меняется от хода к ходу.
+
+Выигрыш по памяти умеренный — руки остаются отдельными объектами Hand
+(bench.py games: одиночная ~1.4 раза, дуэль ~1.7 раза), основная выгода —
+доступ к полям без хеширования строковых ключей.
+"""
+
+from dataclasses import dataclass
+
+from cards import Hand
+
+
+@dataclass(slots=True)
+class SoloGame:
+    """Раунд против бота"""
+
+    player_hand: Hand
+    dealer_hand: Hand
+    game_state: str = "player_turn"
+
+
+@dataclass(slots=True)
+class DuelGame:
+    """Турнир двух игроков до 101 очка"""
+
+    player1_id: int
+    player2_id: int
+    player1_name: str
+    player2_name: str
+    bet: str
+    player1_hand: Hand
+    player2_hand: Hand
+    current_turn: int  # Первым ходит пригласивший
+    player1_score: int = 0  # Очки в текущем раунде
+    player2_score: int = 0
+    player1_stand: bool = False
+    player2_stand: bool = False
+    game_state: str = "active"
+    round_number: int = 1  # Номер раунда
+
+    def __setstate__(self, state):
+        # pickle класса со __slots__ хранит (None, {поле: значение}); в играх,
+        # сохраненных до выноса башмака в duel_shoes, есть лишнее поле shoe
+        _, fields = state
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    def opponent_of(self, player_id):
+        """ID соперника игрока"""
+        return self.player2_id if player_id == self.player1_id else self.player1_id
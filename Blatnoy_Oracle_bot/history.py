@@ -0,0 +1,448 @@
+"""История турниров на диске: сегменты с упакованными записями.
+
+Запись турнира упаковывается struct-ом в ~60 байт (вместо словаря с datetime и
+строковой копией даты) и дописывается фоновым потоком в текущий сегмент —
+файл segment-NNNNNN.log. Когда сегмент дорастает до segment_bytes, он
+закрывается, рядом пишется его индекс (.idx), и начинается следующий.
+
+В памяти остаются только последние recent записей и маленький индекс на
+сегмент: время первой и последней записи, каждая INDEX_EVERY-я запись
+(время, смещение) для поиска по времени и фильтр Блума по user_id, чтобы
+запрос по игроку открывал только сегменты, где он может быть. Память не
+растет с историей — растут файлы, а их подрезает compact().
+
+Формат записи: заголовок RECORD (длина записи, время, user_id, победитель,
+очки, генератор, зерно, колоды, тасовки, длины строк) и следом имя и ставка
+в UTF-8.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime
+
+MAGIC = b"OHS1"  # Начало каждого сегмента
+RECORD = struct.Struct("<HdqBHHBQBHHH")
+WINNERS = ("player", "dealer")
+# Номер генератора в записи; порядок менять нельзя — он записан в файлах
+RNG_NAMES = (None, "mersenne", "pcg32", "shake128")
+INDEX_EVERY = 64  # Каждая какая запись попадает в разреженный индекс
+BLOOM_BITS = 8192
+BLOOM_HASHES = 3
+
+
+def encode(record):
+    """Словарь турнира -> байты записи"""
+    username = record.get("username", "").encode("utf-8")[:1024]
+    bet = str(record.get("bet", "")).encode("utf-8")[:1024]
+    rng = RNG_NAMES.index(record.get("rng"))
+    header = RECORD.pack(
+        RECORD.size + len(username) + len(bet),
+        record["timestamp"].timestamp(),
+        record["user_id"],
+        WINNERS.index(record["winner"]),
+        record["player_final_score"],
+        record["dealer_final_score"],
+        rng,
+        record.get("seed") or 0,
+        record.get("decks") or 0,
+        record.get("shuffles") or 0,
+        len(username),
+        len(bet),
+    )
+    return header + username + bet
+
+
+def decode(data, offset=0):
+    """Байты записи -> словарь в том же виде, в каком его сохраняли"""
+    (_, timestamp, user_id, winner, player_score, dealer_score, rng, seed, decks, shuffles,
+     name_length, bet_length) = RECORD.unpack_from(data, offset)
+    start = offset + RECORD.size
+    moment = datetime.fromtimestamp(timestamp)
+    record = {
+        "timestamp": moment,
+        "datetime_str": moment.strftime("%Y-%m-%d %H:%M:%S"),
+        "user_id": user_id,
+        "username": data[start : start + name_length].decode("utf-8", "replace"),
+        "bet": data[start + name_length : start + name_length + bet_length].decode(
+            "utf-8", "replace"
+        ),
+        "winner": WINNERS[winner],
+        "player_final_score": player_score,
+        "dealer_final_score": dealer_score,
+        "tournament_ended": True,
+    }
+    if rng:
+        record.update(rng=RNG_NAMES[rng], seed=seed, decks=decks, shuffles=shuffles)
+    return record
+
+
+def _bloom_positions(user_id):
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=4 * BLOOM_HASHES).digest()
+    return [
+        int.from_bytes(digest[i * 4 : i * 4 + 4], "little") % BLOOM_BITS
+        for i in range(BLOOM_HASHES)
+    ]
+
+
+class Segment:
+    """Индекс одного сегмента"""
+
+    __slots__ = ("number", "path", "size", "count", "first_ts", "last_ts", "sparse", "bloom")
+
+    def __init__(self, number, path):
+        self.number = number
+        self.path = path
+        self.size = len(MAGIC)
+        self.count = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.sparse = []  # [(время, смещение)] каждой INDEX_EVERY-й записи
+        self.bloom = bytearray(BLOOM_BITS // 8)
+
+    def note(self, timestamp, user_id, offset, length):
+        """Учитывает запись, дописанную по смещению offset"""
+        if self.count % INDEX_EVERY == 0:
+            self.sparse.append((timestamp, offset))
+        if self.first_ts is None:
+            self.first_ts = timestamp
+        self.last_ts = timestamp
+        for position in _bloom_positions(user_id):
+            self.bloom[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+        self.size = offset + length
+
+    def may_contain(self, user_id):
+        return all(
+            self.bloom[position >> 3] & (1 << (position & 7))
+            for position in _bloom_positions(user_id)
+        )
+
+    def overlaps(self, start, end):
+        if self.first_ts is None:
+            return False
+        return (start is None or self.last_ts >= start) and (end is None or self.first_ts <= end)
+
+    def start_offset(self, start):
+        """Смещение, с которого читать записи не раньше start"""
+        if start is None or not self.sparse:
+            return len(MAGIC)
+        i = bisect_right(self.sparse, (start, -1)) - 1
+        return self.sparse[max(i, 0)][1]
+
+    @property
+    def index_path(self):
+        return self.path[: -len(".log")] + ".idx"
+
+    def save_index(self):
+        data = {
+            "size": self.size,
+            "count": self.count,
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+            "sparse": self.sparse,
+            "bloom": self.bloom.hex(),
+        }
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.index_path)
+
+    def load_index(self):
+        """Читает .idx; False, если его нет или он не сходится с файлом"""
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data["size"] != os.path.getsize(self.path):
+                return False
+        except (OSError, ValueError, KeyError):
+            return False
+        self.size = data["size"]
+        self.count = data["count"]
+        self.first_ts = data["first_ts"]
+        self.last_ts = data["last_ts"]
+        self.sparse = [tuple(entry) for entry in data["sparse"]]
+        self.bloom = bytearray.fromhex(data["bloom"])
+        return True
+
+
+def _records(data, offset=len(MAGIC)):
+    """(смещение, длина) целых записей в байтах сегмента"""
+    while offset + RECORD.size <= len(data):
+        length = RECORD.unpack_from(data, offset)[0]
+        if length < RECORD.size or offset + length > len(data):
+            break
+        yield offset, length
+        offset += length
+
+
+def _merged_size(segments):
+    return len(MAGIC) + sum(segment.size - len(MAGIC) for segment in segments)
+
+
+class TournamentHistory:
+    """Лог турниров: запись через фоновый поток, чтение по времени и игроку"""
+
+    def __init__(self, directory, segment_bytes=1 << 20, recent=200, flush_interval=1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self._recent = deque(maxlen=recent)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()  # Сегменты и файл текущего сегмента
+        self._count_lock = threading.Lock()
+        self._segments = []
+        self._file = None
+        self._count = 0
+        self._thread = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._open_segments()
+
+    # ---------- Загрузка ----------
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"segment-{number:06d}.log")
+
+    def _scan(self, segment):
+        """Строит индекс сегмента по файлу; обрезает недописанную последнюю запись"""
+        with open(segment.path, "rb") as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f"{segment.path}: не сегмент истории")
+        end = len(MAGIC)
+        for offset, length in _records(data):
+            timestamp, user_id = RECORD.unpack_from(data, offset)[1:3]
+            segment.note(timestamp, user_id, offset, length)
+            end = offset + length
+        if end < len(data):
+            print(f"{segment.path}: обрезаю недописанную запись ({len(data) - end} байт)")
+            with open(segment.path, "r+b") as f:
+                f.truncate(end)
+
+    def _open_segments(self):
+        numbers = sorted(
+            int(name[len("segment-") : -len(".log")])
+            for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".log")
+        )
+        for i, number in enumerate(numbers):
+            segment = Segment(number, self._segment_path(number))
+            last = i == len(numbers) - 1
+            if last or not segment.load_index():
+                self._scan(segment)
+                if not last:
+                    segment.save_index()
+            self._segments.append(segment)
+            self._count += segment.count
+        if not self._segments:
+            self._new_segment(1)
+        self._file = open(self._segments[-1].path, "ab")
+        self._load_recent()
+
+    def _load_recent(self):
+        """Заполняет окно последних записей из хвостовых сегментов"""
+        tail = []
+        for segment in reversed(self._segments):
+            if len(tail) >= self._recent.maxlen:
+                break
+            tail[:0] = self._read(segment)
+        self._recent.extend(tail[-self._recent.maxlen :])
+
+    def _new_segment(self, number):
+        segment = Segment(number, self._segment_path(number))
+        with open(segment.path, "wb") as f:
+            f.write(MAGIC)
+        self._segments.append(segment)
+        return segment
+
+    # ---------- Запись ----------
+
+    def append(self, record):
+        """Ставит запись в очередь на диск и сразу добавляет в окно последних"""
+        data = encode(record)
+        self._recent.append(decode(data))
+        with self._count_lock:
+            self._count += 1
+        self._queue.put(data)
+
+    def _write(self, batch):
+        with self._lock:
+            segment = self._segments[-1]
+            for data in batch:
+                if segment.size + len(data) > self.segment_bytes and segment.count:
+                    segment = self._rotate()
+                self._file.write(data)
+                timestamp, user_id = RECORD.unpack_from(data)[1:3]
+                segment.note(timestamp, user_id, segment.size, len(data))
+            self._file.flush()
+
+    def _rotate(self):
+        """Закрывает текущий сегмент (пишет его индекс) и открывает следующий"""
+        self._file.close()
+        sealed = self._segments[-1]
+        sealed.save_index()
+        segment = self._new_segment(sealed.number + 1)
+        self._file = open(segment.path, "ab")
+        return segment
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Все, что накопилось за интервал, пишем одним заходом
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except OSError as e:
+                print(f"Ошибка записи истории: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def flush(self):
+        """Дожидается, пока очередь уйдет на диск"""
+        if self._thread:
+            self._queue.join()
+        else:
+            batch = []
+            while not self._queue.empty():
+                batch.append(self._queue.get())
+                self._queue.task_done()
+            if batch:
+                self._write(batch)
+
+    # ---------- Чтение ----------
+
+    def __len__(self):
+        return self._count
+
+    def recent(self):
+        """Последние записи (не больше окна), от старых к новым"""
+        return list(self._recent)
+
+    def _read(self, segment, start=None, end=None, user_id=None):
+        with open(segment.path, "rb") as f:
+            data = f.read(segment.size)
+        records = []
+        for offset, _ in _records(data, segment.start_offset(start)):
+            timestamp, record_user = RECORD.unpack_from(data, offset)[1:3]
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp > end:
+                break
+            if user_id is None or record_user == user_id:
+                records.append(decode(data, offset))
+        return records
+
+    def query(self, start=None, end=None, user_id=None):
+        """Записи с start по end (datetime, включительно) и/или одного игрока"""
+        start = start.timestamp() if start else None
+        end = end.timestamp() if end else None
+        for attempt in range(2):
+            # Список сегментов берем под блокировкой: compact() меняет его там же
+            with self._lock:
+                segments = [
+                    s
+                    for s in self._segments
+                    if s.overlaps(start, end) and (user_id is None or s.may_contain(user_id))
+                ]
+            records = []
+            vanished = False
+            for segment in segments:
+                try:
+                    records.extend(self._read(segment, start, end, user_id))
+                except FileNotFoundError:
+                    # Сегмент удалил или слил compact(); слитые записи теперь
+                    # в другом файле, поэтому один раз перечитываем по новому списку
+                    vanished = True
+            if not vanished:
+                break
+        return records
+
+    # ---------- Обслуживание ----------
+
+    def compact(self, retention_days=0):
+        """Удаляет сегменты старше retention_days (0 — хранить все) и сливает
+        соседние закрытые сегменты, которые вместе не больше segment_bytes.
+        Возвращает (удалено сегментов, слито сегментов)."""
+        removed = merged = 0
+        with self._lock:
+            sealed, active = self._segments[:-1], self._segments[-1]
+            if retention_days:
+                cutoff = time.time() - retention_days * 86400
+                for segment in [s for s in sealed if s.last_ts is None or s.last_ts < cutoff]:
+                    with self._count_lock:
+                        self._count -= segment.count
+                    self._remove_files(segment)
+                    sealed.remove(segment)
+                    removed += 1
+
+            compacted = []
+            group = []
+            for segment in sealed + [None]:
+                if segment is not None and _merged_size(group + [segment]) <= self.segment_bytes:
+                    group.append(segment)
+                    continue
+                if len(group) > 1:
+                    compacted.append(self._merge(group))
+                    merged += len(group)
+                elif group:
+                    compacted.append(group[0])
+                group = [segment] if segment is not None else []
+            self._segments = compacted + [active]
+        return removed, merged
+
+    def _merge(self, group):
+        """Переписывает группу сегментов в файл первого из них"""
+        target = Segment(group[0].number, group[0].path)
+        tmp = target.path + ".tmp"
+        with open(tmp, "wb") as out:
+            out.write(MAGIC)
+            for segment in group:
+                with open(segment.path, "rb") as f:
+                    data = f.read(segment.size)
+                for offset, length in _records(data):
+                    timestamp, user_id = RECORD.unpack_from(data, offset)[1:3]
+                    out.write(data[offset : offset + length])
+                    target.note(timestamp, user_id, target.size, length)
+        os.replace(tmp, target.path)
+        target.save_index()
+        for segment in group[1:]:
+            self._remove_files(segment)
+        return target
+
+    @staticmethod
+    def _remove_files(segment):
+        for path in (segment.path, segment.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "records": self._count,
+                "segments": len(self._segments),
+                "bytes": sum(s.size for s in self._segments),
+                "queued": self._queue.qsize(),
+            }
@@ -0,0 +1,93 @@
+"""Готовые клавиатуры бота.
+
+Клавиатура собирается и сериализуется в JSON один раз: постоянные — при
+импорте, игровые — при первом запросе для своей игры или ставки, дальше берутся
+из кеша. Объекты неизменяемые, поэтому их можно отдавать в любое количество
+сообщений и потоков. telebot принимает их в reply_markup как обычную разметку:
+он вызывает to_json(), а тот просто возвращает готовую строку.
+"""
+
+from functools import lru_cache
+
+from telebot import types
+
+
+class PrebuiltMarkup(types.JsonSerializable):
+    """Разметка, уже сериализованная в JSON"""
+
+    __slots__ = ("json",)
+
+    def __init__(self, markup):
+        object.__setattr__(self, "json", markup.to_json())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PrebuiltMarkup неизменяема")
+
+    def to_json(self):
+        return self.json
+
+    def __repr__(self):
+        return f"PrebuiltMarkup({self.json})"
+
+
+def inline_keyboard(*buttons, row_width=3):
+    """Инлайн-клавиатура из пар (текст, callback_data)"""
+    markup = types.InlineKeyboardMarkup(row_width=row_width)
+    markup.add(
+        *(types.InlineKeyboardButton(text, callback_data=data) for text, data in buttons)
+    )
+    return PrebuiltMarkup(markup)
+
+
+# ---------- Постоянные клавиатуры ----------
+
+# Ход в одиночной игре
+GAME_ACTIONS = inline_keyboard(
+    ("Давай карту", "hit"), ("Хватит", "stand"), ("Сдаюсь", "surrender"), row_width=2
+)
+CONTINUE_GAME = inline_keyboard(("Продолжаем?", "continue"))
+ASK_AGAIN = inline_keyboard(("Да", "ask_again"), ("Нет", "stop_talking"))
+
+
+def _main_menu():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    markup.add(
+        *(
+            types.KeyboardButton(command)
+            for command in (
+                "/поинтересоваться",
+                "/сыграем?",
+                "/погремуха",
+                "/расход",
+                "/не_оставь_в_беде",
+                "/ссучиться",
+            )
+        )
+    )
+    return PrebuiltMarkup(markup)
+
+
+MAIN_MENU = _main_menu()
+
+
+# ---------- Клавиатуры конкретной игры или ставки ----------
+
+
+@lru_cache(maxsize=4096)
+def multiplayer_turn(game_id):
+    """Ход в мультиплеере: кнопки несут game_id"""
+    return inline_keyboard(
+        ("Давай карту", f"multi_hit_{game_id}"),
+        ("Хватит", f"multi_stand_{game_id}"),
+        row_width=2,
+    )
+
+
+@lru_cache(maxsize=1024)
+def game_mode(bet):
+    """Выбор режима игры на ставку bet"""
+    return inline_keyboard(
+        ("позвать кента", f"play_friend_{bet}"),
+        ("играть с арестанотом", f"play_bot_{bet}"),
+        row_width=2,
+    )
@@ -0,0 +1,177 @@
+"""Статистика игроков и рейтинг.
+
+У каждого игрока копится PlayerStats: раунды против бота по исходам, сумма
+очков руки на конец раунда (для среднего) и выигранные/проигранные турниры.
+Счетчики обновляются при каждом исходе раунда, историю для них никто не
+перебирает.
+
+Рейтинг — отсортированный список ключей (-выигранные турниры, -выигранные
+раунды, user_id) плюс словарь user_id -> ключ. Место игрока ищется bisect-ом за
+O(log n), топ — срез с начала. При обновлении ключ переставляется: поиск тоже
+bisect, сдвиг элементов списка — один memmove.
+
+При общем хранилище (Redis) статистику пишут все реплики, поэтому рейтинг
+живет там же (storage.SharedCounters): счетчики игрока прибавляются HINCRBY, а
+ключ рейтинга — счет в sorted set (rank_score), место — ZRANK за O(log n).
+"""
+
+import threading
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+
+# Исходы раунда (rules.ROUND_SCORING) с точки зрения игрока
+ROUND_WINS = ("player_wins", "dealer_bust")
+ROUND_LOSSES = ("dealer_wins", "player_bust", "surrender")
+
+
+@dataclass(slots=True)
+class PlayerStats:
+    """Итоги игрока против бота за все время"""
+
+    rounds: int = 0
+    wins: int = 0
+    losses: int = 0
+    pushes: int = 0
+    busts: int = 0
+    surrenders: int = 0
+    hand_total: int = 0  # Сумма очков руки на конец раундов
+    tournaments_won: int = 0
+    tournaments_lost: int = 0
+
+    @property
+    def average_hand(self):
+        return self.hand_total / self.rounds if self.rounds else 0.0
+
+    def as_dict(self):
+        return {
+            "rounds": self.rounds,
+            "wins": self.wins,
+            "losses": self.losses,
+            "pushes": self.pushes,
+            "busts": self.busts,
+            "surrenders": self.surrenders,
+            "average_hand": round(self.average_hand, 1),
+            "tournaments_won": self.tournaments_won,
+            "tournaments_lost": self.tournaments_lost,
+        }
+
+
+def rank_key(user_id, stats):
+    """Ключ сортировки: больше выигранных турниров, потом выигранных раундов — выше"""
+    return (-stats.tournaments_won, -stats.wins, user_id)
+
+
+# Во сколько раз выигранный турнир весомее выигранного раунда в счете rank_score
+TOURNAMENT_WEIGHT = 1 << 32
+
+
+def rank_score(tournaments_won, wins):
+    """Ключ рейтинга одним числом для sorted set: меньше — выше (как у rank_key)"""
+    return -(tournaments_won * TOURNAMENT_WEIGHT + wins)
+
+
+class Leaderboard:
+    """Упорядоченный рейтинг с поиском места за O(log n)"""
+
+    def __init__(self, stats=()):
+        """stats — пары (user_id, PlayerStats), из которых рейтинг строится одной сортировкой"""
+        self._by_user = {user_id: rank_key(user_id, item) for user_id, item in stats}
+        self._keys = sorted(self._by_user.values())  # Отсортированные ключи rank_key
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id, key):
+        old = self._by_user.get(user_id)
+        if old == key:
+            return
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old)]
+        insort(self._keys, key)
+        self._by_user[user_id] = key
+
+    def rank(self, user_id):
+        """Место игрока (с 1) или None, если его нет в рейтинге"""
+        key = self._by_user.get(user_id)
+        if key is None:
+            return None
+        return bisect_left(self._keys, key) + 1
+
+    def top(self, count):
+        """user_id первых count игроков"""
+        return [key[-1] for key in self._keys[:count]]
+
+
+class StatsEngine:
+    """Статистика игроков и рейтинг по ней.
+
+    storage — словарь хранилища user_id -> PlayerStats, а при shared=True —
+    storage.SharedCounters общего хранилища.
+    """
+
+    def __init__(self, storage, shared=False):
+        self.storage = storage
+        self.shared = shared
+        self.leaderboard = None if shared else Leaderboard(storage.items())
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Сколько игроков в рейтинге"""
+        return len(self.storage)
+
+    def get(self, user_id):
+        if self.shared:
+            values = self.storage.get(user_id)
+            return PlayerStats(**values) if values else None
+        return self.storage.get(user_id)
+
+    def _update(self, user_id, amounts):
+        """Прибавляет amounts {поле PlayerStats: число} к статистике игрока"""
+        if self.shared:
+            score = rank_score(amounts.get("tournaments_won", 0), amounts.get("wins", 0))
+            return PlayerStats(**self.storage.incr(user_id, amounts, score))
+        with self._lock:
+            stats = self.storage.get(user_id) or PlayerStats()
+            for field, amount in amounts.items():
+                setattr(stats, field, getattr(stats, field) + amount)
+            self.storage[user_id] = stats
+            self.leaderboard.update(user_id, rank_key(user_id, stats))
+        return stats
+
+    def record_round(self, user_id, result, hand_value):
+        """Учитывает раунд против бота с исходом result (см. rules.ROUND_SCORING)"""
+        amounts = {"rounds": 1, "hand_total": hand_value}
+        if result in ROUND_WINS:
+            amounts["wins"] = 1
+        elif result in ROUND_LOSSES:
+            amounts["losses"] = 1
+        else:
+            amounts["pushes"] = 1
+        if result == "player_bust":
+            amounts["busts"] = 1
+        elif result == "surrender":
+            amounts["surrenders"] = 1
+        return self._update(user_id, amounts)
+
+    def record_tournament(self, user_id, winner):
+        """Учитывает турнир до 101, winner — кто его выиграл ("player" или "dealer")"""
+        field = "tournaments_won" if winner == "player" else "tournaments_lost"
+        return self._update(user_id, {field: 1})
+
+    def rank(self, user_id):
+        if self.shared:
+            place = self.storage.rank(user_id)
+            return None if place is None else place + 1
+        with self._lock:
+            return self.leaderboard.rank(user_id)
+
+    def top(self, count=10):
+        """[(место, user_id, PlayerStats)] первых count игроков"""
+        if self.shared:
+            return [
+                (place, user_id, PlayerStats(**values))
+                for place, (user_id, values) in enumerate(self.storage.top(count), 1)
+            ]
+        with self._lock:
+            users = self.leaderboard.top(count)
+        return [(place, user_id, self.storage.get(user_id)) for place, user_id in enumerate(users, 1)]
@@ -0,0 +1,45 @@
+"""Поиск ключевых слов вопроса за один проход.
+
+Все ключи собираются в одно регулярное выражение-альтернативу. Ключ считается
+найденным, если стоит в тексте отдельным словом между пробелами — ровно как
+старая проверка f" {keyword} " in f" {question} ".
+"""
+
+import re
+
+
+class KeywordMatcher:
+    """Скомпилированный набор ключевых слов.
+
+    find() повторяет правила выбора оракула: ключ из priority выигрывает сразу,
+    иначе ответ есть, только если в вопросе нашелся ровно один ключ.
+    """
+
+    __slots__ = ("keywords", "priority", "pattern")
+
+    def __init__(self, keywords, priority=()):
+        self.keywords = tuple(keywords)
+        self.priority = tuple(key for key in priority if key in self.keywords)
+        # Длинные ключи раньше коротких: из ключей-префиксов выигрывает более длинный
+        alternatives = "|".join(
+            re.escape(key) for key in sorted(self.keywords, key=len, reverse=True)
+        )
+        # Границы — только пробел или край строки, как в старой проверке
+        self.pattern = re.compile(f"(?<![^ ])(?:{alternatives})(?![^ ])")
+
+    def find_all(self, text):
+        """Множество ключей, которые встречаются в text отдельными словами"""
+        if not self.keywords:
+            return set()
+        return set(self.pattern.findall(text))
+
+    def find(self, text):
+        """Ключ, по которому отвечать, или None — тогда отвечают общим списком"""
+        found = self.find_all(text)
+        for key in self.priority:
+            if key in found:
+                return key
+        if len(found) == 1:
+            return next(iter(found))
+        return None
+
@@ -0,0 +1,261 @@
+"""Метрики в текстовом формате Prometheus.
+
+Запись идет в шард своего потока: у каждого потока свой словарь, поэтому на
+горячем пути нет общих блокировок — инкремент счетчика это get и присваивание
+в собственном словаре, замер гистограммы — bisect по границам и два сложения.
+Блокировка берется только при заведении шарда (раз на поток) и при сборе.
+
+При сборе (/metrics) шарды копируются (dict.copy() под GIL атомарен) и
+складываются. Копия может поймать гистограмму между инкрементом корзины и
+суммой — на одно наблюдение, для мониторинга это не важно. Шарды завершившихся
+потоков при сборе сливаются в общий архив, чтобы счетчики не убывали.
+
+Гейджи и счетчики, которые уже ведутся в других объектах (очереди, outbound),
+не пишутся на горячем пути, а считаются функцией в момент сбора.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин по умолчанию, секунды: от миллисекунд до долгих ответов API
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = registry._local
+
+    def inc(self, *labels, amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self.registry._shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def merge(self, total, value):
+        return value if total is None else total + value
+
+    def samples(self, labels, value):
+        yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """Гистограмма: корзины по границам buckets, последняя ячейка — сумма"""
+
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._local = registry._local
+
+    def observe(self, value, *labels):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self.registry._shard()
+        key = (self.name, labels)
+        cells = shard.get(key)
+        if cells is None:
+            # Корзины по границам, корзина +Inf и сумма
+            cells = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        cells[bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def merge(self, total, cells):
+        if total is None:
+            return list(cells)
+        for i, value in enumerate(cells):
+            total[i] += value
+        return total
+
+    def samples(self, labels, cells):
+        cumulative = 0
+        bounds = (*self.buckets, float("inf"))
+        for bound, count in zip(bounds, cells):
+            cumulative += count
+            le = (("le", format_value(float(bound))),)
+            yield f"{self.name}_bucket", format_labels(self.labelnames, labels, le), cumulative
+        base = format_labels(self.labelnames, labels)
+        yield f"{self.name}_sum", base, cells[-1]
+        yield f"{self.name}_count", base, cumulative
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class Callback:
+    """Метрика, которая считается функцией при сборе.
+
+    fn возвращает число или словарь {кортеж значений меток: число}.
+    """
+
+    def __init__(self, kind, name, help, fn, labelnames=()):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def collect(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, number in value.items():
+            if number is not None:
+                yield self.name, format_labels(self.labelnames, labels), number
+
+
+class MetricsRegistry:
+    """Реестр метрик с пошардовой записью по потокам"""
+
+    def __init__(self):
+        self._metrics = {}  # name: Counter / Histogram / Callback, в порядке заведения
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []  # [(поток, словарь)]
+        self._retired = {}  # Слитые шарды завершившихся потоков
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже заведена")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def gauge(self, name, help, fn, labelnames=()):
+        """Гейдж, который при сборе берет значение у fn()"""
+        return self._register(Callback("gauge", name, help, fn, labelnames))
+
+    def counter_from(self, name, help, fn, labelnames=()):
+        """Счетчик, который уже ведет кто-то другой: значение берется у fn()"""
+        return self._register(Callback("counter", name, help, fn, labelnames))
+
+    def _shard(self):
+        """Заводит шард текущего потока (метрики потом берут его из _local сами)"""
+        shard = self._local.shard = {}
+        with self._lock:
+            self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _merged(self):
+        """Сумма всех шардов: {(имя, метки): значение}"""
+        with self._lock:
+            shards = self._shards
+            alive = [(thread, shard) for thread, shard in shards if thread.is_alive()]
+            dead = [shard for thread, shard in shards if not thread.is_alive()]
+            self._shards = alive
+            # Мертвый поток больше не пишет — его шард можно слить без копии
+            for shard in dead:
+                self._fold(self._retired, shard)
+            totals = self._fold({}, self._retired)
+        for _, shard in alive:
+            self._fold(totals, shard.copy())
+        return totals
+
+    def _fold(self, totals, shard):
+        for key, value in shard.items():
+            totals[key] = self._metrics[key[0]].merge(totals.get(key), value)
+        return totals
+
+    def collect(self):
+        """Текст для /metrics"""
+        totals = self._merged()
+        by_metric = {}
+        for (name, labels), value in sorted(totals.items(), key=lambda item: item[0]):
+            by_metric.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, metric in list(self._metrics.items()):
+            if isinstance(metric, Callback):
+                try:
+                    samples = list(metric.collect())
+                except Exception as e:
+                    print(f"Ошибка при сборе метрики {name}: {e}")
+                    continue
+            else:
+                samples = [
+                    sample
+                    for labels, value in by_metric.get(name, ())
+                    for sample in metric.samples(labels, value)
+                ]
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(f"{sample}{labels} {format_value(value)}" for sample, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+def instrument(fn, calls, errors, seconds):
+    """Обертка обработчика: число вызовов, ошибок и время, метка — имя функции"""
+    name = fn.__name__
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        calls.inc(name)
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started, name)
+
+    return wrapper
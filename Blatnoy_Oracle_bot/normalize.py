@@ -0,0 +1,61 @@
+"""Нормализация вопроса перед поиском ключевых слов.
+
+Текст режется на слова без пунктуации, ё сводится к е, отбрасываются частицы
+(-то, -нибудь, -либо, -ка, кое-), а формы слова приводятся к ключу по таблице
+лемм из корпуса: "Кому-нибудь?" -> "кого", "почему-то" -> "почему".
+Для вопросительных и местоименных ключей таблица точнее стеммера — их формы
+наперечет. В таблице только падежные формы самих ключей ("кому" -> "кого",
+"вам" -> "вы"): синонимы и формы приоритетного "ты" увели бы вопросы из тех
+корзин, куда они попадали раньше. По той же причине нормализованный текст
+ищется, только когда точные слова ключа не дали (Corpus.keyword).
+
+Вопрос режется по пробелам, и каждый кусок ("Кому-нибудь?", "хате,") целиком
+нормализуется через LRU-кеш: в потоке вопросов куски повторяются, так что на
+вопрос остается один split и по словарному поиску на слово.
+"""
+
+import re
+from functools import lru_cache
+
+# Слово — буквы и цифры, можно через дефис: "когда-нибудь", "кое-кто"
+TOKEN_RE = re.compile(r"\w+(?:-\w+)*")
+PARTICLE_PREFIXES = ("кое-", "кой-")
+PARTICLE_SUFFIXES = ("-нибудь", "-либо", "-то", "-ка")
+
+
+def fold(word):
+    return word.lower().replace("ё", "е")
+
+
+class Normalizer:
+    """Приводит вопрос к строке нормальных форм через пробел"""
+
+    __slots__ = ("lemmas", "normalize_chunk")
+
+    def __init__(self, lemmas=None, cache_size=4096):
+        self.lemmas = {fold(form): fold(lemma) for form, lemma in (lemmas or {}).items()}
+        # Кеш у каждого нормализатора свой: новый корпус — новая таблица лемм
+        self.normalize_chunk = lru_cache(maxsize=cache_size)(self._normalize_chunk)
+
+    def _normalize_chunk(self, chunk):
+        """Кусок текста между пробелами -> нормальные формы его слов через пробел"""
+        return " ".join(map(self.normalize_word, TOKEN_RE.findall(fold(chunk))))
+
+    def normalize_word(self, word):
+        """Слово в нижнем регистре без ё -> ключ из таблицы лемм или основа без частиц"""
+        for prefix in PARTICLE_PREFIXES:
+            if word.startswith(prefix) and len(word) > len(prefix):
+                word = word[len(prefix) :]
+                break
+        for suffix in PARTICLE_SUFFIXES:
+            if word.endswith(suffix) and len(word) > len(suffix):
+                word = word[: -len(suffix)]
+                break
+        return self.lemmas.get(word, word)
+
+    def normalize(self, text):
+        # Пустые куски (одна пунктуация) дают лишние пробелы — матчеру они не мешают
+        return " ".join(map(self.normalize_chunk, text.split()))
+
+    def cache_info(self):
+        return self.normalize_chunk.cache_info()
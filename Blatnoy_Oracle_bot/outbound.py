@@ -0,0 +1,527 @@
+"""Исходящие запросы к Telegram через очередь с ограничением скорости.
+
+Обработчики не ходят в Telegram сами: send_message и компания кладут запрос
+в очередь чата и сразу возвращаются. Отдельные потоки-отправители берут
+запросы с учетом двух ведер токенов — общего (~30 сообщений в секунду на бота)
+и своего у каждого чата (~1 в секунду), — и приоритета: игровой интерфейс
+уходит раньше уведомлений админу. Ответ 429 с retry_after ставит очередь чата
+на паузу на указанное время, запрос повторяется сам, но не больше
+max_rate_limits раз.
+
+Сетевые сбои и ошибки 5xx повторяются с экспоненциальной паузой (1, 2, 4...
+секунды со случайным разбросом) до max_attempts попыток. Если Telegram отказал
+насовсем или попытки кончились, запрос уходит в журнал недоставленных
+(deadletter.py), откуда его можно переотправить.
+
+Очередь помнит, что сейчас показано в каждом сообщении (отпечаток текста,
+разметки и parse_mode), и не шлет правку, которая ничего не меняет. Ошибки
+правок разбираются: "message is not modified" — это успех, а новым сообщением
+вместо правки (fallback) отвечаем, только если старое сообщение пропало или
+его больше нельзя править.
+
+Внутри одного чата порядок сообщений сохраняется: пока запрос чата в полете,
+следующий запрос этого чата не отправляется.
+"""
+
+import atexit
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+from telebot.apihelper import ApiTelegramException
+
+# Классы приоритета: меньше — раньше
+PRIORITY_CALLBACK = 0  # Ответы на нажатия кнопок: Telegram ждет их быстро
+PRIORITY_INTERACTIVE = 1  # Игра и ответы пользователям
+PRIORITY_BACKGROUND = 2  # Уведомления и статистика для админа
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, now):
+        """Сколько ждать до свободного токена"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundRequest:
+    """Запрос в очереди: метод бота с аргументами"""
+
+    __slots__ = (
+        "method",
+        "args",
+        "kwargs",
+        "chat_id",
+        "priority",
+        "limited",
+        "fallback",
+        "rendered_key",
+        "attempts",
+        "rate_limits",
+        "result",
+        "error",
+        "_done",
+    )
+
+    def __init__(self, method, args, kwargs, chat_id, priority, limited=True, fallback=None):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.priority = priority
+        self.limited = limited  # Расходует ли токены ведер
+        self.fallback = fallback  # Запрос, который уйдет вместо этого при ошибке
+        self.rendered_key = None  # (chat_id, message_id) сообщения, которое правим
+        self.attempts = 0
+        self.rate_limits = 0  # Сколько раз получили 429
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Ждет отправки и возвращает ответ Telegram (для скриптов, не для обработчиков)"""
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def retry_after(error):
+    """Секунды из ответа 429 или None, если ошибка не про лимит"""
+    if isinstance(error, ApiTelegramException) and error.error_code == 429:
+        parameters = (error.result_json or {}).get("parameters") or {}
+        return float(parameters.get("retry_after", 1))
+    return None
+
+
+def is_permanent(error):
+    """Ошибка, которую повтор не исправит: Telegram ответил 4xx (кроме 429)"""
+    return isinstance(error, ApiTelegramException) and 400 <= error.error_code < 500
+
+
+def edit_error_kind(error):
+    """Вид ошибки правки: "not_modified", "gone" (сообщения нет или его нельзя
+    править) или None — прочие ошибки"""
+    if not isinstance(error, ApiTelegramException) or error.error_code != 400:
+        return None
+    description = (error.description or "").lower()
+    if "message is not modified" in description:
+        return "not_modified"
+    if (
+        "message to edit not found" in description
+        or "message can't be edited" in description
+        or "message_id_invalid" in description
+    ):
+        return "gone"
+    return None
+
+
+def fingerprint(text, kwargs):
+    """Отпечаток того, как сообщение выглядит в чате"""
+    markup = kwargs.get("reply_markup")
+    if hasattr(markup, "to_json"):
+        markup = markup.to_json()
+    return hash((text, kwargs.get("parse_mode"), markup))
+
+
+# Эти запросы имеет смысл переотправить позже; ответ на кнопку или "печатает..."
+# через минуту уже никому не нужен
+DEAD_LETTER_METHODS = ("send_message", "edit_message_text", "edit_message_reply_markup")
+
+
+class OutboundGateway:
+    """Очередь исходящих запросов с ведрами токенов и приоритетами"""
+
+    def __init__(
+        self,
+        bot,
+        global_rate=30.0,
+        chat_rate=1.0,
+        chat_burst=3,
+        senders=4,
+        max_attempts=5,
+        max_rate_limits=10,
+        backoff_base=1.0,
+        backoff_max=60.0,
+        dead_letters=None,
+        rendered=None,
+        name="outbound",
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.senders = senders
+        self.max_attempts = max_attempts
+        self.max_rate_limits = max_rate_limits
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.dead_letters = dead_letters  # DeadLetterLog или None — тогда только print
+        # TTLCache (chat_id, message_id) -> отпечаток показанного; None — не сравнивать
+        self.rendered = rendered
+        self.name = name
+
+        self._cond = threading.Condition()
+        now = time.monotonic()
+        self._global = TokenBucket(global_rate, global_rate, now)
+        self._global_blocked_until = 0.0
+
+        # Очередь каждой полосы (обычно полоса — это chat_id)
+        self._queues = {}
+        self._buckets = {}
+        self._blocked_until = {}
+        # Готовые к отправке полосы: (приоритет головы, номер, полоса)
+        self._ready = []
+        # Полосы, ждущие токена или конца retry_after: (срок, номер, полоса)
+        self._waiting = []
+        # Полоса: номер ее актуальной записи в кучах (прочие записи устарели)
+        self._scheduled = {}
+        self._busy = set()
+        self._seq = itertools.count()
+        self._last_purge = now
+
+        self._pending = 0
+        self.sent = 0
+        self.rate_limited = 0
+        self.retried = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self.edits_skipped = 0
+        self.not_modified = 0
+        self._threads = []
+
+    # ---------- API для обработчиков: те же аргументы, что у TeleBot ----------
+
+    def send_message(self, chat_id, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return self.submit("send_message", chat_id, (chat_id, text), kwargs, priority)
+
+    def send_chat_action(self, chat_id, action, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return self.submit("send_chat_action", chat_id, (chat_id, action), kwargs, priority)
+
+    def edit_message_text(
+        self,
+        text,
+        chat_id,
+        message_id,
+        fallback=False,
+        fallback_text=None,
+        priority=PRIORITY_INTERACTIVE,
+        **kwargs,
+    ):
+        """Правит сообщение; при fallback=True, если старого сообщения уже нет
+        или его нельзя править, шлет текст новым"""
+        key = (chat_id, message_id)
+        if self.rendered is not None:
+            shown = fingerprint(text, kwargs)
+            if self.rendered.get(key) == shown:
+                # В чате уже ровно это — Telegram все равно ответил бы "not modified"
+                self.edits_skipped += 1
+                return self._skipped()
+            # Запоминаем сразу: следующая правка из очереди сравнивается уже с этой
+            self.rendered.put(key, shown)
+        backup = None
+        if fallback:
+            backup = OutboundRequest(
+                "send_message",
+                (chat_id, fallback_text or text),
+                {k: v for k, v in kwargs.items() if k in ("reply_markup", "parse_mode")},
+                chat_id,
+                priority,
+            )
+        return self.submit(
+            "edit_message_text",
+            chat_id,
+            (text, chat_id, message_id),
+            kwargs,
+            priority,
+            fallback=backup,
+            rendered_key=key,
+        )
+
+    def edit_message_reply_markup(
+        self, chat_id, message_id, priority=PRIORITY_INTERACTIVE, **kwargs
+    ):
+        if self.rendered is not None:
+            # Текст сообщения тут неизвестен — отпечаток больше не годится
+            self.rendered.pop((chat_id, message_id))
+        return self.submit(
+            "edit_message_reply_markup", chat_id, (chat_id, message_id), kwargs, priority
+        )
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        # Ответы на кнопки не считаются сообщениями в чат — ведра их не ограничивают
+        return self.submit(
+            "answer_callback_query",
+            None,
+            (callback_query_id, text),
+            kwargs,
+            PRIORITY_CALLBACK,
+            limited=False,
+        )
+
+    def submit(
+        self,
+        method,
+        chat_id,
+        args,
+        kwargs,
+        priority,
+        limited=True,
+        fallback=None,
+        rendered_key=None,
+    ):
+        request = OutboundRequest(
+            method, args, kwargs, chat_id, priority, limited=limited, fallback=fallback
+        )
+        request.rendered_key = rendered_key
+        self._enqueue(request)
+        return request
+
+    @staticmethod
+    def _skipped():
+        """Уже выполненный запрос для правки, которую не нужно слать"""
+        request = OutboundRequest(None, (), {}, None, PRIORITY_INTERACTIVE, limited=False)
+        request._done.set()
+        return request
+
+    # ---------- Очередь ----------
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def stats(self):
+        return {
+            "pending": self._pending,
+            "sent": self.sent,
+            "rate_limited": self.rate_limited,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dead_lettered": self.dead_lettered,
+            "edits_skipped": self.edits_skipped,
+            "not_modified": self.not_modified,
+        }
+
+    def _lane(self, request):
+        if request.chat_id is None:
+            # У запросов без чата нет общего порядка — каждому своя полоса
+            return ("free", next(self._seq))
+        return request.chat_id
+
+    def _enqueue(self, request, lane=None, front=False):
+        if lane is None:
+            lane = self._lane(request)
+        with self._cond:
+            queue = self._queues.get(lane)
+            if queue is None:
+                queue = self._queues[lane] = deque()
+            if front:
+                queue.appendleft(request)
+            else:
+                queue.append(request)
+            self._pending += 1
+            if lane not in self._busy:
+                # Голова полосы могла смениться — пересчитаем ее место
+                self._schedule(lane, time.monotonic())
+
+    def _bucket(self, lane, now):
+        bucket = self._buckets.get(lane)
+        if bucket is None:
+            bucket = self._buckets[lane] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _schedule(self, lane, now):
+        """Ставит полосу в очередь готовых или ждущих по ее голове (под замком)"""
+        head = self._queues[lane][0]
+        ready_at = self._blocked_until.get(lane, 0.0)
+        if head.limited:
+            ready_at = max(ready_at, now + self._bucket(lane, now).wait_time(now))
+        # Если полоса уже стояла в куче, старая запись станет неактуальной
+        entry_seq = self._scheduled[lane] = next(self._seq)
+        if ready_at <= now:
+            heapq.heappush(self._ready, (head.priority, entry_seq, lane))
+        else:
+            heapq.heappush(self._waiting, (ready_at, entry_seq, lane))
+        self._cond.notify()
+
+    def _take(self):
+        """Ждет и забирает следующий запрос для отправки"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._waiting and self._waiting[0][0] <= now:
+                    _, entry_seq, lane = heapq.heappop(self._waiting)
+                    if self._scheduled.get(lane) == entry_seq:
+                        priority = self._queues[lane][0].priority
+                        heapq.heappush(self._ready, (priority, entry_seq, lane))
+
+                if self._ready:
+                    _, entry_seq, lane = self._ready[0]
+                    if self._scheduled.get(lane) != entry_seq:
+                        heapq.heappop(self._ready)
+                        continue
+                    queue = self._queues[lane]
+                    head = queue[0]
+                    if head.limited:
+                        wait = max(
+                            self._global_blocked_until - now, self._global.wait_time(now)
+                        )
+                        if wait > 0:
+                            self._cond.wait(wait)
+                            continue
+                        self._global.take(now)
+                        self._bucket(lane, now).take(now)
+                    heapq.heappop(self._ready)
+                    del self._scheduled[lane]
+                    self._busy.add(lane)
+                    return lane, queue.popleft()
+
+                if now - self._last_purge > 60:
+                    self._purge(now)
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._cond.wait(timeout)
+
+    def _purge(self, now):
+        """Выбрасывает ведра и паузы чатов, которые давно ничего не слали"""
+        self._last_purge = now
+        for lane in [l for l, b in self._buckets.items() if l not in self._queues and b.is_full(now)]:
+            del self._buckets[lane]
+        for lane in [l for l, t in self._blocked_until.items() if t <= now]:
+            del self._blocked_until[lane]
+
+    def _finish(self, lane):
+        with self._cond:
+            self._busy.discard(lane)
+            self._pending -= 1
+            queue = self._queues.get(lane)
+            if queue:
+                self._schedule(lane, time.monotonic())
+            elif queue is not None:
+                del self._queues[lane]
+            self._cond.notify_all()
+
+    def backoff(self, attempts):
+        """Пауза перед повтором номер attempts: base * 2^(n-1), не больше backoff_max"""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        # Разброс, чтобы чаты после общего сбоя не ломились в Telegram одновременно
+        return delay * random.uniform(0.5, 1.0)
+
+    def _send(self, lane, request):
+        request.attempts += 1
+        try:
+            request.result = getattr(self.bot, request.method)(*request.args, **request.kwargs)
+        except Exception as e:
+            kind = edit_error_kind(e) if request.rendered_key is not None else None
+            if kind == "not_modified":
+                # Сообщение и так выглядит как надо
+                self.not_modified += 1
+                request._done.set()
+                return
+            delay = retry_after(e)
+            if delay is not None and request.rate_limits < self.max_rate_limits:
+                # Telegram просит подождать: полоса на паузе, запрос — обратно в голову
+                self.rate_limited += 1
+                request.rate_limits += 1
+                with self._cond:
+                    until = time.monotonic() + delay
+                    # Своя полоса ждет всегда, даже если запрос не тратит токены
+                    self._blocked_until[lane] = until
+                    if request.chat_id is None:
+                        self._global_blocked_until = max(self._global_blocked_until, until)
+                self._enqueue(request, lane, front=True)
+                return
+            if not is_permanent(e) and request.attempts < self.max_attempts:
+                # Сеть или 5xx: повторим позже, остальные сообщения чата подождут
+                self.retried += 1
+                with self._cond:
+                    self._blocked_until[lane] = time.monotonic() + self.backoff(request.attempts)
+                self._enqueue(request, lane, front=True)
+                return
+            if request.rendered_key is not None and self.rendered is not None:
+                # Правка не прошла — что на экране, мы больше не знаем
+                self.rendered.pop(request.rendered_key)
+            if request.fallback is not None and kind == "gone":
+                # Старое сообщение не поправить — новое, в том же месте очереди
+                self._enqueue(request.fallback, lane, front=True)
+            else:
+                self._give_up(request, e)
+            request.error = e
+        else:
+            self.sent += 1
+            if request.method == "send_message" and self.rendered is not None:
+                message_id = getattr(request.result, "message_id", None)
+                if message_id is not None:
+                    text = request.args[1]
+                    self.rendered.put(
+                        (request.chat_id, message_id), fingerprint(text, request.kwargs)
+                    )
+        request._done.set()
+
+    def _give_up(self, request, error):
+        self.failed += 1
+        print(
+            f"Ошибка отправки {request.method} в {request.chat_id} "
+            f"(попыток: {request.attempts}): {error}"
+        )
+        if self.dead_letters is not None and request.method in DEAD_LETTER_METHODS:
+            try:
+                self.dead_letters.record(
+                    request.method, request.args, request.kwargs, error, request.attempts
+                )
+            except OSError as e:
+                print(f"Не удалось записать в журнал недоставленных: {e}")
+            else:
+                self.dead_lettered += 1
+
+    def _work(self):
+        while True:
+            lane, request = self._take()
+            try:
+                self._send(lane, request)
+            finally:
+                self._finish(lane)
+
+    # ---------- Запуск и остановка ----------
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.senders):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.drain, 5)
+
+    def drain(self, timeout=None):
+        """Ждет, пока очередь опустеет (не дольше timeout секунд)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
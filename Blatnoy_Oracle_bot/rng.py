@@ -0,0 +1,130 @@
+"""Генераторы случайных чисел для раздачи.
+
+У каждой игры свое зерно, а генератор на каждую тасовку выводится из пары
+(зерно, номер тасовки). Общее состояние модуля random между потоками
+обработчиков не трогается, а любую раздачу можно повторить по зерну из истории.
+
+Провайдер — класс с методом shuffle(buf), который перемешивает bytearray на месте.
+
+По умолчанию — shake128: вся тасовка делается вызовами C без цикла на Python.
+mersenne и pcg32 тасуют Фишером–Йетсом в цикле на Python (~2 раза медленнее) и
+нужны, чтобы /разбор повторял раздачи, сыгранные с ними.
+"""
+
+import hashlib
+import random
+import secrets
+import sys
+from array import array
+
+MASK32 = 0xFFFFFFFF
+MASK64 = 0xFFFFFFFFFFFFFFFF
+# Слова ключей читаются как little-endian, чтобы порядок карт не зависел от платформы
+BIG_ENDIAN = sys.byteorder == "big"
+
+
+class MersenneRNG:
+    """Вихрь Мерсенна из стандартной библиотеки: отдельный random.Random на тасовку"""
+
+    __slots__ = ("_random",)
+    name = "mersenne"
+
+    def __init__(self, seed, stream=0):
+        self._random = random.Random((seed << 32) | stream)
+
+    def shuffle(self, buf):
+        uniform = self._random.random
+        for i in range(len(buf) - 1, 0, -1):
+            # int(random() * n) вместо randrange(n): вызов C без лишних проверок,
+            # смещение при 53 битах на колоду из сотен карт пренебрежимо мало
+            j = int(uniform() * (i + 1))
+            buf[i], buf[j] = buf[j], buf[i]
+
+
+class PCG32:
+    """PCG-XSH-RR 64/32 (O'Neill). Номер тасовки — номер потока генератора.
+
+    Состояние — два целых, так что генератор дешево создавать и переносить
+    на любую платформу: последовательность не зависит от версии Python.
+    """
+
+    __slots__ = ("state", "inc")
+    name = "pcg32"
+    MULTIPLIER = 6364136223846793005
+
+    def __init__(self, seed, stream=0):
+        self.inc = ((stream << 1) | 1) & MASK64
+        self.state = 0
+        self.next_u32()
+        self.state = (self.state + seed) & MASK64
+        self.next_u32()
+
+    def next_u32(self):
+        old = self.state
+        self.state = (old * self.MULTIPLIER + self.inc) & MASK64
+        xorshifted = (((old >> 18) ^ old) >> 27) & MASK32
+        rot = old >> 59
+        return ((xorshifted >> rot) | (xorshifted << (-rot & 31))) & MASK32
+
+    def randbelow(self, n):
+        """Равномерно 0..n-1 без смещения (метод Лемира)"""
+        product = self.next_u32() * n
+        low = product & MASK32
+        if low < n:
+            threshold = (MASK32 + 1 - n) % n
+            while low < threshold:
+                product = self.next_u32() * n
+                low = product & MASK32
+        return product >> 32
+
+    def shuffle(self, buf):
+        randbelow = self.randbelow
+        for i in range(len(buf) - 1, 0, -1):
+            j = randbelow(i + 1)
+            buf[i], buf[j] = buf[j], buf[i]
+
+
+class Shake128:
+    """Тасовка сортировкой по случайным ключам из SHAKE-128(зерно, номер тасовки).
+
+    Каждой карте достается 64-битное слово из выхода SHAKE, в младший байт
+    которого записана сама карта; после сортировки слов карты читаются обратно
+    срезом. Поток SHAKE, срезы и сортировка целых — все в C. Случайных бит в
+    ключе 56: совпадение ключей даже на башмаке из 8 колод почти невероятно
+    (~10^-12), так что перестановка равномерна.
+    """
+
+    __slots__ = ("_key",)
+    name = "shake128"
+
+    def __init__(self, seed, stream=0):
+        self._key = f"{seed}:{stream}".encode()
+
+    def shuffle(self, buf):
+        keys = bytearray(hashlib.shake_128(self._key).digest(8 * len(buf)))
+        keys[0::8] = buf  # Младший байт слова (little-endian) — карта
+        words = array("Q", keys)
+        if BIG_ENDIAN:
+            words.byteswap()
+        ordered = array("Q", sorted(words.tolist()))
+        if BIG_ENDIAN:
+            ordered.byteswap()
+        buf[:] = ordered.tobytes()[0::8]
+
+
+PROVIDERS = {provider.name: provider for provider in (Shake128, MersenneRNG, PCG32)}
+DEFAULT_PROVIDER = Shake128.name
+
+
+def make_rng(name, seed, stream=0):
+    """Генератор провайдера name для зерна игры и номера тасовки"""
+    try:
+        provider = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный генератор: {name}") from None
+    return provider(seed, stream)
+
+
+def new_seed():
+    """Зерно новой игры — из системного источника, а не из общего random"""
+    return secrets.randbits(64)
@@ -0,0 +1,58 @@
+"""Правила очка — одни и те же для бота (bot.py) и симуляции (simulate.py).
+
+Функции-проверки написаны так, что работают и с числами, и с массивами NumPy:
+симуляция прогоняет через них сразу миллионы раундов.
+"""
+
+BLACKJACK = 21  # Больше — перебор
+DEALER_STANDS_ON = 17  # Дилер берет карты, пока у него меньше
+TOURNAMENT_TARGET = 101  # Турнир идет до этого счета
+
+# Кому и сколько очков руки идет в турнир за исход раунда:
+# (получатель, делитель) — получатель берет очки своей руки // делитель
+ROUND_SCORING = {
+    "player_wins": ("player", 1),
+    "dealer_bust": ("player", 1),
+    "dealer_wins": ("dealer", 1),
+    "player_bust": ("dealer", 1),
+    "surrender": ("dealer", 2),  # Сдался — дилеру половина его очков
+    "push": (None, 1),
+}
+
+
+def is_bust(value):
+    return value > BLACKJACK
+
+
+def dealer_should_hit(value):
+    return value < DEALER_STANDS_ON
+
+
+def round_outcome(player_value, dealer_value):
+    """Исход раунда, когда игрок остановился, а дилер добрал карты"""
+    if is_bust(dealer_value):
+        return "dealer_bust"
+    if dealer_value > player_value:
+        return "dealer_wins"
+    if dealer_value < player_value:
+        return "player_wins"
+    return "push"
+
+
+def round_points(result, player_value, dealer_value):
+    """Очки в турнир за раунд: (игроку, дилеру)"""
+    receiver, divisor = ROUND_SCORING[result]
+    if receiver == "player":
+        return player_value // divisor, 0
+    if receiver == "dealer":
+        return 0, dealer_value // divisor
+    return 0, 0
+
+
+def tournament_winner(player_score, dealer_score):
+    """Кто первым добрал до TOURNAMENT_TARGET (игрок проверяется первым)"""
+    if player_score >= TOURNAMENT_TARGET:
+        return "player"
+    if dealer_score >= TOURNAMENT_TARGET:
+        return "dealer"
+    return None
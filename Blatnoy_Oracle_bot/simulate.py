@@ -0,0 +1,199 @@
+"""Монте-Карло для очка: как правила бота играют на длинной дистанции.
+
+Раунды считаются пачками в массивах NumPy: каждая строка — отдельный раунд
+из свежего башмака, карты добираются всем строкам разом, пока хоть кому-то
+нужна карта. Правила (когда дилер берет, перебор, очки за исход, цель турнира)
+берутся из rules.py — того же модуля, что использует бот.
+
+Игрок играет по простой стратегии: берет, пока у него меньше --player-stands-on.
+
+Запуск: python simulate.py [--tournaments 100000] [--workers 4] [--decks 1]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cards import HARD_VALUES, IS_ACE, card_deck
+from rules import (
+    BLACKJACK,
+    DEALER_STANDS_ON,
+    ROUND_SCORING,
+    TOURNAMENT_TARGET,
+    dealer_should_hit,
+    is_bust,
+    round_points,
+)
+
+HARD = np.frombuffer(HARD_VALUES, dtype=np.uint8).astype(np.int16)
+ACES = np.frombuffer(IS_ACE, dtype=np.uint8).astype(np.int16)
+
+# Раундов на турнир с запасом: за раунд кто-то получает минимум 4 очка (или ничья)
+ROUNDS_PER_TOURNAMENT = 32
+# Турниров в одной задаче воркера — ограничивает память на массив карт
+CHUNK = 10_000
+
+OUTCOMES = tuple(ROUND_SCORING)
+
+
+def soft_values(hard, aces):
+    """cards.soft_total для массивов"""
+    return np.where((aces > 0) & (hard + 10 <= BLACKJACK), hard + 10, hard)
+
+
+def draw_until(cards, pos, hard, aces, active, should_hit):
+    """Добирает карты строкам, где active и should_hit(очки) — как цикл раздачи в боте"""
+    rows = np.arange(len(cards))
+    values = soft_values(hard, aces)
+    hitting = active & should_hit(values)
+    while hitting.any():
+        card = cards[rows[hitting], pos[hitting]]
+        hard[hitting] += HARD[card]
+        aces[hitting] += ACES[card]
+        pos[hitting] += 1
+        values = soft_values(hard, aces)
+        hitting &= should_hit(values)
+    return values
+
+
+def play_rounds(rng, count, decks, player_stands_on):
+    """count раундов: очки рук и код исхода (индекс в OUTCOMES)"""
+    shoe = np.tile(np.arange(len(card_deck), dtype=np.uint8), (count, decks))
+    cards = rng.permuted(shoe, axis=1)
+
+    # Раздача как в create_game: две карты игроку, потом две дилеру
+    player_hard = HARD[cards[:, 0]] + HARD[cards[:, 1]]
+    player_aces = ACES[cards[:, 0]] + ACES[cards[:, 1]]
+    dealer_hard = HARD[cards[:, 2]] + HARD[cards[:, 3]]
+    dealer_aces = ACES[cards[:, 2]] + ACES[cards[:, 3]]
+    pos = np.full(count, 4, dtype=np.int16)
+
+    everyone = np.ones(count, dtype=bool)
+    player = draw_until(
+        cards, pos, player_hard, player_aces, everyone, lambda v: v < player_stands_on
+    )
+    player_bust = is_bust(player)
+    # При переборе игрока дилер не добирает, как в game_callback
+    dealer = draw_until(
+        cards, pos, dealer_hard, dealer_aces, ~player_bust, dealer_should_hit
+    )
+
+    # Порядок проверок — как в dealer_play_with_humor / rules.round_outcome
+    checks = {
+        "player_bust": player_bust,
+        "dealer_bust": is_bust(dealer),
+        "dealer_wins": dealer > player,
+        "player_wins": dealer < player,
+    }
+    outcome = np.select(
+        list(checks.values()),
+        [OUTCOMES.index(name) for name in checks],
+        default=OUTCOMES.index("push"),
+    )
+    return player, dealer, outcome
+
+
+def simulate_chunk(seed, tournaments, decks, player_stands_on):
+    """Прогон tournaments турниров; возвращает суммы для сведения итогов"""
+    rng = np.random.default_rng(seed)
+    count = tournaments * ROUNDS_PER_TOURNAMENT
+    player, dealer, outcome = play_rounds(rng, count, decks, player_stands_on)
+
+    player_points = np.zeros(count, dtype=np.int32)
+    dealer_points = np.zeros(count, dtype=np.int32)
+    for code, name in enumerate(OUTCOMES):
+        mask = outcome == code
+        player_points[mask], dealer_points[mask] = round_points(
+            name, player[mask], dealer[mask]
+        )
+
+    # Раунды турнира идут подряд: накопленный счет по строкам матрицы
+    player_total = player_points.reshape(tournaments, -1).cumsum(axis=1)
+    dealer_total = dealer_points.reshape(tournaments, -1).cumsum(axis=1)
+    finished = (player_total >= TOURNAMENT_TARGET) | (dealer_total >= TOURNAMENT_TARGET)
+    done = finished.any(axis=1)
+    last = finished.argmax(axis=1)
+    player_won = player_total[np.arange(tournaments), last] >= TOURNAMENT_TARGET
+
+    dealer_played = outcome != OUTCOMES.index("player_bust")
+    return {
+        "rounds": count,
+        "outcomes": np.bincount(outcome, minlength=len(OUTCOMES)),
+        "dealer_played": int(dealer_played.sum()),
+        "tournaments": int(done.sum()),
+        "unfinished": int((~done).sum()),
+        "player_tournaments": int((player_won & done).sum()),
+        "tournament_rounds": int((last[done] + 1).sum()),
+        "player_points": int(player_points.sum()),
+        "dealer_points": int(dealer_points.sum()),
+    }
+
+
+def merge(results):
+    total = {}
+    for result in results:
+        for key, value in result.items():
+            total[key] = total[key] + value if key in total else value
+    return total
+
+
+def report(total, seconds):
+    rounds = total["rounds"]
+    outcomes = dict(zip(OUTCOMES, total["outcomes"]))
+    share = lambda n, of=rounds: f"{n / of:.2%}" if of else "—"
+    player_wins = outcomes["player_wins"] + outcomes["dealer_bust"]
+    dealer_wins = outcomes["dealer_wins"] + outcomes["player_bust"]
+    tournaments = total["tournaments"]
+
+    print(f"Раундов: {rounds:,} за {seconds:.1f} с ({rounds / seconds:,.0f} в секунду)")
+    print(f"  победы игрока: {share(player_wins)}, победы дилера: {share(dealer_wins)}, "
+          f"ничьи: {share(outcomes['push'])}")
+    print(f"  перебор игрока: {share(outcomes['player_bust'])}, "
+          f"перебор дилера: {share(outcomes['dealer_bust'])} "
+          f"({share(outcomes['dealer_bust'], total['dealer_played'])} из раундов, где он добирал)")
+    print(f"  очков за раунд: игроку {total['player_points'] / rounds:.2f}, "
+          f"дилеру {total['dealer_points'] / rounds:.2f}")
+    print(f"Турниров до {TOURNAMENT_TARGET}: {tournaments:,}")
+    if tournaments:
+        print(f"  игрок выигрывает: {share(total['player_tournaments'], tournaments)}, "
+              f"средняя длина: {total['tournament_rounds'] / tournaments:.2f} раунда")
+    if total["unfinished"]:
+        print(f"  не уложились в {ROUNDS_PER_TOURNAMENT} раундов: {total['unfinished']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Монте-Карло для очка по правилам бота")
+    parser.add_argument("--tournaments", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--decks", type=int, default=1)
+    parser.add_argument(
+        "--player-stands-on", type=int, default=DEALER_STANDS_ON,
+        help="игрок берет карты, пока у него меньше (по умолчанию как дилер)",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    sizes = [CHUNK] * (args.tournaments // CHUNK)
+    if args.tournaments % CHUNK:
+        sizes.append(args.tournaments % CHUNK)
+    # Независимые потоки случайных чисел для каждой задачи из одного зерна
+    seeds = np.random.SeedSequence(args.seed).spawn(len(sizes))
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = pool.map(
+            simulate_chunk,
+            seeds,
+            sizes,
+            [args.decks] * len(sizes),
+            [args.player_stands_on] * len(sizes),
+        )
+        total = merge(results)
+    report(total, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
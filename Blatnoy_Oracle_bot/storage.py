@@ -0,0 +1,680 @@
+"""Хранилище состояния бота: словари в памяти с фоновой записью в базу"""
+
+import atexit
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+
+class StoredDict(MutableMapping):
+    """Словарь, который живет в памяти и сам сохраняет изменения в хранилище.
+
+    Запись не идет в базу при каждом обращении: ключ помечается "грязным",
+    а фоновый поток сбрасывает все грязные ключи одной пачкой.
+    Значения часто меняют на месте (game["player_hand"].append(...)), поэтому
+    при track_reads=True грязным считается и каждый прочитанный ключ.
+
+    Живые объекты фоновый поток не сериализует: ключи, тронутые внутри задачи
+    диспетчера (store.unit_of_work), снимаются в pickle в конце задачи, на том же
+    воркере, когда объект уже не меняется. Только ключи, тронутые вне задач
+    (запуск, планировщик), сериализуются при сбросе.
+    """
+
+    def __init__(self, store, namespace, default_factory=None, track_reads=False):
+        self.store = store
+        self.namespace = namespace
+        self.default_factory = default_factory
+        # Без сохранения (MemoryBackend) следить за изменениями незачем
+        self.persistent = store.backend.persistent
+        self.track_reads = track_reads and self.persistent
+        self._data = {}
+        self._dirty = {}  # key: снимок в pickle, _DELETED или None (снять при сбросе)
+        self._lock = threading.Lock()
+
+    def _touch(self, key):
+        if not self.persistent:
+            return
+        touched = self.store._current_touched()
+        if touched is not None:
+            # Снимок сделает конец задачи, а до тех пор старый снимок не нужен
+            touched[(self.namespace, key)] = self
+            return
+        with self._lock:
+            self._dirty[key] = None
+
+    def snapshot(self, key):
+        """Снимает текущее значение ключа в грязные (конец задачи, см. unit_of_work)"""
+        with self._lock:
+            value = self._data.get(key, _DELETED)
+            self._dirty[key] = value if value is _DELETED else pickle.dumps(value)
+
+    def __getitem__(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            if self.default_factory is None:
+                raise
+            value = self._data[key] = self.default_factory()
+            self._touch(key)
+            return value
+        if self.track_reads:
+            self._touch(key)
+        return value
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        return self[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._touch(key)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._touch(key)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"StoredDict({self.namespace!r}, {len(self)} keys)"
+
+    def values(self):
+        if self.track_reads:
+            for key in list(self._data):
+                self._touch(key)
+        return list(self._data.values())
+
+    def items(self):
+        if self.track_reads:
+            for key in list(self._data):
+                self._touch(key)
+        return list(self._data.items())
+
+    def take_dirty(self):
+        """Забирает накопленные изменения: [(ключ, pickle значения или _DELETED при удалении)]"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        changes = []
+        for key, blob in dirty.items():
+            if blob is None:
+                # Тронут вне задач диспетчера — снимаем последнее значение сейчас
+                value = self._data.get(key, _DELETED)
+                blob = value if value is _DELETED else pickle.dumps(value)
+            changes.append((key, blob))
+        return changes
+
+    def incr(self, key, amount=1):
+        """Атомарно увеличивает числовое значение ключа и возвращает новое"""
+        with self._lock:
+            value = self._data.get(key, 0) + amount
+            self._data[key] = value
+        self._touch(key)
+        return value
+
+    def mark_dirty(self, changes):
+        """Возвращает изменения в грязные (например, если запись не удалась);
+        более новые снимки тех же ключей остаются"""
+        with self._lock:
+            for key, blob in changes:
+                self._dirty.setdefault(key, blob)
+
+    def load(self, items):
+        """Заполняет словарь значениями из хранилища, не помечая их грязными"""
+        self._data.update(items)
+
+
+# Метка удаленного ключа в пачке изменений
+_DELETED = object()
+
+
+class SharedDict(MutableMapping):
+    """Словарь, который живет в общем хранилище (Redis) и виден всем репликам бота.
+
+    Внутри задачи диспетчера (store.unit_of_work) прочитанные значения кешируются
+    в потоке: изменения на месте видны до конца задачи, а в конце все тронутые
+    ключи одной пачкой пишутся обратно. Вне задачи каждое чтение идет в хранилище,
+    а запись сразу уходит туда же. Между репликами действует "последняя запись побеждает".
+    """
+
+    def __init__(self, store, namespace, default_factory=None, track_reads=False):
+        self.store = store
+        self.namespace = namespace
+        self.default_factory = default_factory
+        self.track_reads = track_reads
+        self.backend = store.backend
+
+    def _load(self, key):
+        """Значение ключа (или _DELETED): сначала из кеша задачи, потом из хранилища"""
+        unit = self.store._current_unit()
+        if unit is not None and (self.namespace, key) in unit:
+            return unit[(self.namespace, key)]
+
+        value = self.backend.get(self.namespace, key)
+        if unit is not None and value is not _DELETED:
+            unit[(self.namespace, key)] = value
+            if self.track_reads:
+                self.store._mark(self.namespace, key)
+        return value
+
+    def __getitem__(self, key):
+        value = self._load(key)
+        if value is _DELETED:
+            if self.default_factory is None:
+                raise KeyError(key)
+            value = self.default_factory()
+            self._write(key, value)
+        return value
+
+    def get(self, key, default=None):
+        value = self._load(key)
+        return default if value is _DELETED else value
+
+    def _write(self, key, value):
+        unit = self.store._current_unit()
+        if unit is None:
+            self.backend.write_shared([(self.namespace, key, value)])
+        else:
+            unit[(self.namespace, key)] = value
+            self.store._mark(self.namespace, key)
+
+    def __setitem__(self, key, value):
+        self._write(key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._write(key, _DELETED)
+
+    def __contains__(self, key):
+        unit = self.store._current_unit()
+        if unit is not None and (self.namespace, key) in unit:
+            return unit[(self.namespace, key)] is not _DELETED
+        return self.backend.exists(self.namespace, key)
+
+    def __iter__(self):
+        return iter(self.backend.keys(self.namespace))
+
+    def __len__(self):
+        return self.backend.length(self.namespace)
+
+    def __repr__(self):
+        return f"SharedDict({self.namespace!r})"
+
+    def values(self):
+        return [value for _, value in self.backend.items(self.namespace)]
+
+    def items(self):
+        return self.backend.items(self.namespace)
+
+    def incr(self, key, amount=1):
+        """Атомарно увеличивает числовое значение ключа и возвращает новое"""
+        value = self.backend.incr(self.namespace, key, amount)
+        unit = self.store._current_unit()
+        if unit is not None and (self.namespace, key) in unit:
+            # Иначе запись кеша задачи в конце затрет прибавку старым значением
+            unit[(self.namespace, key)] = value
+        return value
+
+
+class SharedCounters:
+    """Записи из целых счетчиков в общем хранилище (Redis) и упорядоченный индекс по ним.
+
+    Запись — свой хеш <prefix>:<ns>:<ключ>, поле — имя счетчика. Прибавки идут
+    HINCRBY, поэтому реплики и воркеры не затирают изменения друг друга.
+    Индекс — sorted set <prefix>:<ns>:rank: меньший счет выше, при равном счете
+    выше меньший ключ. Место ищется ZRANK за O(log n), начало — ZRANGE.
+    Ключи — неотрицательные целые (user_id): в индексе они дополнены нулями,
+    чтобы строковый порядок совпадал с числовым.
+    """
+
+    def __init__(self, backend, namespace):
+        self.backend = backend
+        self.client = backend.client
+        self.namespace = namespace
+        self._index = f"{backend.prefix}:{namespace}:rank"
+
+    @staticmethod
+    def _member(key):
+        return f"{key:020d}"
+
+    def _record(self, member):
+        return f"{self.backend.prefix}:{self.namespace}:{member}"
+
+    @staticmethod
+    def _decode(raw):
+        return {field.decode(): int(value) for field, value in raw.items()}
+
+    def __len__(self):
+        return self.client.zcard(self._index)
+
+    def get(self, key):
+        """Счетчики записи {поле: значение} или None, если записи нет"""
+        raw = self.client.hgetall(self._record(self._member(key)))
+        return self._decode(raw) if raw else None
+
+    def incr(self, key, amounts, score=0):
+        """Атомарно прибавляет amounts {поле: число} к записи и score к ее счету
+        в индексе (одна транзакция MULTI). Возвращает новые значения записи."""
+        member = self._member(key)
+        record = self._record(member)
+        with self.client.pipeline() as pipe:
+            for field, amount in amounts.items():
+                pipe.hincrby(record, field, amount)
+            pipe.zincrby(self._index, score, member)
+            pipe.hgetall(record)
+            return self._decode(pipe.execute()[-1])
+
+    def rank(self, key):
+        """Место записи в индексе (с 0) или None"""
+        return self.client.zrank(self._index, self._member(key))
+
+    def top(self, count):
+        """[(ключ, счетчики)] первых count записей индекса"""
+        members = self.client.zrange(self._index, 0, count - 1)
+        if not members:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        for member in members:
+            pipe.hgetall(self._record(member.decode()))
+        return [
+            (int(member), self._decode(raw)) for member, raw in zip(members, pipe.execute())
+        ]
+
+
+class SharedUniques:
+    """Оценка уникальных по дням в общем хранилище: HyperLogLog самого Redis.
+
+    День — ключ <prefix>:<ns>:<день>. PFADD меняет регистры на сервере, поэтому
+    реплики не затирают отметки друг друга, а по сети идет только сам элемент.
+    Ключ живет keep_days суток после последней отметки.
+    """
+
+    def __init__(self, backend, namespace, keep_days=30):
+        self.client = backend.client
+        self.prefix = f"{backend.prefix}:{namespace}"
+        self.keep_days = keep_days
+
+    def add(self, day, item):
+        key = f"{self.prefix}:{day}"
+        pipe = self.client.pipeline(transaction=False)
+        pipe.pfadd(key, item)
+        pipe.expire(key, self.keep_days * 86400)
+        pipe.execute()
+
+    def count(self, day):
+        return self.client.pfcount(f"{self.prefix}:{day}")
+
+
+class MemoryBackend:
+    """Хранилище без сохранения: все живет только в памяти процесса"""
+
+    persistent = False
+    shared = False
+
+    def load_dict(self, namespace):
+        return []
+
+    def load_log(self, namespace):
+        return []
+
+    def write(self, dict_changes):
+        pass
+
+    def checkpoint(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """Хранилище в SQLite: WAL, пачечная запись одной транзакцией, периодический checkpoint"""
+
+    persistent = True
+    shared = False
+
+    # Тексты запросов не меняются — sqlite3 держит их скомпилированными в кеше соединения
+    UPSERT_SQL = "INSERT OR REPLACE INTO kv (ns, key, value) VALUES (?, ?, ?)"
+    DELETE_SQL = "DELETE FROM kv WHERE ns = ? AND key = ?"
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, cached_statements=64
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # При WAL режим NORMAL не теряет целостность, но не делает fsync на каждый коммит
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "ns TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (ns, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS log ("
+            "ns TEXT NOT NULL, seq INTEGER NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (ns, seq))"
+        )
+
+    def load_dict(self, namespace):
+        rows = self._conn.execute(
+            "SELECT key, value FROM kv WHERE ns = ?", (namespace,)
+        ).fetchall()
+        return [(json.loads(key), pickle.loads(value)) for key, value in rows]
+
+    def load_log(self, namespace):
+        """Записи лога из прошлых версий (история турниров до history.py)"""
+        rows = self._conn.execute(
+            "SELECT value FROM log WHERE ns = ? ORDER BY seq", (namespace,)
+        ).fetchall()
+        return [pickle.loads(value) for (value,) in rows]
+
+    def write(self, dict_changes):
+        """Пишет пачку (ns, ключ, pickle значения или _DELETED) одной транзакцией"""
+        upserts = []
+        deletes = []
+        for namespace, key, value in dict_changes:
+            encoded_key = json.dumps(key)
+            if value is _DELETED:
+                deletes.append((namespace, encoded_key))
+            else:
+                upserts.append((namespace, encoded_key, value))
+
+        self._conn.execute("BEGIN")
+        try:
+            if upserts:
+                self._conn.executemany(self.UPSERT_SQL, upserts)
+            if deletes:
+                self._conn.executemany(self.DELETE_SQL, deletes)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def checkpoint(self):
+        # PASSIVE не ждет читателей и не блокирует запись
+        self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        self._conn.close()
+
+
+class RedisBackend:
+    """Общее хранилище в Redis: несколько реплик бота видят одни и те же игры.
+
+    Каждое пространство имен — хеш oracle:<ns>, поле — ключ в JSON, значение — pickle.
+    Целые числа пишутся десятичной строкой, как их хранит HINCRBY: тогда incr и
+    обычные чтение и запись работают с одним и тем же ключом.
+    Годится любой сервер, говорящий на протоколе Redis (Redis, KeyDB, Valkey).
+    """
+
+    persistent = True
+    shared = True
+
+    def __init__(self, url, prefix="oracle"):
+        # Зависимость нужна только в этом режиме, поэтому импортируем здесь
+        import redis
+
+        self.url = url
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+
+    @classmethod
+    def from_client(cls, client, prefix="oracle"):
+        """Создает хранилище поверх готового клиента (например, fakeredis)"""
+        backend = cls.__new__(cls)
+        backend.url = None
+        backend.prefix = prefix
+        backend.client = client
+        return backend
+
+    def _hash(self, namespace):
+        return f"{self.prefix}:{namespace}"
+
+    def _list(self, namespace):
+        return f"{self.prefix}:log:{namespace}"
+
+    @staticmethod
+    def _dumps(value):
+        if type(value) is int:
+            return str(value).encode()
+        return pickle.dumps(value)
+
+    @staticmethod
+    def _loads(raw):
+        # pickle (протокол 2+) всегда начинается с байта PROTO 0x80, число — нет
+        if raw[:1] == b"\x80":
+            return pickle.loads(raw)
+        return int(raw)
+
+    def get(self, namespace, key):
+        value = self.client.hget(self._hash(namespace), json.dumps(key))
+        return _DELETED if value is None else self._loads(value)
+
+    def exists(self, namespace, key):
+        return bool(self.client.hexists(self._hash(namespace), json.dumps(key)))
+
+    def keys(self, namespace):
+        return [json.loads(key) for key in self.client.hkeys(self._hash(namespace))]
+
+    def items(self, namespace):
+        return [
+            (json.loads(key), self._loads(value))
+            for key, value in self.client.hgetall(self._hash(namespace)).items()
+        ]
+
+    def length(self, namespace):
+        return self.client.hlen(self._hash(namespace))
+
+    def incr(self, namespace, key, amount=1):
+        import redis
+
+        name, field = self._hash(namespace), json.dumps(key)
+        try:
+            return self.client.hincrby(name, field, amount)
+        except redis.ResponseError:
+            # Число, записанное pickle-ом в старой версии: переписываем строкой в транзакции
+            with self.client.pipeline() as pipe:
+                while True:
+                    try:
+                        pipe.watch(name)
+                        raw = pipe.hget(name, field)
+                        value = (0 if raw is None else self._loads(raw)) + amount
+                        pipe.multi()
+                        pipe.hset(name, field, self._dumps(value))
+                        pipe.execute()
+                        return value
+                    except redis.WatchError:
+                        continue
+
+    def write_shared(self, changes):
+        """Пишет пачку изменений одним конвейером (один сетевой круг)"""
+        pipe = self.client.pipeline(transaction=False)
+        for namespace, key, value in changes:
+            if value is _DELETED:
+                pipe.hdel(self._hash(namespace), json.dumps(key))
+            else:
+                pipe.hset(self._hash(namespace), json.dumps(key), self._dumps(value))
+        pipe.execute()
+
+    def read_log(self, namespace):
+        """Записи лога из прошлых версий (история турниров до history.py)"""
+        return [pickle.loads(item) for item in self.client.lrange(self._list(namespace), 0, -1)]
+
+    def load_dict(self, namespace):
+        return []
+
+    def load_log(self, namespace):
+        return []
+
+    def write(self, dict_changes):
+        pass
+
+    def checkpoint(self):
+        pass
+
+    def close(self):
+        self.client.close()
+
+
+class StateStore:
+    """Набор сохраняемых словарей с общим фоновым сбросом в хранилище"""
+
+    def __init__(self, backend, flush_interval=1.0, checkpoint_every=60):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.checkpoint_every = checkpoint_every
+        self._dicts = []
+        self._flush_lock = threading.Lock()
+        self._flushes = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._local = threading.local()
+
+    @property
+    def shared(self):
+        """Живет ли состояние в общем хранилище, которое видят другие реплики"""
+        return self.backend.shared
+
+    def dict(self, namespace, default_factory=None, track_reads=False):
+        """Создает сохраняемый словарь и загружает в него сохраненные данные"""
+        if self.shared:
+            return SharedDict(self, namespace, default_factory, track_reads)
+        stored = StoredDict(self, namespace, default_factory, track_reads)
+        stored.load(self.backend.load_dict(namespace))
+        self._dicts.append(stored)
+        return stored
+
+    def counters(self, namespace):
+        """Записи из счетчиков с индексом для общего хранилища (см. SharedCounters)"""
+        if not self.shared:
+            raise ValueError("Счетчики с индексом есть только у общего хранилища")
+        return SharedCounters(self.backend, namespace)
+
+    def uniques(self, namespace, keep_days=30):
+        """Уникальные по дням для общего хранилища (см. SharedUniques)"""
+        if not self.shared:
+            raise ValueError("HyperLogLog Redis есть только у общего хранилища")
+        return SharedUniques(self.backend, namespace, keep_days)
+
+    def _current_unit(self):
+        return getattr(self._local, "unit", None)
+
+    def _mark(self, namespace, key):
+        self._local.touched.add((namespace, key))
+
+    def _current_touched(self):
+        """Тронутые задачей ключи локальных словарей {(ns, ключ): словарь} или None вне задачи"""
+        return getattr(self._local, "stored_touched", None)
+
+    @contextmanager
+    def unit_of_work(self):
+        """Оборачивает обработку одного апдейта.
+
+        Для общего хранилища в начале заводится кеш прочитанных значений потока,
+        а в конце все тронутые ключи пишутся обратно одной пачкой. Для локальных
+        сохраняемых хранилищ в конце задачи тронутые ключи снимаются в pickle —
+        фоновый поток запишет эти снимки, а не объекты, которые меняют воркеры.
+        """
+        if not self.shared:
+            if not self.backend.persistent or self._current_touched() is not None:
+                yield
+                return
+            self._local.stored_touched = touched = {}
+            try:
+                yield
+            finally:
+                self._local.stored_touched = None
+                for (_, key), stored in touched.items():
+                    stored.snapshot(key)
+            return
+
+        if self._current_unit() is not None:
+            yield
+            return
+
+        self._local.unit = unit = {}
+        self._local.touched = touched = set()
+        try:
+            yield
+        finally:
+            self._local.unit = None
+            if touched:
+                self.backend.write_shared(
+                    [(namespace, key, unit[(namespace, key)]) for namespace, key in touched]
+                )
+
+    def start(self):
+        """Запускает фоновый поток записи"""
+        if self._thread or self.shared:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="state-flusher", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def flush(self):
+        """Сбрасывает все накопленные изменения одной транзакцией"""
+        with self._flush_lock:
+            dict_changes = []
+            taken = []
+            for stored in self._dicts:
+                changes = stored.take_dirty()
+                taken.append((stored, changes))
+                dict_changes.extend(
+                    (stored.namespace, key, value) for key, value in changes
+                )
+            if not dict_changes:
+                return
+
+            try:
+                self.backend.write(dict_changes)
+            except Exception as e:
+                # Ничего не теряем: вернем изменения и попробуем на следующем круге
+                print(f"Ошибка сохранения состояния: {e}")
+                for stored, changes in taken:
+                    stored.mark_dirty(changes)
+                return
+
+            self._flushes += 1
+            if self._flushes % self.checkpoint_every == 0:
+                self.backend.checkpoint()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Останавливает фоновый поток и дописывает последние изменения"""
+        self._stop.set()
+        self.flush()
+        self.backend.checkpoint()
+
+
+def open_store(backend=None, path=None, flush_interval=None):
+    """Создает хранилище по настройкам из переменных окружения"""
+    backend = (backend or os.getenv("STATE_BACKEND", "memory")).lower()
+    flush_interval = flush_interval or float(os.getenv("STATE_FLUSH_INTERVAL", "1.0"))
+
+    if backend == "sqlite":
+        path = path or os.getenv("STATE_DB_PATH", "oracle_state.db")
+        return StateStore(SQLiteBackend(path), flush_interval=flush_interval)
+    if backend == "redis":
+        url = path or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        return StateStore(RedisBackend(url))
+    if backend == "memory":
+        return StateStore(MemoryBackend(), flush_interval=flush_interval)
+    raise ValueError(f"Неизвестный STATE_BACKEND: {backend}")
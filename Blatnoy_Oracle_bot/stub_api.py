@@ -0,0 +1,112 @@
+"""Локальная заглушка Bot API для проверок и замеров без Telegram.
+
+Отвечает {"ok": true, ...} на любые методы: sendMessage и editMessageText
+возвращают правдоподобное сообщение, getUpdates — пустой список, остальное —
+true. Держит keep-alive (HTTP/1.1), может добавлять задержку ответа.
+
+Запуск:  python stub_api.py [--port 8081] [--latency 0.05]
+Бот:     TELEGRAM_API_URL=http://127.0.0.1:8081 TELEGRAM_TOKEN=1:stub python bot.py
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Иначе соединение закрывается после каждого ответа
+    # Заголовки и тело уходят отдельными пакетами; без этого keep-alive упирается
+    # в задержанный ACK и каждый ответ ждет ~40 мс
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _params(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length).decode("utf-8", "replace")
+            params.update({key: values[0] for key, values in parse_qs(body).items()})
+        return url.path.rsplit("/", 1)[-1], params
+
+    def _result(self, method, params):
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id") or 0)
+            return {
+                "message_id": int(params.get("message_id") or next(self.server.message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "stub", "username": "stub_bot"}
+        if method == "getUpdates":
+            return []
+        return True
+
+    def _handle(self):
+        method, params = self._params()
+        self.server.calls.append((method, params))
+        if method == "getUpdates":
+            # Изображаем long polling, чтобы поллинг бота не крутился вхолостую
+            time.sleep(min(float(params.get("timeout") or 0), 1.0))
+        elif self.server.latency:
+            time.sleep(self.server.latency)
+        data = json.dumps({"ok": True, "result": self._result(method, params)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = _handle
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, history=10_000):
+        super().__init__((host, port), StubHandler)
+        self.latency = latency
+        self.calls = deque(maxlen=history)  # (метод, параметры) последних запросов
+        self.message_ids = itertools.count(1)
+        self.connections = 0  # Сколько TCP-соединений открыли клиенты
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Запускает сервер в фоновом потоке и возвращает его адрес"""
+        threading.Thread(target=self.serve_forever, name="stub-api", daemon=True).start()
+        return self.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунды")
+    args = parser.parse_args()
+
+    server = StubServer(args.host, args.port, args.latency)
+    print(f"Заглушка Bot API на {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
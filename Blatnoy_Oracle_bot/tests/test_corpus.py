@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+from corpus import load_corpus
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "corpus.json")
+
+
+@pytest.fixture(scope="module")
+def texts():
+    return load_corpus(CORPUS_PATH)
+
+
+@pytest.mark.parametrize(
+    "question",
+    ["Когда? Почему так вышло", "почему кому-то везет", "Почему вам так"],
+)
+def test_exact_keyword_wins_over_normalized(texts, question):
+    # Тот же поиск, что в process_question: вопрос и его нормализованный вид
+    normalized = texts.normalizer.normalize(question)
+    assert texts.keyword(question, normalized) == "почему"
+    assert texts.answer(question, normalized) in texts.answers["почему"]
+
+
+def test_normalized_lookup_still_finds_misses(texts):
+    question = "Кем я стану?"
+    assert texts.matcher.find(question.lower()) is None
+    assert texts.keyword(question) == "кого"
@@ -0,0 +1,62 @@
+"""Рейтинг в памяти и в общем хранилище (fakeredis) должен совпадать"""
+
+import random
+import threading
+
+import pytest
+
+from leaderboard import PlayerStats, StatsEngine
+from storage import MemoryBackend, StateStore
+
+RESULTS = ("player_wins", "dealer_bust", "dealer_wins", "player_bust", "surrender", "push")
+
+
+@pytest.fixture
+def shared_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    from storage import RedisBackend
+
+    return StateStore(RedisBackend.from_client(fakeredis.FakeRedis()))
+
+
+def play(engine, rng, players=40, events=600):
+    for _ in range(events):
+        user_id = rng.randrange(1, players + 1)
+        if rng.random() < 0.1:
+            engine.record_tournament(user_id, rng.choice(("player", "dealer")))
+        else:
+            engine.record_round(user_id, rng.choice(RESULTS), rng.randrange(4, 27))
+
+
+def test_shared_rank_matches_local(shared_store):
+    local = StatsEngine(StateStore(MemoryBackend()).dict("player_stats"))
+    shared = StatsEngine(shared_store.counters("player_stats"), shared=True)
+    play(local, random.Random(1))
+    play(shared, random.Random(1))
+
+    assert len(shared) == len(local)
+    assert shared.top(100) == local.top(100)
+    for user_id in range(0, 42):
+        assert shared.rank(user_id) == local.rank(user_id)
+        assert shared.get(user_id) == local.get(user_id)
+    assert shared.get(0) is None and shared.rank(0) is None
+
+
+def test_shared_updates_are_not_lost(shared_store):
+    # Две "реплики" поверх одного хранилища пишут одновременно
+    engines = [StatsEngine(shared_store.counters("player_stats"), shared=True) for _ in range(2)]
+
+    def worker(engine):
+        for _ in range(200):
+            engine.record_round(7, "player_wins", 20)
+            engine.record_tournament(7, "player")
+
+    threads = [threading.Thread(target=worker, args=(engine,)) for engine in engines * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = engines[0].get(7)
+    assert stats == PlayerStats(rounds=800, wins=800, hand_total=16000, tournaments_won=800)
+    assert engines[1].top(1) == [(1, 7, stats)]
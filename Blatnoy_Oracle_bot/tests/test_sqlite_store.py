@@ -0,0 +1,85 @@
+"""Локальное хранилище в SQLite: фоновый сброс пишет снимки с конца задач"""
+
+import threading
+
+import pytest
+
+from storage import SQLiteBackend, StateStore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+def reopen(path, namespace):
+    backend = SQLiteBackend(path)
+    try:
+        return dict(backend.load_dict(namespace))
+    finally:
+        backend.close()
+
+
+def test_flush_writes_snapshot_from_end_of_task(db_path):
+    store = StateStore(SQLiteBackend(db_path))
+    games = store.dict("games", track_reads=True)
+    with store.unit_of_work():
+        games["g1"] = {"hand": ["6♥"]}
+        games["g1"]["hand"].append("Т♠")
+
+    # Следующая задача еще меняет объект, а фоновый поток уже сбрасывает
+    with store.unit_of_work():
+        hand = games["g1"]["hand"]
+        hand.append("В♦")
+        store.flush()
+        hand.append("Д♣")
+    assert reopen(db_path, "games") == {"g1": {"hand": ["6♥", "Т♠"]}}
+
+    store.flush()
+    assert reopen(db_path, "games") == {"g1": {"hand": ["6♥", "Т♠", "В♦", "Д♣"]}}
+
+
+def test_changes_outside_tasks_and_deletes(db_path):
+    store = StateStore(SQLiteBackend(db_path))
+    names = store.dict("user_names")
+    names[1] = "@vasya"
+    names[2] = "@petya"
+    store.flush()
+    with store.unit_of_work():
+        del names[1]
+    store.flush()
+    assert reopen(db_path, "user_names") == {2: "@petya"}
+
+
+def test_failed_write_keeps_snapshots(db_path, monkeypatch):
+    store = StateStore(SQLiteBackend(db_path))
+    games = store.dict("games", track_reads=True)
+    with store.unit_of_work():
+        games["g1"] = {"hand": ["6♥"]}
+
+    def broken(changes):
+        raise OSError("диск")
+
+    monkeypatch.setattr(store.backend, "write", broken)
+    store.flush()
+    monkeypatch.undo()
+    store.flush()
+    assert reopen(db_path, "games") == {"g1": {"hand": ["6♥"]}}
+
+
+def test_incr_from_parallel_tasks(db_path):
+    store = StateStore(SQLiteBackend(db_path))
+    counters = store.dict("counters")
+
+    def worker():
+        for _ in range(500):
+            with store.unit_of_work():
+                counters.incr("tournaments")
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.flush()
+    assert reopen(db_path, "counters") == {"tournaments": 2000}
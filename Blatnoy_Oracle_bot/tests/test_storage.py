@@ -0,0 +1,87 @@
+"""Общее хранилище поверх fakeredis: те же хеши и команды, что у настоящего Redis.
+
+fakeredis ставится из requirements-dev.txt.
+"""
+
+import pickle
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from storage import RedisBackend, StateStore  # noqa: E402
+
+
+@pytest.fixture
+def store():
+    return StateStore(RedisBackend.from_client(fakeredis.FakeRedis()))
+
+
+def test_get_set_items_pop(store):
+    games = store.dict("games")
+    games["g1"] = {"hand": ["6♥", "Т♠"], "bet": 50}
+    games[42] = 7
+
+    assert games["g1"] == {"hand": ["6♥", "Т♠"], "bet": 50}
+    assert games.get(42) == 7
+    assert games.get("missing") is None
+    assert "g1" in games and "missing" not in games
+    assert dict(games.items()) == {42: 7, "g1": {"hand": ["6♥", "Т♠"], "bet": 50}}
+    assert len(games) == 2
+
+    assert games.pop("g1")["bet"] == 50
+    assert "g1" not in games
+    with pytest.raises(KeyError):
+        del games["g1"]
+
+
+def test_incr_and_plain_access_share_a_key(store):
+    counters = store.dict("counters")
+    assert counters.incr("game") == 1
+    assert counters.incr("game", 4) == 5
+    assert counters["game"] == 5
+
+    counters["tournaments"] = 10
+    assert counters.incr("tournaments") == 11
+    assert counters.get("tournaments") == 11
+    assert dict(counters.items()) == {"game": 5, "tournaments": 11}
+
+
+def test_incr_converts_pickled_number(store):
+    # Так писала число прошлая версия бэкенда — HINCRBY по нему падает
+    store.backend.client.hset("oracle:counters", '"game"', pickle.dumps(3))
+    counters = store.dict("counters")
+    assert counters.incr("game") == 4
+    assert counters.incr("game") == 5
+    assert counters["game"] == 5
+
+
+def test_unit_of_work_keeps_incr(store):
+    counters = store.dict("counters")
+    counters["game"] = 1
+    with store.unit_of_work():
+        assert counters["game"] == 1
+        counters.incr("game")
+        assert counters["game"] == 2
+    assert counters["game"] == 2
+
+
+def test_unit_of_work_writes_back_in_place_changes(store):
+    games = store.dict("games", track_reads=True)
+    games["g1"] = {"hand": []}
+    with store.unit_of_work():
+        games["g1"]["hand"].append("Т♠")
+        # Внутри задачи изменение видно, в Redis еще старое значение
+        assert store.backend.get("games", "g1") == {"hand": []}
+    assert games["g1"] == {"hand": ["Т♠"]}
+
+
+def test_uniques_from_two_replicas_add_up(store):
+    # У каждой реплики свой объект, регистры общие — в Redis
+    replicas = [store.uniques("daily_uniques"), store.uniques("daily_uniques")]
+    for user_id in range(1000):
+        replicas[user_id % 2].add("2024-05-01", user_id)
+        replicas[0].add("2024-05-01", user_id)
+    assert abs(replicas[1].count("2024-05-01") - 1000) <= 20
+    assert replicas[0].count("2024-05-02") == 0
+    assert store.backend.client.ttl("oracle:daily_uniques:2024-05-01") > 0
@@ -0,0 +1,128 @@
+"""HTTP-транспорт для запросов бота к Telegram.
+
+По умолчанию telebot заводит по requests.Session на каждый поток. Здесь одна
+общая сессия с пулом keep-alive соединений на все потоки: отправители очереди
+и поллинг берут уже открытые соединения и не платят за TLS-рукопожатие на
+каждом всплеске. Размер пула равен числу потоков, которые ходят в API, —
+тогда никто не открывает лишних соединений и не ждет свободного.
+
+Таймауты раздельные: соединение должно устанавливаться быстро, а ответ на
+getUpdates при long polling приходит через десятки секунд.
+
+Транспорт встает в apihelper.CUSTOM_REQUEST_SENDER и замеряет время каждого
+запроса (кроме getUpdates, который по замыслу висит) — p50/p99 видны в /status.
+Адрес API можно подменить (TELEGRAM_API_URL), например на stub_api.py.
+
+С реестром metrics транспорт еще пишет гистограмму времени и счетчик ошибок по
+методу API (сюда входит и getUpdates — по метке его легко отделить).
+"""
+
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+# Запросы, время которых не говорит о скорости отправки
+UNTIMED_METHODS = ("getUpdates",)
+
+
+def percentile(ordered, fraction):
+    """Значение из отсортированного списка, ниже которого доля fraction замеров"""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(len(ordered) * fraction))
+    return ordered[index]
+
+
+class TelegramTransport:
+    """Общая сессия с пулом соединений и замером задержек"""
+
+    def __init__(
+        self,
+        pool_size=8,
+        connect_timeout=3.05,
+        read_timeout=30.0,
+        api_url=None,
+        samples=1024,
+        metrics=None,
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.api_url = api_url
+        self.session = requests.Session()
+        # Хост один (api.telegram.org), поэтому пул один; pool_block — не открывать
+        # соединений сверх пула, а подождать освободившееся
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.requests = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=samples)  # Секунды последних запросов
+        self._lock = threading.Lock()
+
+        self._seconds = self._errors = None
+        if metrics is not None:
+            self._seconds = metrics.histogram(
+                "oracle_telegram_request_seconds", "Время запроса к Bot API", ("method",)
+            )
+            self._errors = metrics.counter(
+                "oracle_telegram_errors_total",
+                "Запросы к Bot API с ошибкой сети или HTTP-статусом 4xx/5xx",
+                ("method",),
+            )
+
+    def install(self):
+        """Подключает транспорт ко всем запросам telebot"""
+        apihelper.CONNECT_TIMEOUT = self.connect_timeout
+        apihelper.READ_TIMEOUT = self.read_timeout
+        if self.api_url:
+            apihelper.API_URL = self.api_url.rstrip("/") + "/bot{0}/{1}"
+        apihelper.CUSTOM_REQUEST_SENDER = self.request
+        return self
+
+    def request(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        """Подпись как у CUSTOM_REQUEST_SENDER; timeout приходит парой (connect, read)"""
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(
+                method, url, params=params, files=files, timeout=timeout, proxies=proxies
+            )
+            failed = response.status_code >= 400
+            return response
+        except requests.RequestException:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.requests += 1
+                if not url.endswith(UNTIMED_METHODS):
+                    self._latencies.append(elapsed)
+            if self._seconds is not None:
+                api_method = url.rsplit("/", 1)[-1]
+                self._seconds.observe(elapsed, api_method)
+                if failed:
+                    self._errors.inc(api_method)
+
+    def stats(self):
+        with self._lock:
+            ordered = sorted(self._latencies)
+            requests_made, errors = self.requests, self.errors
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+
+        return {
+            "pool_size": self.pool_size,
+            "requests": requests_made,
+            "errors": errors,
+            "p50_ms": ms(percentile(ordered, 0.50)),
+            "p99_ms": ms(percentile(ordered, 0.99)),
+        }